@@ -0,0 +1,221 @@
+import os
+import json
+import math
+import logging
+from collections import defaultdict, namedtuple
+from datetime import date, datetime, timedelta
+from sqlalchemy.orm import aliased
+from app import db
+from models import Client, TransitionStatut, AgregatWorkflowJour, ScanCheckpoint, WorkflowStatus
+from workflow import WORKFLOW_STEPS
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_BATCH_SIZE = int(os.environ.get('ANALYTICS_BATCH_SIZE', 5000))
+CHECKPOINT_NAME = 'analytics'
+# Les identifiants sont attribués à l'insertion, pas au commit : une transaction longue peut valider une
+# transition d'id inférieur au point de reprise. Les transitions récentes non agrégées sont donc relues.
+ANALYTICS_SAFETY_WINDOW = timedelta(minutes=int(os.environ.get('ANALYTICS_SAFETY_WINDOW_MINUTES', 15)))
+
+# Histogramme des durées : classes logarithmiques de rapport racine de 2, à partir d'une minute
+# (42 classes couvrent jusqu'à environ deux ans). Les histogrammes s'additionnent d'un jour à l'autre,
+# ce qui permet d'estimer médiane et p90 sur n'importe quelle période sans relire les événements.
+HISTOGRAM_BASE_SECONDS = 60
+HISTOGRAM_BUCKETS = 42
+
+_STATUS_ORDER = sorted(WORKFLOW_STEPS, key=lambda status: WORKFLOW_STEPS[status].ordinal)
+
+StepStats = namedtuple('StepStats', ['status', 'sorties', 'moyenne', 'mediane', 'p90'])
+FunnelStep = namedtuple('FunnelStep', ['status', 'entrees', 'taux'])
+AdvisorStats = namedtuple('AdvisorStats', ['conseiller', 'transitions', 'termines'])
+
+
+def bucket_index(seconds):
+    if seconds <= HISTOGRAM_BASE_SECONDS:
+        return 0
+    return min(HISTOGRAM_BUCKETS - 1, math.ceil(2 * math.log2(seconds / HISTOGRAM_BASE_SECONDS)))
+
+
+def bucket_value(index):
+    """Valeur représentative d'une classe (milieu géométrique)"""
+    return HISTOGRAM_BASE_SECONDS * 2 ** ((2 * index - 1) / 4)
+
+
+def histogram_percentile(histogram, q):
+    total = sum(histogram)
+    if not total:
+        return None
+    rank = q * total
+    cumulative = 0
+    for index, count in enumerate(histogram):
+        cumulative += count
+        if cumulative >= rank:
+            return bucket_value(index)
+    return bucket_value(len(histogram) - 1)
+
+
+def _merge_histograms(target, source):
+    if len(target) < len(source):
+        target.extend([0] * (len(source) - len(target)))
+    for index, count in enumerate(source):
+        target[index] += count
+    return target
+
+
+def _aggregate(events):
+    """Agrège un lot d'événements (ligne, date du statut précédent) par (jour, statut, conseiller)"""
+    totals = defaultdict(lambda: {'entrees': 0, 'sorties': 0, 'duree_totale': 0.0, 'histogramme': []})
+    for event, previous_date in events:
+        day = event.date_transition.date()
+        advisor = event.conseiller or ''
+        totals[(day, event.statut.name, advisor)]['entrees'] += 1
+        if event.statut_precedent is not None and previous_date is not None:
+            seconds = max(0.0, (event.date_transition - previous_date).total_seconds())
+            bucket = totals[(day, event.statut_precedent.name, advisor)]
+            bucket['sorties'] += 1
+            bucket['duree_totale'] += seconds
+            histogram = [0] * (bucket_index(seconds) + 1)
+            histogram[-1] = 1
+            _merge_histograms(bucket['histogramme'], histogram)
+    return totals
+
+
+def _apply_totals(totals):
+    days = {day for day, _, _ in totals}
+    existing = {(row.jour, row.statut, row.conseiller): row for row in
+                AgregatWorkflowJour.query.filter(AgregatWorkflowJour.jour.in_(days)).all()}
+    for key, values in totals.items():
+        row = existing.get(key)
+        if row is None:
+            row = AgregatWorkflowJour(jour=key[0], statut=key[1], conseiller=key[2],
+                                      entrees=0, sorties=0, duree_totale=0, histogramme='[]')
+            db.session.add(row)
+        row.entrees += values['entrees']
+        row.sorties += values['sorties']
+        row.duree_totale += values['duree_totale']
+        row.histogramme = json.dumps(_merge_histograms(json.loads(row.histogramme), values['histogramme']))
+
+
+def rollup_transitions(batch_size=ANALYTICS_BATCH_SIZE):
+    """Intègre aux agrégats quotidiens les transitions non encore agrégées : celles au-delà du point de reprise
+    et celles de la fenêtre de sécurité en deçà (validées en retard) ; chacune n'est comptée qu'une fois"""
+    checkpoint = db.session.get(ScanCheckpoint, CHECKPOINT_NAME)
+    if checkpoint is None:
+        checkpoint = ScanCheckpoint(nom=CHECKPOINT_NAME, date_execution=datetime.utcnow(), dernier_id=0)
+        db.session.add(checkpoint)
+    safety_since = checkpoint.date_execution - ANALYTICS_SAFETY_WINDOW
+    table = TransitionStatut.__table__
+
+    earlier = aliased(TransitionStatut)
+    previous_date = (db.select(db.func.max(earlier.date_transition))
+                     .where(earlier.client_id == TransitionStatut.client_id, earlier.id < TransitionStatut.id)
+                     .scalar_subquery())
+    processed = 0
+    while True:
+        events = db.session.execute(
+            db.select(TransitionStatut, previous_date)
+            .where(TransitionStatut.agrege.is_(False),
+                   db.or_(TransitionStatut.id > (checkpoint.dernier_id or 0),
+                          TransitionStatut.date_transition >= safety_since))
+            .order_by(TransitionStatut.id)
+            .limit(batch_size)).all()
+        if not events:
+            break
+        _apply_totals(_aggregate(events))
+        db.session.execute(table.update().where(table.c.id.in_([event.id for event, _ in events]))
+                           .values(agrege=True))
+        checkpoint.dernier_id = max(checkpoint.dernier_id or 0, events[-1][0].id)
+        checkpoint.date_execution = datetime.utcnow()
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        processed += len(events)
+    db.session.commit()
+    return processed
+
+
+# Dates de suivi existantes permettant de reconstituer l'historique des clients antérieurs au journal
+_BACKFILL_DATES = [
+    (WorkflowStatus.CREATED, 'date_creation'),
+    (WorkflowStatus.DER_SENT, 'date_envoi_der'),
+    (WorkflowStatus.DER_SIGNED, 'date_signature_der'),
+    (WorkflowStatus.DOCUMENTS_SENT, 'date_envoi_documents'),
+    (WorkflowStatus.DOCUMENTS_SIGNED, 'date_signature_documents'),
+    (WorkflowStatus.SUBSCRIPTION_SENT, 'date_envoi_souscription'),
+]
+
+
+def backfill_transitions():
+    """Reconstitue les transitions des clients sans historique à partir de leurs dates de suivi"""
+    without_history = ~db.exists().where(TransitionStatut.client_id == Client.id)
+    rows = []
+    for client in Client.query.filter(without_history).order_by(Client.id).all():
+        previous = None
+        last_date = None
+        for status, field in _BACKFILL_DATES:
+            value = getattr(client, field)
+            if value is None:
+                continue
+            rows.append({'client_id': client.id, 'statut_precedent': previous, 'statut': status,
+                         'date_transition': value})
+            previous, last_date = status, value
+        current = client.statut_workflow or WorkflowStatus.CREATED
+        if current != previous:
+            rows.append({'client_id': client.id, 'statut_precedent': previous, 'statut': current,
+                         'date_transition': max(filter(None, [client.date_derniere_maj, last_date]),
+                                                default=datetime.utcnow())})
+    if rows:
+        db.session.execute(db.insert(TransitionStatut), rows)
+    db.session.commit()
+    return len(rows)
+
+
+def last_rollup():
+    return db.session.get(ScanCheckpoint, CHECKPOINT_NAME)
+
+
+def workflow_report(days=365):
+    """Entonnoir, durées par étape et débit par conseiller sur la période, à partir des agrégats"""
+    since = date.today() - timedelta(days=days)
+    rows = AgregatWorkflowJour.query.filter(AgregatWorkflowJour.jour >= since).all()
+
+    entries = defaultdict(int)
+    exits = defaultdict(int)
+    durations = defaultdict(float)
+    histograms = defaultdict(list)
+    advisors = defaultdict(lambda: [0, 0])
+    for row in rows:
+        entries[row.statut] += row.entrees
+        exits[row.statut] += row.sorties
+        durations[row.statut] += row.duree_totale
+        _merge_histograms(histograms[row.statut], json.loads(row.histogramme))
+        advisor = advisors[row.conseiller]
+        advisor[0] += row.entrees
+        if row.statut == WorkflowStatus.COMPLETED.name:
+            advisor[1] += row.entrees
+
+    created = entries[WorkflowStatus.CREATED.name]
+    funnel = [FunnelStep(status, entries[status.name],
+                         round(entries[status.name] / created * 100, 1) if created else None)
+              for status in _STATUS_ORDER]
+    steps = [StepStats(status, exits[status.name],
+                       durations[status.name] / exits[status.name] if exits[status.name] else None,
+                       histogram_percentile(histograms[status.name], 0.5),
+                       histogram_percentile(histograms[status.name], 0.9))
+             for status in _STATUS_ORDER if status != WorkflowStatus.COMPLETED]
+    advisor_stats = sorted((AdvisorStats(name, values[0], values[1]) for name, values in advisors.items()),
+                           key=lambda stats: stats.transitions, reverse=True)
+    return {'since': since, 'funnel': funnel, 'steps': steps, 'advisors': advisor_stats}
+
+
+def format_duration(seconds):
+    """Durée lisible (jours, heures ou minutes)"""
+    if seconds is None:
+        return '—'
+    if seconds >= 86400:
+        return f'{seconds / 86400:.1f} j'
+    if seconds >= 3600:
+        return f'{seconds / 3600:.1f} h'
+    return f'{max(1, round(seconds / 60))} min'
@@ -0,0 +1,313 @@
+import base64
+import enum
+import gzip
+import hashlib
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from flask import request
+from app import app, db
+from models import Client, Document, ProfilInvestisseur, JournalAudit, WorkflowStatus
+from db_routing import read_only_route
+from workflow import WORKFLOW_STEPS
+from audit import decompress_changes
+from duplicates import find_duplicates
+from signature import SIGNED_STATUS, record_signature
+
+# orjson est nettement plus rapide que json ; on s'en passe s'il n'est pas installé
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+API_PREFIX = '/api/v1'
+MAX_BATCH_SIZE = 500
+DEFAULT_PAGE_SIZE = 100
+GZIP_MIN_SIZE = 1024
+
+# Seules les confirmations de signature peuvent être poussées par l'API (elles passent par le même traitement
+# que les webhooks) ; les autres étapes exigent des pièces, des envois ou des contrôles faits par les routes
+API_TRANSITIONS = {status: kind for kind, status in SIGNED_STATUS.items()}
+
+
+class ApiError(Exception):
+    """Erreur renvoyée au client de l'API sous forme JSON"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Type non sérialisable : {type(value).__name__}")
+
+
+def dumps(payload):
+    """Sérialise en JSON (octets UTF-8)"""
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default)
+    return json.dumps(payload, default=_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def serialize_row(row):
+    """Convertit une ligne en dict JSON ; les enums sont exposés par leur nom (codes stables)"""
+    return {key: value.name if isinstance(value, enum.Enum) else value for key, value in row.items()}
+
+
+def json_response(payload, status=200):
+    """Réponse JSON avec ETag (GET conditionnel) et compression gzip si le client l'accepte"""
+    body = dumps(payload)
+    response = app.response_class(body, status=status, mimetype='application/json')
+    if request.method == 'GET' and status == 200:
+        response.set_etag(hashlib.sha1(body).hexdigest(), weak=True)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.make_conditional(request)
+    if response.status_code == 200 and len(body) >= GZIP_MIN_SIZE and 'gzip' in request.accept_encodings:
+        response.set_data(gzip.compress(body, compresslevel=5))
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+@app.errorhandler(ApiError)
+def handle_api_error(error):
+    return json_response({'error': error.message}, status=error.status)
+
+
+def _parse_ids(param):
+    raw = request.args.get(param)
+    if not raw:
+        return None
+    try:
+        ids = sorted({int(value) for value in raw.split(',') if value.strip()})
+    except ValueError:
+        raise ApiError(f"'{param}' doit être une liste d'entiers séparés par des virgules")
+    if len(ids) > MAX_BATCH_SIZE:
+        raise ApiError(f"'{param}' est limité à {MAX_BATCH_SIZE} identifiants")
+    return ids
+
+
+def _selected_columns(model):
+    """Colonnes demandées via ?fields= (fieldset partiel) ; l'id est toujours inclus"""
+    columns = model.__table__.columns
+    fields = request.args.get('fields')
+    if not fields:
+        return list(columns)
+    names = ['id'] + [name.strip() for name in fields.split(',') if name.strip() and name.strip() != 'id']
+    unknown = [name for name in names if name not in columns]
+    if unknown:
+        raise ApiError(f"Champs inconnus : {', '.join(unknown)}")
+    return [columns[name] for name in names]
+
+
+def _encode_cursor(last_id):
+    return base64.urlsafe_b64encode(dumps({'after': last_id})).decode('ascii')
+
+
+def _decode_cursor(cursor):
+    if not cursor:
+        return 0
+    try:
+        return int(json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))['after'])
+    except (ValueError, KeyError, TypeError):
+        raise ApiError("Curseur invalide")
+
+
+def _encode_audit_cursor(entry):
+    return base64.urlsafe_b64encode(dumps({'date': entry['date_action'], 'id': entry['id']})).decode('ascii')
+
+
+def _decode_audit_cursor(cursor):
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.fromisoformat(position['date']), int(position['id'])
+    except (ValueError, KeyError, TypeError):
+        raise ApiError("Curseur invalide")
+
+
+def _page_size():
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ApiError("'limit' doit être un entier")
+    return max(1, min(limit, MAX_BATCH_SIZE))
+
+
+def list_resource(model, columns=None):
+    """Liste une ressource : lot par ?ids= ou ?client_ids=, sinon pagination par curseur sur l'id"""
+    columns = columns or _selected_columns(model)
+    query = db.select(*columns).order_by(model.id)
+
+    ids = _parse_ids('ids')
+    client_ids = _parse_ids('client_ids') if 'client_id' in model.__table__.columns else None
+    if ids:
+        query = query.where(model.id.in_(ids))
+    if client_ids:
+        query = query.where(model.client_id.in_(client_ids))
+
+    if ids:
+        rows = db.session.execute(query).mappings().all()
+        data = [serialize_row(row) for row in rows]
+        found = {row['id'] for row in data}
+        return {'data': data, 'missing': [i for i in ids if i not in found]}
+
+    limit = _page_size()
+    query = query.where(model.id > _decode_cursor(request.args.get('cursor'))).limit(limit + 1)
+    rows = db.session.execute(query).mappings().all()
+    data = [serialize_row(row) for row in rows[:limit]]
+    next_cursor = _encode_cursor(data[-1]['id']) if len(rows) > limit else None
+    return {'data': data, 'next_cursor': next_cursor}
+
+
+@app.route(f'{API_PREFIX}/clients')
+@read_only_route
+def api_clients():
+    """Clients : lot par ids, fieldset partiel, pagination par curseur"""
+    return json_response(list_resource(Client))
+
+
+@app.route(f'{API_PREFIX}/clients/doublons')
+@read_only_route
+def api_client_duplicates():
+    """Doublons possibles d'une fiche en cours de saisie (?nom=&prenom=&email=&telephone=&ville=&date_naissance=)"""
+    fields = {field: request.args.get(field, '').strip() or None
+              for field in ('nom', 'prenom', 'email', 'telephone', 'ville', 'date_naissance')}
+    if fields['date_naissance']:
+        try:
+            date.fromisoformat(fields['date_naissance'])
+        except ValueError:
+            raise ApiError("'date_naissance' doit être au format AAAA-MM-JJ")
+    duplicates = find_duplicates(exclude_client_id=request.args.get('exclude', type=int), **fields)
+    data = [{
+        'id': duplicate['client'].id,
+        'nom': duplicate['client'].nom,
+        'prenom': duplicate['client'].prenom,
+        'ville': duplicate['client'].ville,
+        'score': duplicate['score'],
+        'niveau': duplicate['niveau'],
+        'motifs': duplicate['motifs'],
+    } for duplicate in duplicates]
+    return json_response({'data': data})
+
+
+@app.route(f'{API_PREFIX}/clients/<int:client_id>')
+@read_only_route
+def api_client(client_id):
+    """Un client"""
+    row = db.session.execute(db.select(*_selected_columns(Client)).where(Client.id == client_id)).mappings().first()
+    if row is None:
+        raise ApiError("Client introuvable", status=404)
+    return json_response({'data': serialize_row(row)})
+
+
+@app.route(f'{API_PREFIX}/clients/<int:client_id>/audit')
+@read_only_route
+def api_client_audit(client_id):
+    """Historique des modifications des données KYC d'un client, du plus récent au plus ancien.
+    Le curseur porte (date_action, id) : les ids suivent l'ordre d'écriture des lots, pas celui des modifications"""
+    limit = _page_size()
+    query = (db.select(JournalAudit)
+             .where(JournalAudit.client_id == client_id)
+             .order_by(JournalAudit.date_action.desc(), JournalAudit.id.desc())
+             .limit(limit + 1))
+    before = request.args.get('before')
+    if before:
+        date_action, entry_id = _decode_audit_cursor(before)
+        query = query.where(db.or_(JournalAudit.date_action < date_action,
+                                   db.and_(JournalAudit.date_action == date_action, JournalAudit.id < entry_id)))
+    entries = db.session.scalars(query).all()
+    data = [{
+        'id': entry.id,
+        'date_action': entry.date_action,
+        'table': entry.table_objet,
+        'objet_id': entry.objet_id,
+        'operation': entry.operation,
+        'conseiller': entry.conseiller,
+        'modifications': decompress_changes(entry.modifications),
+    } for entry in entries[:limit]]
+    return json_response({'data': data, 'next_before': _encode_audit_cursor(data[-1]) if len(entries) > limit else None})
+
+
+@app.route(f'{API_PREFIX}/documents')
+@read_only_route
+def api_documents():
+    """Documents : lot par ids ou client_ids"""
+    return json_response(list_resource(Document))
+
+
+@app.route(f'{API_PREFIX}/profils')
+@read_only_route
+def api_profils():
+    """Profils investisseur : lot par ids ou client_ids"""
+    return json_response(list_resource(ProfilInvestisseur))
+
+
+def _workflow_payload(client_id, status):
+    step = WORKFLOW_STEPS[status]
+    return {
+        'client_id': client_id,
+        'status': status.name,
+        'label': status.value,
+        'ordinal': step.ordinal,
+        'progress': step.progress,
+        'next_action': step.next_action.endpoint if step.next_action else None,
+        'transitions': sorted(target.name for target in step.transitions),
+    }
+
+
+@app.route(f'{API_PREFIX}/workflow')
+@read_only_route
+def api_workflow():
+    """Statut du workflow des clients demandés (?ids=) ou de tous, par curseur"""
+    result = list_resource(Client, columns=[Client.id, Client.statut_workflow])
+    # Fiches anciennes sans statut : considérées comme créées, comme dans les statistiques
+    result['data'] = [_workflow_payload(row['id'], WorkflowStatus[row['statut_workflow'] or WorkflowStatus.CREATED.name])
+                      for row in result['data']]
+    return json_response(result)
+
+
+@app.route(f'{API_PREFIX}/workflow/transitions', methods=['POST'])
+def api_workflow_transitions():
+    """Applique un lot de confirmations de signature dans une seule transaction"""
+    payload = request.get_json(silent=True) or {}
+    transitions = payload.get('transitions')
+    if not isinstance(transitions, list) or not transitions:
+        raise ApiError("'transitions' doit être une liste non vide de {client_id, status}")
+    if len(transitions) > MAX_BATCH_SIZE:
+        raise ApiError(f"Lot limité à {MAX_BATCH_SIZE} transitions")
+
+    try:
+        requested = [(int(item['client_id']), WorkflowStatus[item['status']]) for item in transitions]
+    except (KeyError, TypeError, ValueError):
+        raise ApiError("Chaque transition doit contenir un client_id entier et un status valide")
+    refused = sorted({target.name for _, target in requested if target not in API_TRANSITIONS})
+    if refused:
+        raise ApiError(f"Statuts non modifiables par l'API : {', '.join(refused)} "
+                       f"(autorisés : {', '.join(sorted(status.name for status in API_TRANSITIONS))})", status=409)
+
+    clients = {client.id: client for client in
+               Client.query.filter(Client.id.in_({client_id for client_id, _ in requested})).all()}
+
+    results = []
+    for client_id, target in requested:
+        client = clients.get(client_id)
+        if client is None:
+            results.append({'client_id': client_id, 'status': target.name, 'applied': False, 'error': 'Client introuvable'})
+        elif record_signature(client, API_TRANSITIONS[target]):
+            results.append({'client_id': client_id, 'status': target.name, 'applied': True})
+        else:
+            results.append({'client_id': client_id, 'status': target.name, 'applied': False,
+                            'error': f"Transition impossible depuis {client.statut_workflow.name}"})
+
+    try:
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        raise ApiError(f"Erreur lors de l'enregistrement : {str(e)}", status=500)
+
+    return json_response({'data': results})
@@ -1,9 +1,17 @@
 import os
+import time
 import logging
+import click
+import sqlalchemy as sa
 from flask import Flask
+from jinja2 import FileSystemBytecodeCache
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
+from db_config import normalize_database_uri, build_engine_options, check_database_settings
+from db_routing import RoutingSession, init_replica_routing
+from page_cache import init_page_cache
+from audit import init_audit
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -11,7 +19,7 @@ logging.basicConfig(level=logging.DEBUG)
 class Base(DeclarativeBase):
     pass
 
-db = SQLAlchemy(model_class=Base)
+db = SQLAlchemy(model_class=Base, session_options={"class_": RoutingSession})
 
 # Create the app
 app = Flask(__name__)
@@ -29,29 +37,281 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(GENERATED_DOCS_FOLDER, exist_ok=True)
 
+# Templates compilés conservés sur disque : redémarrages et nouveaux workers évitent la compilation Jinja
+# (JINJA_CACHE_DIR, vide pour désactiver)
+JINJA_CACHE_DIR = os.environ.get("JINJA_CACHE_DIR", os.path.join(app.instance_path, "jinja_cache"))
+if JINJA_CACHE_DIR:
+    os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
+
 # Configure the database
-database_uri = os.environ.get("DATABASE_URL", "sqlite:////root/KYC-AML-V2/instance/kyc_aml.db")
-if database_uri.startswith("sqlite") and not database_uri.endswith("?charset=utf8mb4"):
-    database_uri += "?charset=utf8mb4"
+database_uri = normalize_database_uri(os.environ.get("DATABASE_URL", "sqlite:////root/KYC-AML-V2/instance/kyc_aml.db"))
 app.config["SQLALCHEMY_DATABASE_URI"] = database_uri
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = build_engine_options(database_uri)
+
+# Optional read replica used by read-only routes and reporting queries
+replica_uri = os.environ.get("DATABASE_REPLICA_URL")
+if replica_uri:
+    replica_uri = normalize_database_uri(replica_uri)
+    app.config["SQLALCHEMY_BINDS"] = {
+        "replica": {"url": replica_uri, **build_engine_options(replica_uri)},
+    }
 
 # Initialize the app with the extension
 db.init_app(app)
+init_replica_routing(app)
 
-def initialize_app():
+# Rendered fragment cache (in-process LRU by default, see PAGE_CACHE_BACKEND)
+init_page_cache(app)
+
+# Append-only audit log of KYC data changes, written in batches by a background thread
+init_audit(app)
+
+# Schema creation on boot is convenient in development; in production set
+# SCHEMA_AUTO_CREATE=0 and run `flask --app app init-db` once per deployment
+SCHEMA_AUTO_CREATE = os.environ.get("SCHEMA_AUTO_CREATE", "1").lower() in ("1", "true", "yes")
+
+def create_schema():
     with app.app_context():
         # Import models to ensure tables are created
         import models
         db.create_all()
+        # create_all() skips existing tables: add columns and indexes introduced since they were created
+        add_missing_columns()
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(db.engine, checkfirst=True)
+
+def add_missing_columns():
+    """Add new nullable (or server-defaulted) columns to existing tables, and drop NOT NULL
+    (PostgreSQL) on columns the models now allow to be empty."""
+    inspector = sa.inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {column["name"]: column for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    if (column.nullable and not existing[column.name]["nullable"]
+                            and connection.dialect.name == "postgresql"):
+                        connection.execute(sa.text(f"ALTER TABLE {table.name} ALTER COLUMN {column.name} DROP NOT NULL"))
+                        logging.getLogger(__name__).info("Column %s.%s is now nullable", table.name, column.name)
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(db.engine.dialect)}"
+                if column.server_default is not None:
+                    ddl += f" DEFAULT {column.server_default.arg}"
+                if not column.nullable:
+                    ddl += " NOT NULL"
+                connection.execute(sa.text(ddl))
+                logging.getLogger(__name__).info("Added column %s.%s", table.name, column.name)
+
+@app.cli.command("init-db")
+def init_db_command():
+    """Create the database schema (one-time command, run before starting workers)."""
+    create_schema()
+    logging.getLogger(__name__).info("Database schema initialized")
+
+@app.cli.command("process-signature-events")
+@click.option("--loop", is_flag=True, help="Keep polling the queue instead of exiting when it is empty.")
+@click.option("--interval", default=2.0, show_default=True, help="Seconds between polls in --loop mode.")
+def process_signature_events_command(loop, interval):
+    """Apply queued e-signature webhook events in batched transactions."""
+    from signature import process_signature_events
+    while True:
+        processed = process_signature_events()
+        if processed:
+            logging.getLogger(__name__).info("%d signature event(s) processed", processed)
+        elif not loop:
+            break
+        else:
+            time.sleep(interval)
+
+@app.cli.command("dispatch-notifications")
+@click.option("--loop", is_flag=True, help="Keep watching the outbox instead of exiting when it is empty.")
+@click.option("--interval", default=5.0, show_default=True, help="Seconds between polls in --loop mode.")
+def dispatch_notifications_command(loop, interval):
+    """Send queued client emails from the notification outbox."""
+    import asyncio
+    from notifications import run_dispatcher
+    asyncio.run(run_dispatcher(loop=loop, interval=interval))
+
+@app.cli.command("smtp-stub")
+@click.option("--host", default="localhost", show_default=True)
+@click.option("--port", default=1025, show_default=True)
+@click.option("--output-dir", default="instance/outbox", show_default=True, help="Directory receiving .eml files.")
+def smtp_stub_command(host, port, output_dir):
+    """Run a local SMTP server that accepts every message (development and tests)."""
+    import asyncio
+    from notifications import SMTPStub
+    asyncio.run(SMTPStub(output_dir).serve(host, port))
+
+@app.cli.command("scan-sla")
+@click.option("--loop", is_flag=True, help="Run the scan periodically (scheduler mode).")
+@click.option("--interval", default=300.0, show_default=True, help="Seconds between scans in --loop mode.")
+def scan_sla_command(loop, interval):
+    """Raise overdue-workflow alerts and reminders since the last checkpoint."""
+    from sla import scan_sla
+    while True:
+        raised, resolved = scan_sla()
+        logging.getLogger(__name__).info("SLA scan: %d alert(s) raised, %d resolved", raised, resolved)
+        if not loop:
+            break
+        time.sleep(interval)
+
+@app.cli.command("analytics-rollup")
+@click.option("--backfill", is_flag=True, help="First rebuild transitions of clients created before the event log.")
+@click.option("--loop", is_flag=True, help="Keep aggregating new transitions periodically.")
+@click.option("--interval", default=300.0, show_default=True, help="Seconds between runs in --loop mode.")
+def analytics_rollup_command(backfill, loop, interval):
+    """Fold new workflow status transitions into the daily analytics rollups."""
+    from analytics import backfill_transitions, rollup_transitions
+    if backfill:
+        logging.getLogger(__name__).info("%d transition(s) backfilled", backfill_transitions())
+    while True:
+        logging.getLogger(__name__).info("%d transition(s) aggregated", rollup_transitions())
+        if not loop:
+            break
+        time.sleep(interval)
+
+@app.cli.command("rescreen-clients")
+@click.option("--full", is_flag=True, help="Ignore the stored list snapshot and rescreen every entry.")
+@click.option("--workers", type=int, default=None, help="Search processes (default: RESCREEN_WORKERS or CPU count).")
+@click.option("--loop", is_flag=True, help="Check the list files periodically and rescreen on change.")
+@click.option("--interval", default=3600.0, show_default=True, help="Seconds between runs in --loop mode.")
+def rescreen_clients_command(full, workers, loop, interval):
+    """Rescreen the client book against added or changed sanctions/PEP list entries."""
+    from screening import ScreeningLists
+    from rescreening import rescreen_clients, RESCREEN_WORKERS
+    lists = ScreeningLists()
+    while True:
+        rescreen_clients(lists, workers or RESCREEN_WORKERS, full)
+        full = False
+        if not loop:
+            break
+        time.sleep(interval)
+
+@app.cli.command("rate-clients")
+@click.option("--rules", "rules_path", default=None, help="JSON rules file (default: RISK_RULES_PATH or built-in rules).")
+@click.option("--batch-size", default=5000, show_default=True, help="Clients per column batch.")
+def rate_clients_command(rules_path, batch_size):
+    """Recompute the AML risk rating of every client."""
+    from risk_rating import load_rules, rate_all_clients
+    rate_all_clients(load_rules(rules_path), batch_size)
+
+@app.cli.command("import-products")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+def import_products_command(path):
+    """Create or update catalogue products from a JSON file (keyed by code)."""
+    from suitability import import_products
+    created, updated = import_products(path)
+    logging.getLogger(__name__).info("Products: %d created, %d updated", created, updated)
+
+@app.cli.command("encode-profiles")
+def encode_profiles_command():
+    """Compute suitability masks for investor profiles saved before they existed."""
+    from suitability import encode_all_profiles
+    logging.getLogger(__name__).info("%d investor profile(s) encoded", encode_all_profiles())
+
+@app.cli.command("rebuild-duplicate-keys")
+@click.option("--batch-size", default=1000, show_default=True, help="Clients per insert batch.")
+def rebuild_duplicate_keys_command(batch_size):
+    """Recompute the duplicate-detection blocking keys of every client."""
+    from duplicates import rebuild_keys
+    logging.getLogger(__name__).info("Duplicate keys rebuilt for %d client(s)", rebuild_keys(batch_size))
+
+@app.cli.command("migrate-documents")
+@click.option("--batch-size", default=500, show_default=True, help="Legacy rows copied per transaction.")
+def migrate_documents_command(batch_size):
+    """Copy the four legacy document tables into documents_clients (safe to run while the app is serving)."""
+    from document_store import migrate_documents
+    for table, (copied, removed) in migrate_documents(batch_size).items():
+        logging.getLogger(__name__).info("%s: %d copied, %d stale removed", table, copied, removed)
+
+@app.cli.command("archive-clients")
+@click.option("--older-than-days", default=None, type=int, help="Minimum age since last update (default: ARCHIVE_AFTER_DAYS).")
+@click.option("--batch-size", default=None, type=int, help="Clients moved per transaction (default: ARCHIVE_BATCH_SIZE).")
+@click.option("--limit", default=None, type=int, help="Stop after this many clients.")
+def archive_clients_command(older_than_days, batch_size, limit):
+    """Move completed client files into the archive tables."""
+    from archive import archive_clients, ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE
+    archive_clients(ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days,
+                    batch_size or ARCHIVE_BATCH_SIZE, limit)
+
+@app.cli.command("restore-client")
+@click.argument("client_id", type=int)
+def restore_client_command(client_id):
+    """Move an archived client file back into the active tables."""
+    from archive import restore_client
+    if not restore_client(client_id):
+        raise click.ClickException(f"Client {client_id} is not archived")
+    db.session.commit()
+
+@app.cli.command("process-scans")
+@click.option("--workers", type=int, default=None, help="Image processes (default: SCAN_WORKERS or CPU count).")
+@click.option("--loop", is_flag=True, help="Keep polling for new uploads.")
+@click.option("--interval", default=10.0, show_default=True, help="Seconds between polls in --loop mode.")
+def process_scans_command(workers, loop, interval):
+    """Normalize uploaded images and build thumbnails and PDF first-page previews."""
+    from scan_processing import process_pending, SCAN_WORKERS
+    while True:
+        process_pending(workers or SCAN_WORKERS)
+        if not loop:
+            break
+        time.sleep(interval)
+
+@app.cli.command("duplicate-report")
+@click.option("--min-score", default=None, type=int, help="Lowest pair score reported (default: DUPLICATE_POSSIBLE_SCORE).")
+@click.option("--output", type=click.File("w", encoding="utf-8"), default="-", help="CSV destination (default: stdout).")
+def duplicate_report_command(min_score, output):
+    """Write the pairs of clients sharing blocking keys as CSV, highest score first."""
+    import csv
+    from duplicates import duplicate_pairs, DUPLICATE_POSSIBLE_SCORE
+    writer = csv.writer(output)
+    writer.writerow(["client_id", "nom", "prenom", "doublon_id", "doublon_nom", "doublon_prenom", "score", "niveau", "motifs"])
+    for pair in duplicate_pairs(DUPLICATE_POSSIBLE_SCORE if min_score is None else min_score):
+        a, b = pair["clients"]
+        writer.writerow([a.id, a.nom, a.prenom, b.id, b.nom, b.prenom, pair["score"], pair["niveau"], "; ".join(pair["motifs"])])
+
+def warm_caches():
+    """Compile les templates des pages, charge les modèles Word et les listes de filtrage avant la première requête"""
+    started = time.perf_counter()
+    # Les filtres et globales des templates sont enregistrés par les modules de routes
+    import routes  # noqa: F401
+    import api  # noqa: F401
+    templates = app.jinja_env.list_templates(extensions=["html"])
+    for name in templates:
+        app.jinja_env.get_template(name)
+    from document_generator import warm_templates
+    warm_templates()
+    # Index des listes sanctions / PPE, sinon construit par la première entrée en relation de chaque worker
+    from screening import screening_lists
+    screening_lists().refresh(force=True)
+    logging.getLogger(__name__).info("%d templates warmed in %.0f ms", len(templates),
+                                     (time.perf_counter() - started) * 1000)
+
+@app.cli.command("warm-cache")
+def warm_cache_command():
+    """Fill the Jinja bytecode cache (e.g. at build time, before the first deployment start)."""
+    warm_caches()
+
+def initialize_app():
+    if SCHEMA_AUTO_CREATE:
+        create_schema()
+
+    with app.app_context():
+        # Import models so the mappers are configured before the first request
+        import models
+        # Report the effective engine settings (startup self-check)
+        for engine in db.engines.values():
+            check_database_settings(engine)
     
     # Import routes after app is created
     import routes
+    import api
     return app
 
 # Only initialize if this file is run directly
 if __name__ == '__main__':
-    initialize_app()
+    initialize_app()
\ No newline at end of file
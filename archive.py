@@ -0,0 +1,123 @@
+import os
+import time
+import logging
+from datetime import datetime, timedelta
+from app import db
+from models import Client, WorkflowStatus, ARCHIVE_TABLES
+from document_store import unified_documents_ready
+
+logger = logging.getLogger(__name__)
+
+# Âge minimal (jours depuis la dernière mise à jour) d'un dossier terminé avant archivage
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 365))
+# Clients déplacés par transaction
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 200))
+
+# Tables filles d'abord à la suppression (clés étrangères vers clients)
+_CHILD_TABLES = [name for name in ARCHIVE_TABLES if name != 'clients']
+
+
+def _client_filter(table, client_ids):
+    column = table.c.id if table.name.startswith('clients') else table.c.client_id
+    return column.in_(client_ids)
+
+
+def _archive_batch(client_ids, now):
+    hot_clients = db.metadata.tables['clients']
+    columns = [column.name for column in hot_clients.c]
+    db.session.execute(ARCHIVE_TABLES['clients'].insert().from_select(
+        columns + ['date_archivage'],
+        db.select(*hot_clients.c, db.literal(now, db.DateTime)).where(_client_filter(hot_clients, client_ids))))
+    for name in _CHILD_TABLES:
+        hot = db.metadata.tables[name]
+        db.session.execute(ARCHIVE_TABLES[name].insert().from_select(
+            [column.name for column in hot.c], db.select(*hot.c).where(_client_filter(hot, client_ids))))
+    for name in _CHILD_TABLES + ['clients']:
+        hot = db.metadata.tables[name]
+        db.session.execute(hot.delete().where(_client_filter(hot, client_ids)))
+
+
+def archive_clients(older_than_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE, limit=None):
+    """Déplace les dossiers terminés non modifiés depuis older_than_days jours vers les tables d'archives,
+    par transactions de batch_size clients (toutes leurs lignes filles avec eux)"""
+    started = time.perf_counter()
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    archived = 0
+    while limit is None or archived < limit:
+        size = batch_size if limit is None else min(batch_size, limit - archived)
+        # Les clients du lot sont verrouillés (PostgreSQL) : aucune ligne fille ne peut leur être ajoutée pendant le déplacement
+        client_ids = db.session.scalars(
+            db.select(Client.id)
+            .where(Client.statut_workflow == WorkflowStatus.COMPLETED, Client.date_derniere_maj < cutoff)
+            .order_by(Client.id)
+            .limit(size)
+            .with_for_update(skip_locked=True)).all()
+        if not client_ids:
+            break
+        try:
+            _archive_batch(client_ids, datetime.utcnow())
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        archived += len(client_ids)
+    logger.info("%d dossier(s) archivé(s) en %.1f s", archived, time.perf_counter() - started)
+    return archived
+
+
+def restore_client(client_id):
+    """Remet un dossier archivé dans les tables actives (sans valider la transaction) ; False s'il n'est pas archivé"""
+    cold_clients = ARCHIVE_TABLES['clients']
+    if db.session.scalar(db.select(cold_clients.c.id).where(cold_clients.c.id == client_id)) is None:
+        return False
+    hot_clients = db.metadata.tables['clients']
+    columns = [column.name for column in hot_clients.c]
+    db.session.execute(hot_clients.insert().from_select(
+        columns, db.select(*[cold_clients.c[name] for name in columns]).where(cold_clients.c.id == client_id)))
+    for name in _CHILD_TABLES:
+        hot, cold = db.metadata.tables[name], ARCHIVE_TABLES[name]
+        db.session.execute(hot.insert().from_select([column.name for column in hot.c],
+                                                    db.select(*cold.c).where(cold.c.client_id == client_id)))
+        db.session.execute(cold.delete().where(cold.c.client_id == client_id))
+    db.session.execute(cold_clients.delete().where(cold_clients.c.id == client_id))
+    # Dossier rouvert : il n'est pas réarchivé avant ARCHIVE_AFTER_DAYS et le prochain refiltrage le reprend
+    db.session.execute(hot_clients.update().where(hot_clients.c.id == client_id)
+                       .values(date_derniere_maj=datetime.utcnow()))
+    return True
+
+
+# Lecture transparente des archives (lignes en lecture seule, mêmes attributs que les modèles)
+def archived_client(client_id):
+    table = ARCHIVE_TABLES['clients']
+    return db.session.execute(db.select(table).where(table.c.id == client_id)).first()
+
+
+def archived_rows(name, client_id):
+    table = ARCHIVE_TABLES[name]
+    return db.session.execute(db.select(table).where(table.c.client_id == client_id)).all()
+
+
+def archived_documents(client_id):
+    """Fichiers d'un client archivé, depuis la table unifiée si la migration est faite"""
+    if not unified_documents_ready():
+        return archived_rows('documents', client_id)
+    table = ARCHIVE_TABLES['documents_clients']
+    return db.session.execute(
+        db.select(table, table.c.date_creation.label('date_upload'))
+        .where(table.c.client_id == client_id)
+        .order_by(table.c.date_creation.desc(), table.c.id.desc())).all()
+
+
+def archived_document(name, document_id):
+    table = ARCHIVE_TABLES[name]
+    return db.session.execute(db.select(table).where(table.c.id == document_id)).first()
+
+
+def search_archived_clients(query, limit=50):
+    table = ARCHIVE_TABLES['clients']
+    pattern = f'%{query}%'
+    return db.session.execute(
+        db.select(table)
+        .where(db.or_(table.c.nom.ilike(pattern), table.c.prenom.ilike(pattern), table.c.email.ilike(pattern)))
+        .order_by(table.c.nom, table.c.prenom)
+        .limit(limit)).all()
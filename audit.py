@@ -0,0 +1,325 @@
+import os
+import json
+import time
+import uuid
+import zlib
+import queue
+import atexit
+import logging
+import threading
+from collections import deque
+from datetime import date, datetime
+from decimal import Decimal
+import enum
+import sqlalchemy as sa
+from sqlalchemy import event
+from sqlalchemy.orm.base import NO_VALUE
+from flask import has_request_context
+from db_routing import RoutingSession
+
+logger = logging.getLogger(__name__)
+
+# Tables portant des données KYC dont chaque modification est journalisée
+AUDITED_TABLES = {
+    'clients',
+    'profils_investisseur',
+    'questionnaire_responses',
+    'der',
+    'pieces_justificatives',
+    'documents',
+}
+
+# 'async' (par défaut) : les entrées sont écrites après le commit par un thread d'arrière-plan, sans latence
+# ajoutée aux écritures, mais celles encore en mémoire sont perdues si le processus est tué (SIGKILL, OOM,
+# dépassement de graceful_timeout de gunicorn), cas où atexit ne s'exécute pas.
+# 'transaction' : les entrées sont insérées dans la transaction métier, validées ou annulées avec elle
+AUDIT_MODE = os.environ.get('AUDIT_MODE', 'async')
+AUDIT_BATCH_SIZE = int(os.environ.get('AUDIT_BATCH_SIZE', 500))
+AUDIT_FLUSH_INTERVAL = float(os.environ.get('AUDIT_FLUSH_INTERVAL', 1.0))
+AUDIT_TABLE = 'journal_audit'
+# Un lot dont l'écriture échoue est retenté (délai doublé à chaque tentative), puis écrit dans un fichier
+# de secours rejoué au démarrage du writer et à chaque flush : une panne de la base ne perd pas d'entrées,
+# l'arrêt brutal du processus si (voir AUDIT_MODE)
+AUDIT_MAX_RETRIES = int(os.environ.get('AUDIT_MAX_RETRIES', 5))
+AUDIT_RETRY_DELAY = float(os.environ.get('AUDIT_RETRY_DELAY', 0.5))
+AUDIT_SPILL_DIR = os.environ.get('AUDIT_SPILL_DIR')
+
+_PENDING_KEY = 'audit_pending'
+
+
+def _json_value(value):
+    if isinstance(value, enum.Enum):
+        return value.name
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, bytes):
+        return None
+    return value
+
+
+def _changes(obj, operation):
+    """Différences {champ: [avant, après]} d'un objet au moment du flush"""
+    state = sa.inspect(obj)
+    changes = {}
+    for attr in state.mapper.column_attrs:
+        key = attr.key
+        if operation == 'UPDATE':
+            history = state.attrs[key].history
+            if not history.has_changes():
+                continue
+            before = history.deleted[0] if history.deleted else None
+            after = history.added[0] if history.added else None
+        else:
+            value = state.attrs[key].loaded_value
+            if value is NO_VALUE or value is None:
+                continue
+            before, after = (None, value) if operation == 'INSERT' else (value, None)
+        if before != after:
+            changes[key] = [_json_value(before), _json_value(after)]
+    return changes
+
+
+def _keep_previous(target, value, oldvalue, initiator):
+    pass
+
+
+@event.listens_for(sa.orm.Mapper, 'mapper_configured')
+def _track_previous_values(mapper, class_):
+    """Charge l'ancienne valeur avant chaque modification d'un champ audité : sans cela, un attribut expiré
+    par le commit précédent est modifié sans que sa valeur d'avant soit connue au flush"""
+    if mapper.local_table.name not in AUDITED_TABLES:
+        return
+    for attr in mapper.column_attrs:
+        event.listen(getattr(class_, attr.key), 'set', _keep_previous, active_history=True)
+
+
+def _client_id(obj):
+    return obj.id if obj.__tablename__ == 'clients' else getattr(obj, 'client_id', None)
+
+
+def _advisor():
+    if not has_request_context():
+        return None
+    from workflow import current_advisor
+    return current_advisor()
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _capture_changes(session, flush_context):
+    """Relève les différences pendant le flush ; elles ne sont écrites qu'après le commit"""
+    now = datetime.utcnow()
+    advisor = _advisor()
+    records = []
+    for operation, objects in (('INSERT', session.new), ('UPDATE', session.dirty), ('DELETE', session.deleted)):
+        for obj in objects:
+            if getattr(obj, '__tablename__', None) not in AUDITED_TABLES:
+                continue
+            changes = _changes(obj, operation)
+            if not changes:
+                continue
+            records.append({
+                'mois': now.strftime('%Y-%m'),
+                'date_action': now,
+                'client_id': _client_id(obj),
+                'table_objet': obj.__tablename__,
+                'objet_id': getattr(obj, 'id', None),
+                'operation': operation,
+                'conseiller': advisor,
+                'modifications': changes,
+            })
+    _store(session, records)
+
+
+def _store(session, records):
+    """Insère les entrées dans la transaction en cours (mode transaction) ou les garde jusqu'au commit"""
+    if not records:
+        return
+    if AUDIT_MODE == 'transaction':
+        from app import db
+        session.execute(db.metadata.tables[AUDIT_TABLE].insert(), [_row(record) for record in records])
+    else:
+        session.info.setdefault(_PENDING_KEY, []).extend(records)
+
+
+def record_changes(session, table_name, client_id, changes):
+    """Journalise des modifications faites hors ORM (requêtes en bloc) : liste de (opération, différences)"""
+    now = datetime.utcnow()
+    advisor = _advisor()
+    _store(session, [{
+        'mois': now.strftime('%Y-%m'),
+        'date_action': now,
+        'client_id': client_id,
+        'table_objet': table_name,
+        'objet_id': None,
+        'operation': operation,
+        'conseiller': advisor,
+        'modifications': diff,
+    } for operation, diff in changes])
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _queue_committed(session):
+    records = session.info.pop(_PENDING_KEY, None)
+    if records and _writer is not None:
+        _writer.enqueue(records)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_rolled_back(session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+def compress_changes(changes):
+    return zlib.compress(json.dumps(changes, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+
+
+def decompress_changes(data):
+    return json.loads(zlib.decompress(data))
+
+
+def _row(record):
+    return {**record, 'modifications': compress_changes(record['modifications'])}
+
+
+class AuditWriter:
+    """Écrit le journal d'audit par lots depuis un thread dédié, hors du chemin des requêtes"""
+
+    def __init__(self, app, batch_size=AUDIT_BATCH_SIZE, interval=AUDIT_FLUSH_INTERVAL, spill_dir=AUDIT_SPILL_DIR):
+        self.app = app
+        self.batch_size = batch_size
+        self.interval = interval
+        self.spill_dir = spill_dir or os.path.join(app.instance_path, 'audit_spill')
+        self._queue = queue.Queue()
+        # Lots en échec à retenter : (échéance, lot, tentatives déjà faites)
+        self._retries = deque()
+        self._retry_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def enqueue(self, records):
+        self._ensure_thread()
+        for record in records:
+            self._queue.put(record)
+
+    def _ensure_thread(self):
+        # Le thread est (re)démarré dans chaque worker après le fork
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._retries = deque()
+                self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+                self._thread.start()
+
+    def _next_batch(self, timeout):
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=timeout))
+            while len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _run(self):
+        self.replay_spilled()
+        while True:
+            self._retry_due()
+            batch = self._next_batch(self.interval)
+            if batch:
+                self._write(batch)
+
+    def _insert(self, batch):
+        rows = [_row(record) for record in batch]
+        with self.app.app_context():
+            sqlalchemy_ext = self.app.extensions['sqlalchemy']
+            table = sqlalchemy_ext.metadata.tables[AUDIT_TABLE]
+            with sqlalchemy_ext.engine.begin() as connection:
+                connection.execute(table.insert(), rows)
+
+    def _write(self, batch, attempts=0):
+        try:
+            self._insert(batch)
+            return
+        except Exception:
+            logger.exception("Échec de l'écriture de %d entrée(s) du journal d'audit (tentative %d)",
+                             len(batch), attempts + 1)
+        if attempts < AUDIT_MAX_RETRIES:
+            self._retries.append((time.monotonic() + AUDIT_RETRY_DELAY * 2 ** attempts, batch, attempts + 1))
+        else:
+            self._spill(batch)
+
+    def _retry_due(self, wait=False):
+        """Retente les lots arrivés à échéance (tous, en attendant leur échéance, si wait)"""
+        while True:
+            with self._retry_lock:
+                if not self._retries or (not wait and self._retries[0][0] > time.monotonic()):
+                    return
+                due, batch, attempts = self._retries.popleft()
+            time.sleep(max(0.0, due - time.monotonic()))
+            self._write(batch, attempts)
+
+    def _spill(self, batch):
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = os.path.join(self.spill_dir, f'audit_{datetime.utcnow():%Y%m%d%H%M%S}_{uuid.uuid4().hex}.jsonl')
+        # Écrit sous un autre nom puis renommé : un rejeu concurrent ne lit jamais un fichier incomplet
+        with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+            for record in batch:
+                f.write(json.dumps(record, default=_json_value, ensure_ascii=False) + '\n')
+        os.replace(f'{path}.tmp', path)
+        logger.error("%d entrée(s) du journal d'audit écrites dans %s (rejouées au prochain démarrage)", len(batch), path)
+
+    def replay_spilled(self):
+        """Réécrit dans la base les lots de secours ; chaque fichier est réservé par renommage (un seul processus)"""
+        if not os.path.isdir(self.spill_dir):
+            return 0
+        replayed = 0
+        for name in sorted(os.listdir(self.spill_dir)):
+            if not name.endswith('.jsonl'):
+                continue
+            path = os.path.join(self.spill_dir, name)
+            claimed = f'{path}.{os.getpid()}'
+            try:
+                os.rename(path, claimed)
+            except OSError:
+                continue
+            with open(claimed, encoding='utf-8') as f:
+                batch = [json.loads(line) for line in f if line.strip()]
+            for record in batch:
+                record['date_action'] = datetime.fromisoformat(record['date_action'])
+            try:
+                self._insert(batch)
+            except Exception:
+                logger.exception("Lot de secours %s non rejoué", name)
+                os.rename(claimed, path)
+                continue
+            os.remove(claimed)
+            replayed += len(batch)
+        if replayed:
+            logger.info("%d entrée(s) du journal d'audit rejouées depuis %s", replayed, self.spill_dir)
+        return replayed
+
+    def flush(self):
+        """Écrit immédiatement les entrées en attente (arrêt du processus, commandes CLI)"""
+        self.replay_spilled()
+        while True:
+            batch = self._next_batch(0)
+            if not batch:
+                break
+            self._write(batch)
+        self._retry_due(wait=True)
+
+
+_writer = None
+
+
+def init_audit(app):
+    """Active l'écriture du journal d'audit pour l'application"""
+    global _writer
+    _writer = AuditWriter(app)
+    app.extensions['audit_writer'] = _writer
+    atexit.register(_writer.flush)
@@ -0,0 +1,95 @@
+"""Benchmark du temps d'import d'un worker, basé sur `python -X importtime`.
+
+Usage :
+    python benchmarks/import_time.py [--module main] [--runs 5] [--budget-ms 800] [--top 15]
+
+Le script importe le module d'entrée des workers dans un interpréteur neuf, avec
+SCHEMA_AUTO_CREATE=0 comme en production, et analyse la sortie de -X importtime.
+Il échoue (code 1) si le budget est dépassé ou si python-docx est chargé au démarrage.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules qui ne doivent être chargés qu'au premier rendu d'un document
+LAZY_MODULES = ('docx', 'lxml')
+
+
+def run_importtime(module, env):
+    """Importe le module dans un nouvel interpréteur et retourne {module: (self_us, cumul_us)}"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Import de {module} impossible :\n{result.stderr[-2000:]}")
+
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        timings[name.strip()] = (int(self_us), int(cumulative_us))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default='main', help="Module d'entrée des workers")
+    parser.add_argument('--runs', type=int, default=5, help="Nombre d'imports mesurés")
+    parser.add_argument('--budget-ms', type=float, default=None, help="Temps d'import médian maximal")
+    parser.add_argument('--top', type=int, default=15, help="Nombre de modules les plus coûteux à afficher")
+    parser.add_argument('--json', dest='json_path', help="Fichier de sortie JSON")
+    args = parser.parse_args()
+
+    env = dict(os.environ, SCHEMA_AUTO_CREATE='0', PYTHONDONTWRITEBYTECODE='0')
+    env.setdefault('DATABASE_URL', 'sqlite:///:memory:')
+
+    # Premier import non mesuré pour compiler les .pyc
+    run_importtime(args.module, env)
+
+    totals_ms = []
+    last_timings = {}
+    for _ in range(args.runs):
+        last_timings = run_importtime(args.module, env)
+        totals_ms.append(last_timings[args.module][1] / 1000)
+
+    median_ms = statistics.median(totals_ms)
+    lazy_loaded = sorted(name for name in last_timings if name.split('.')[0] in LAZY_MODULES)
+    slowest = sorted(last_timings.items(), key=lambda item: item[1][0], reverse=True)[:args.top]
+
+    print(f"Import de '{args.module}' : médiane {median_ms:.1f} ms "
+          f"(min {min(totals_ms):.1f} ms, max {max(totals_ms):.1f} ms, {args.runs} essais)")
+    print(f"{'self [ms]':>10} {'cumul [ms]':>11}  module")
+    for name, (self_us, cumulative_us) in slowest:
+        print(f"{self_us / 1000:>10.1f} {cumulative_us / 1000:>11.1f}  {name}")
+
+    report = {
+        'module': args.module,
+        'runs_ms': totals_ms,
+        'median_ms': median_ms,
+        'lazy_modules_loaded': lazy_loaded,
+        'slowest': [{'module': name, 'self_ms': s / 1000, 'cumulative_ms': c / 1000}
+                    for name, (s, c) in slowest],
+    }
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    failed = False
+    if lazy_loaded:
+        print(f"ECHEC : modules chargés au démarrage alors qu'ils devraient être paresseux : {', '.join(lazy_loaded[:5])}")
+        failed = True
+    if args.budget_ms is not None and median_ms > args.budget_ms:
+        print(f"ECHEC : {median_ms:.1f} ms > budget de {args.budget_ms:.1f} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
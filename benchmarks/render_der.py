@@ -0,0 +1,154 @@
+"""Micro-benchmark du rendu des DER et de la substitution des tags.
+
+Usage :
+    python benchmarks/render_der.py [--iterations 20] [--sizes 0x10,5x50,20x200] [--in-memory]
+                                    [--max-ms-per-doc 250] [--max-rss-mb 300] [--json resultats.json]
+
+Rend le DER à partir de templates_docs/der_template.docx, puis à partir de modèles
+synthétiques de taille croissante (TABLESxPARAGRAPHES, tableaux de 5x4 cellules et un tag
+par paragraphe et par cellule). Pour chaque modèle, le script mesure le temps par phase
+(chargement, substitution, sauvegarde), le débit en documents/s et le pic de mémoire
+résidente du processus. Avec --in-memory, la sauvegarde se fait dans un tampon mémoire
+(render_to_buffer) au lieu d'un fichier. Il échoue (code 1) si un budget configuré est dépassé.
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('DATABASE_URL', 'sqlite:///:memory:')
+
+TABLE_ROWS, TABLE_COLS = 5, 4
+
+
+def sample_client():
+    """Client factice portant les champs utilisés par le DER"""
+    return SimpleNamespace(
+        nom='DUPONT', prenom='Marie', email='marie.dupont@example.fr', telephone='0601020304',
+        ville='Lyon', adresse='12 rue de la République, 69002 Lyon', profession='Ingénieure',
+        date_entree_relation=date(2024, 3, 1), date_naissance=date(1980, 6, 15),
+    )
+
+
+def build_synthetic_template(path, tags, n_tables, n_paragraphs):
+    """Crée un modèle Word synthétique contenant des tags dans des paragraphes et des tableaux"""
+    from docx import Document
+
+    doc = Document()
+    for i in range(n_paragraphs):
+        doc.add_paragraph(f"Paragraphe {i} : {tags[i % len(tags)]} fin du paragraphe.")
+    for t in range(n_tables):
+        table = doc.add_table(rows=TABLE_ROWS, cols=TABLE_COLS)
+        for r, row in enumerate(table.rows):
+            for c, cell in enumerate(row.cells):
+                cell.text = f"{tags[(t + r + c) % len(tags)]} ({r},{c})"
+    doc.save(path)
+
+
+def peak_rss_mb():
+    # ru_maxrss est exprimé en kilo-octets sous Linux et en octets sous macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def bench_template(template_path, replacements, iterations, output_dir, in_memory=False):
+    """Rend le modèle plusieurs fois et mesure chaque phase"""
+    from document_generator import load_template, substitute_placeholders, render_to_buffer
+
+    phases = {'load': [], 'substitute': [], 'save': []}
+    output_path = os.path.join(output_dir, 'rendu.docx')
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        doc = load_template(template_path)
+        t1 = time.perf_counter()
+        substitute_placeholders(doc, replacements)
+        t2 = time.perf_counter()
+        if in_memory:
+            output_bytes = render_to_buffer(doc, 'rendu.docx').size
+        else:
+            doc.save(output_path)
+            output_bytes = os.path.getsize(output_path)
+        t3 = time.perf_counter()
+        phases['load'].append((t1 - t0) * 1000)
+        phases['substitute'].append((t2 - t1) * 1000)
+        phases['save'].append((t3 - t2) * 1000)
+
+    totals = [sum(values) for values in zip(*phases.values())]
+    return {
+        'iterations': iterations,
+        'phases_ms': {name: statistics.median(values) for name, values in phases.items()},
+        'ms_per_doc': statistics.median(totals),
+        'docs_per_second': 1000 / statistics.mean(totals),
+        'output_bytes': output_bytes,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def parse_sizes(value):
+    sizes = []
+    for item in value.split(','):
+        tables, paragraphs = item.lower().split('x')
+        sizes.append((int(tables), int(paragraphs)))
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=20, help="Rendus mesurés par modèle")
+    parser.add_argument('--sizes', default='0x10,5x50,20x200,50x500',
+                        help="Modèles synthétiques TABLESxPARAGRAPHES séparés par des virgules")
+    parser.add_argument('--in-memory', action='store_true', help="Sauvegarder dans un tampon mémoire plutôt que sur disque")
+    parser.add_argument('--max-ms-per-doc', type=float, help="Budget de temps médian par DER (modèle réel)")
+    parser.add_argument('--max-rss-mb', type=float, help="Budget de mémoire résidente maximale du processus")
+    parser.add_argument('--json', dest='json_path', help="Fichier de sortie JSON")
+    args = parser.parse_args()
+
+    from document_generator import DER_TEMPLATE_PATH, build_der_replacements
+
+    replacements = build_der_replacements(sample_client())
+    tags = list(replacements)
+    results = {}
+
+    with tempfile.TemporaryDirectory(prefix='cif_render_') as workdir:
+        # Rendu d'échauffement : import de python-docx et de lxml
+        bench_template(DER_TEMPLATE_PATH, replacements, 1, workdir)
+
+        results['der_template'] = bench_template(DER_TEMPLATE_PATH, replacements, args.iterations, workdir,
+                                                 args.in_memory)
+        for n_tables, n_paragraphs in parse_sizes(args.sizes):
+            name = f'synthetic_{n_tables}x{n_paragraphs}'
+            template_path = os.path.join(workdir, f'{name}.docx')
+            build_synthetic_template(template_path, tags, n_tables, n_paragraphs)
+            results[name] = bench_template(template_path, replacements, args.iterations, workdir, args.in_memory)
+            results[name]['tags'] = n_paragraphs + n_tables * TABLE_ROWS * TABLE_COLS
+
+    print(f"{'modèle':<24} {'load ms':>8} {'subst ms':>9} {'save ms':>8} {'ms/doc':>8} {'docs/s':>8} {'RSS Mo':>8}")
+    for name, stats in results.items():
+        phases = stats['phases_ms']
+        print(f"{name:<24} {phases['load']:>8.1f} {phases['substitute']:>9.1f} {phases['save']:>8.1f} "
+              f"{stats['ms_per_doc']:>8.1f} {stats['docs_per_second']:>8.1f} {stats['peak_rss_mb']:>8.1f}")
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    failures = []
+    if args.max_ms_per_doc is not None and results['der_template']['ms_per_doc'] > args.max_ms_per_doc:
+        failures.append(f"DER : {results['der_template']['ms_per_doc']:.1f} ms/doc > budget de {args.max_ms_per_doc:.1f} ms")
+    if args.max_rss_mb is not None and peak_rss_mb() > args.max_rss_mb:
+        failures.append(f"mémoire : {peak_rss_mb():.1f} Mo > budget de {args.max_rss_mb:.1f} Mo")
+    for failure in failures:
+        print(f"ECHEC : {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,190 @@
+"""Micro-benchmark du filtrage sanctions / PEP (index de noms en mémoire).
+
+Usage :
+    python benchmarks/screening.py [--entries 20000] [--queries 2000] [--seed 42]
+                                   [--max-ms 10] [--min-recall 0.95] [--json resultats.json]
+                                   [--clients 100000 --delta 500 --workers 4 --max-rescreen-s 30]
+
+Génère une liste synthétique de personnes (avec alias), construit l'index, puis filtre des
+clients dont une partie sont des variantes d'entrées de la liste (accents retirés, prénom et
+nom inversés, faute de frappe, particule ajoutée) et le reste des noms sans correspondance.
+Le script mesure le temps de construction de l'index, la latence par client (médiane et
+99e centile), le rappel sur les variantes et le taux de faux positifs. Il échoue (code 1)
+si un budget configuré est dépassé.
+
+Avec --clients, le script mesure aussi le refiltrage incrémental : construction de l'index
+des clients, puis recherche des entrées ajoutées ou modifiées (--delta) réparties sur
+--workers processus (rescreening.search_many).
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('DATABASE_URL', 'sqlite:///:memory:')
+
+FIRST_NAMES = ['Jean', 'Marie', 'Élodie', 'François', 'Hélène', 'Mohamed', 'Ahmed', 'Fatima', 'Olga', 'Ivan',
+               'Sergueï', 'Dmitri', 'Ana', 'José', 'Jürgen', 'Chloé', 'Grégoire', 'Ali', 'Youssef', 'Léa']
+SYLLABLES = ['ba', 'ko', 'ri', 'ne', 'tal', 'mor', 'vis', 'ka', 'dro', 'lin', 'sa', 'pe', 'zu', 'gar', 'mi',
+             'stel', 'ov', 'ev', 'ian', 'ez', 'bor', 'cha', 'den', 'fu', 'gil', 'hor', 'jas', 'kel', 'lu', 'mon',
+             'nor', 'pol', 'ques', 'rud', 'sen', 'tur', 'val', 'wen', 'yak', 'zim']
+
+
+def random_surname(rng):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+
+
+def synthetic_entries(count, rng):
+    """Entrées de liste synthétiques (1 à 3 noms par entrée)"""
+    from screening import _entry
+
+    entries = []
+    for i in range(count):
+        surname = random_surname(rng)
+        names = [f'{rng.choice(FIRST_NAMES)} {surname}' for _ in range(rng.randint(1, 3))]
+        birth = f'{rng.randint(1940, 2000)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}'
+        entries.append(_entry('synthetique', i, names, birth, rng.choice(['SANCTION', 'PEP'])))
+    return entries
+
+
+def variant(name, rng):
+    """Variante réaliste d'un nom de la liste"""
+    first, last = name.split(' ', 1)
+    kind = rng.choice(['accents', 'order', 'typo', 'particle'])
+    if kind == 'accents':
+        import unicodedata
+        return ''.join(c for c in unicodedata.normalize('NFKD', name.upper()) if not unicodedata.combining(c))
+    if kind == 'order':
+        return f'{last} {first}'
+    if kind == 'typo':
+        position = rng.randrange(1, len(last))
+        return f'{first} {last[:position]}{rng.choice("aeiou")}{last[position + 1:]}'
+    return f'{first} de {last}'
+
+
+def bench_rescreening(entries, n_clients, n_delta, workers, rng):
+    """Refiltrage d'une mise à jour de liste contre un portefeuille synthétique"""
+    from screening import NameIndex
+    from rescreening import search_many
+
+    clients = [(i, f'{rng.choice(FIRST_NAMES)} {random_surname(rng)}') for i in range(n_clients)]
+    t0 = time.perf_counter()
+    index = NameIndex()
+    for client_id, name in clients:
+        index.add(client_id, name)
+    build_s = time.perf_counter() - t0
+
+    # Mise à jour hebdomadaire : nouvelles entrées, dont une partie correspond à des clients
+    delta = rng.sample(entries, min(n_delta, len(entries)))
+    planted = {}
+    for i, entry in enumerate(delta[:n_delta // 10]):
+        client_id, name = rng.choice(clients)
+        delta[i] = entry._replace(noms=(variant(name, rng),), date_naissance=None)
+        planted[(delta[i].liste, delta[i].entree_id)] = client_id
+
+    queries = [((entry.liste, entry.entree_id), nom, entry.date_naissance) for entry in delta for nom in entry.noms]
+    t0 = time.perf_counter()
+    hits = search_many(index, queries, workers)
+    search_s = time.perf_counter() - t0
+    found = {(key, match.key) for key, match in hits}
+    return {
+        'clients': n_clients,
+        'delta_entries': len(delta),
+        'workers': workers,
+        'index_build_s': build_s,
+        'search_s': search_s,
+        'total_s': build_s + search_s,
+        'hits': len(found),
+        'recall': sum((key, client_id) in found for key, client_id in planted.items()) / len(planted) if planted else 1.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, default=20000, help="Entrées de la liste synthétique")
+    parser.add_argument('--queries', type=int, default=2000, help="Clients filtrés (moitié de variantes)")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--max-ms', type=float, help="Budget de latence au 99e centile par client")
+    parser.add_argument('--min-recall', type=float, help="Rappel minimal sur les variantes")
+    parser.add_argument('--json', dest='json_path', help="Fichier de sortie JSON")
+    parser.add_argument('--clients', type=int, default=0, help="Clients du portefeuille pour le refiltrage (0 : ignoré)")
+    parser.add_argument('--delta', type=int, default=500, help="Entrées ajoutées ou modifiées par la mise à jour")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Processus de recherche du refiltrage")
+    parser.add_argument('--max-rescreen-s', type=float, help="Budget de durée totale du refiltrage")
+    args = parser.parse_args()
+
+    from screening import build_list_index
+
+    rng = random.Random(args.seed)
+    entries = synthetic_entries(args.entries, rng)
+
+    t0 = time.perf_counter()
+    index = build_list_index(entries)
+    build_ms = (time.perf_counter() - t0) * 1000
+
+    queries = []
+    for _ in range(args.queries // 2):
+        entry = rng.choice(entries)
+        queries.append((variant(rng.choice(entry.noms), rng), entry.date_naissance, (entry.liste, entry.entree_id)))
+    for _ in range(args.queries - len(queries)):
+        queries.append((f'{rng.choice(FIRST_NAMES)} {random_surname(rng)}{random_surname(rng).lower()}', None, None))
+    rng.shuffle(queries)
+
+    latencies = []
+    found = expected = false_positives = 0
+    for name, birth, key in queries:
+        t0 = time.perf_counter()
+        matches = index.search(name, birth)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        if key is not None:
+            expected += 1
+            found += any(match.key == key for match in matches)
+        elif matches:
+            false_positives += 1
+
+    latencies.sort()
+    results = {
+        'entries': len(entries),
+        'indexed_names': sum(len(entry.noms) for entry in entries),
+        'build_ms': build_ms,
+        'p50_ms': statistics.median(latencies),
+        'p99_ms': latencies[int(len(latencies) * 0.99) - 1],
+        'recall': found / expected if expected else 1.0,
+        'false_positive_rate': false_positives / (len(queries) - expected) if len(queries) > expected else 0.0,
+    }
+
+    print(f"{'entrées':>8} {'noms':>8} {'index ms':>9} {'p50 ms':>7} {'p99 ms':>7} {'rappel':>7} {'faux +':>7}")
+    print(f"{results['entries']:>8} {results['indexed_names']:>8} {results['build_ms']:>9.0f} {results['p50_ms']:>7.2f} "
+          f"{results['p99_ms']:>7.2f} {results['recall']:>7.1%} {results['false_positive_rate']:>7.1%}")
+
+    if args.clients:
+        results['rescreening'] = bench_rescreening(entries, args.clients, args.delta, args.workers, rng)
+        rescreening = results['rescreening']
+        print(f"\n{'clients':>8} {'delta':>6} {'proc.':>6} {'index s':>8} {'recherche s':>12} {'total s':>8} {'rappel':>7}")
+        print(f"{rescreening['clients']:>8} {rescreening['delta_entries']:>6} {rescreening['workers']:>6} "
+              f"{rescreening['index_build_s']:>8.1f} {rescreening['search_s']:>12.1f} {rescreening['total_s']:>8.1f} "
+              f"{rescreening['recall']:>7.1%}")
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    failures = []
+    if args.max_ms is not None and results['p99_ms'] > args.max_ms:
+        failures.append(f"latence p99 : {results['p99_ms']:.2f} ms > budget de {args.max_ms:.2f} ms")
+    if args.min_recall is not None and results['recall'] < args.min_recall:
+        failures.append(f"rappel : {results['recall']:.1%} < minimum de {args.min_recall:.1%}")
+    if args.max_rescreen_s is not None and args.clients and results['rescreening']['total_s'] > args.max_rescreen_s:
+        failures.append(f"refiltrage : {results['rescreening']['total_s']:.1f} s > budget de {args.max_rescreen_s:.1f} s")
+    for failure in failures:
+        print(f"ECHEC : {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
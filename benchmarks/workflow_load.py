@@ -0,0 +1,343 @@
+"""Générateur de charge synthétique pour le workflow d'onboarding.
+
+Usage :
+    python benchmarks/workflow_load.py [--clients 1000] [--workflows 50] [--concurrency 4]
+                                       [--database sqlite:////tmp/bench.db] [--output resultats.json]
+                                       [--compare resultats_precedents.json]
+
+Le script peuple une base avec N clients synthétiques (documents, pièces justificatives,
+profils investisseur) puis rejoue le workflow complet via le client de test Flask :
+/onboarding -> send_der -> confirm_der_signed -> upload_piece_justificative (x4)
+-> complete_kyc -> generate_documents -> client_details, avec des consultations du tableau
+de bord en parallèle. Il mesure pour chaque route les latences p50/p95/p99, le débit,
+le nombre de requêtes SQL par requête HTTP et les erreurs signalées par message flash.
+Un workflow s'arrête à sa première étape en échec et le script sort avec le code 1 dès
+qu'une requête est en erreur. Les résultats sont écrits en JSON pour comparer les commits entre eux.
+"""
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PIECES_REQUISES = ['PIECE_IDENTITE', 'AVIS_IMPOSITION', 'JUSTIFICATIF_DOMICILE', 'RELEVE_COMPTE']
+NOMS = ['MARTIN', 'BERNARD', 'DUBOIS', 'THOMAS', 'ROBERT', 'RICHARD', 'PETIT', 'DURAND', 'LEROY', 'MOREAU']
+PRENOMS = ['Jean', 'Marie', 'Pierre', 'Sophie', 'Luc', 'Camille', 'Julien', 'Claire', 'Hugo', 'Léa']
+VILLES = ['Paris', 'Lyon', 'Marseille', 'Bordeaux', 'Lille', 'Nantes', 'Toulouse', 'Nice']
+
+# Compteurs par thread : requêtes SQL et messages flash d'erreur de la requête HTTP en cours
+_request_stats = threading.local()
+
+
+def percentile(values, pct):
+    """Percentile par rang le plus proche sur une liste de valeurs"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def load_app(database_uri, upload_folder):
+    """Importe l'application sur la base de benchmark et branche le compteur de requêtes SQL"""
+    os.environ['DATABASE_URL'] = database_uri
+    os.environ['SCHEMA_AUTO_CREATE'] = '1'
+
+    import logging
+    from flask import message_flashed
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    import main
+
+    logging.getLogger().setLevel(logging.WARNING)
+    main.app.config['UPLOAD_FOLDER'] = upload_folder
+
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        _request_stats.queries = getattr(_request_stats, 'queries', 0) + 1
+
+    # Les routes signalent leurs échecs par message flash, puis redirigent ou réaffichent la page
+    def record_flash(sender, message, category):
+        if category == 'error':
+            _request_stats.errors = getattr(_request_stats, 'errors', 0) + 1
+
+    message_flashed.connect(record_flash, main.app, weak=False)
+    return main.app
+
+
+def seed_database(app, count, batch_size=1000):
+    """Crée N clients synthétiques avec leurs documents, pièces et profils"""
+    from app import db
+    from models import (Client, Document, PieceJustificative, ProfilInvestisseur, WorkflowStatus,
+                        DocumentType, TypeInvestisseur, NiveauConnaissance, RiskTolerance,
+                        InvestmentHorizon, TypeSouscripteur)
+
+    statuts = list(WorkflowStatus)
+    kyc_types = [DocumentType.PIECE_IDENTITE, DocumentType.JUSTIFICATIF_DOMICILE,
+                 DocumentType.AVIS_IMPOSITION, DocumentType.RELEVE_BANCAIRE]
+    rng = random.Random(42)
+    now = datetime.utcnow()
+
+    with app.app_context():
+        offset = db.session.query(db.func.max(Client.id)).scalar() or 0
+        for start in range(0, count, batch_size):
+            clients = []
+            for i in range(start, min(start + batch_size, count)):
+                created = now - timedelta(days=rng.randint(0, 3 * 365))
+                clients.append(Client(
+                    nom=rng.choice(NOMS), prenom=rng.choice(PRENOMS),
+                    email=f'seed{offset + i}@bench.local', telephone=f'06{rng.randint(0, 10**8):08d}',
+                    ville=rng.choice(VILLES), date_naissance=(now - timedelta(days=rng.randint(20, 80) * 365)).date(),
+                    revenus_mensuels=rng.randint(1500, 20000), patrimoine_total=rng.randint(0, 2_000_000),
+                    charges_mensuelles=rng.randint(300, 5000), statut_workflow=rng.choice(statuts),
+                    date_creation=created, date_derniere_maj=created + timedelta(days=rng.randint(0, 60)),
+                    date_entree_relation=created.date(),
+                ))
+            db.session.add_all(clients)
+            db.session.flush()
+
+            for client in clients:
+                for doc_type in kyc_types:
+                    db.session.add(Document(
+                        client_id=client.id, nom_fichier=f'{client.id}_{doc_type.name}.pdf',
+                        nom_original=f'{doc_type.name}.pdf', type_document=doc_type,
+                        chemin_fichier=f'uploads/{client.id}_{doc_type.name}.pdf',
+                        taille_fichier=rng.randint(50_000, 4_000_000), date_upload=client.date_creation,
+                    ))
+                for type_piece in PIECES_REQUISES:
+                    db.session.add(PieceJustificative(
+                        client_id=client.id, type_piece=type_piece, nom_fichier=f'{type_piece}.pdf',
+                        fichier_path=f'uploads/{client.id}_{type_piece}.pdf', date_upload=client.date_creation,
+                        statut=WorkflowStatus.DOCUMENTS_UPLOADED,
+                    ))
+                db.session.add(ProfilInvestisseur(
+                    client_id=client.id, type_investisseur=rng.choice(list(TypeInvestisseur)),
+                    niveau_connaissance=rng.choice(list(NiveauConnaissance)),
+                    tolerance_risque=rng.choice(list(RiskTolerance)), srri_score=rng.randint(1, 7),
+                    horizon_investissement=rng.choice(list(InvestmentHorizon)),
+                    type_souscripteur=TypeSouscripteur.PERSONNE_PHYSIQUE,
+                    revenus_annuels=client.revenus_mensuels * 12, patrimoine_total=client.patrimoine_total,
+                ))
+            db.session.commit()
+
+
+class StepFailed(Exception):
+    """Étape du workflow en échec : la suite du workflow n'est pas rejouée (elle ne mesurerait que des erreurs)"""
+
+    def __init__(self, route):
+        super().__init__(route)
+        self.route = route
+
+
+class Recorder:
+    """Collecte les mesures par route de façon thread-safe"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.aborted = defaultdict(int)
+        self.completed = 0
+        self.lock = threading.Lock()
+
+    def request(self, client, route, method, url, **kwargs):
+        _request_stats.queries = 0
+        _request_stats.errors = 0
+        start = time.perf_counter()
+        response = client.open(url, method=method, **kwargs)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        queries = _request_stats.queries
+        error = response.status_code >= 400 or _request_stats.errors > 0
+
+        with self.lock:
+            self.samples[route].append((elapsed_ms, queries, error))
+        if error:
+            raise StepFailed(route)
+        return response
+
+
+def run_workflow(app, recorder, index, run_id):
+    """Rejoue le workflow complet d'un nouveau client, jusqu'à la première étape en échec"""
+    try:
+        _replay_workflow(app, recorder, index, run_id)
+    except StepFailed as e:
+        with recorder.lock:
+            recorder.aborted[e.route] += 1
+    else:
+        with recorder.lock:
+            recorder.completed += 1
+
+
+def _replay_workflow(app, recorder, index, run_id):
+    client = app.test_client()
+    response = recorder.request(client, 'client_onboarding', 'POST', '/onboarding', data={
+        'nom': NOMS[index % len(NOMS)], 'prenom': PRENOMS[index % len(PRENOMS)],
+        'email': f'bench{run_id}_{index}@bench.local', 'telephone': '0600000000',
+        'ville': VILLES[index % len(VILLES)], 'date_entree_relation': '2024-01-15',
+    })
+    if response.status_code != 302 or '/client/' not in response.location:
+        raise StepFailed('client_onboarding')
+    client_id = int(response.location.rstrip('/').rsplit('/', 1)[1])
+
+    recorder.request(client, 'send_der_signature', 'GET', f'/send_der/{client_id}')
+    recorder.request(client, 'confirm_der_signed', 'GET', f'/confirm_der_signed/{client_id}')
+    for type_piece in PIECES_REQUISES:
+        recorder.request(client, 'upload_piece_justificative', 'POST',
+                         f'/upload_piece_justificative/{client_id}',
+                         data={'type_piece': type_piece, 'file': (io.BytesIO(b'%PDF-1.4 bench\n' * 64), f'{type_piece}.pdf')},
+                         content_type='multipart/form-data')
+    recorder.request(client, 'complete_kyc', 'POST', f'/complete_kyc/{client_id}', data={
+        'type_investisseur': 'NON_PROFESSIONNEL', 'niveau_connaissance': 'INVESTISSEUR_INFORME',
+        'type_souscripteur': 'PERSONNE_PHYSIQUE', 'tolerance_risque': 'MOYENNE', 'srri_score': '4',
+        'horizon_investissement': 'MOYEN', 'duree_investissement_annees': '5', 'classification_sfdr': 'ARTICLE_8',
+        'revenus_annuels': '60000', 'patrimoine_total': '250000', 'risque_perte_capital': '1',
+        'objectifs_investissement': ['PREPARER_RETRAITE', 'DIVERSIFIER_PATRIMOINE'],
+    })
+    recorder.request(client, 'generate_documents', 'GET', f'/generate_documents/{client_id}')
+    recorder.request(client, 'client_details', 'GET', f'/client/{client_id}')
+
+    # Consultations en lecture concurrentes des écritures
+    if index % 5 == 0:
+        recorder.request(client, 'dashboard', 'GET', '/dashboard')
+        recorder.request(client, 'index', 'GET', '/')
+
+
+def summarize(samples, wall_seconds):
+    routes = {}
+    for route, values in sorted(samples.items()):
+        latencies = [v[0] for v in values]
+        queries = [v[1] for v in values]
+        routes[route] = {
+            'count': len(values),
+            'errors': sum(1 for v in values if v[2]),
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'mean_ms': sum(latencies) / len(latencies),
+            'throughput_rps': len(values) / wall_seconds if wall_seconds else None,
+            'queries_per_request': sum(queries) / len(queries),
+        }
+    return routes
+
+
+def print_report(report, baseline=None):
+    print(f"{'route':<28} {'n':>5} {'err':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8} {'SQL/req':>8}"
+          + ('  Δp95' if baseline else ''))
+    for route, stats in report['routes'].items():
+        line = (f"{route:<28} {stats['count']:>5} {stats['errors']:>4} {stats['p50_ms']:>8.1f} "
+                f"{stats['p95_ms']:>8.1f} {stats['p99_ms']:>8.1f} {stats['throughput_rps']:>8.1f} "
+                f"{stats['queries_per_request']:>8.1f}")
+        previous = (baseline or {}).get('routes', {}).get(route)
+        if previous and previous.get('p95_ms'):
+            line += f"  {(stats['p95_ms'] / previous['p95_ms'] - 1) * 100:+.0f}%"
+        print(line)
+    totals = report['totals']
+    print(f"\n{totals['requests']} requêtes, {totals['workflows']} workflows en {totals['wall_seconds']:.2f}s : "
+          f"{totals['throughput_rps']:.1f} req/s, {totals['workflows_per_second']:.2f} workflows/s")
+    if totals['errors']:
+        steps = ', '.join(f"{route} ({count})" for route, count in sorted(totals['aborted_at'].items()))
+        print(f"ÉCHEC : {totals['errors']} requête(s) en erreur, {totals['workflows'] - totals['completed_workflows']} "
+              f"workflow(s) interrompu(s) à : {steps}. Les mesures ne couvrent pas le workflow complet.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=1000, help="Nombre de clients synthétiques à créer")
+    parser.add_argument('--workflows', type=int, default=50, help="Nombre de workflows complets à rejouer")
+    parser.add_argument('--concurrency', type=int, default=4, help="Nombre de workflows simultanés")
+    parser.add_argument('--database', help="URI de la base de benchmark (par défaut un fichier SQLite temporaire)")
+    parser.add_argument('--output', help="Fichier JSON des résultats (par défaut benchmarks/results/)")
+    parser.add_argument('--compare', help="Fichier JSON d'un run précédent à comparer")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='cif_bench_')
+    database_uri = args.database or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    app = load_app(database_uri, os.path.join(workdir, 'uploads'))
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+    generated_dir = os.path.join(app.root_path, 'generated_docs')
+    existing_docs = set(os.listdir(generated_dir)) if os.path.isdir(generated_dir) else set()
+
+    seed_start = time.perf_counter()
+    seed_database(app, args.clients)
+    seed_seconds = time.perf_counter() - seed_start
+    print(f"{args.clients} clients synthétiques créés en {seed_seconds:.2f}s")
+
+    recorder = Recorder()
+    run_id = int(time.time())
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for future in [pool.submit(run_workflow, app, recorder, i, run_id) for i in range(args.workflows)]:
+            future.result()
+    wall_seconds = time.perf_counter() - start
+
+    # Ne pas laisser les DER du benchmark dans le dossier de l'application
+    if os.path.isdir(generated_dir):
+        for name in set(os.listdir(generated_dir)) - existing_docs:
+            os.remove(os.path.join(generated_dir, name))
+
+    total_requests = sum(len(v) for v in recorder.samples.values())
+    total_errors = sum(1 for values in recorder.samples.values() for v in values if v[2])
+    report = {
+        'meta': {
+            'git_revision': git_revision(),
+            'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'python': platform.python_version(),
+            'database_backend': database_uri.split(':', 1)[0],
+            'clients': args.clients,
+            'workflows': args.workflows,
+            'concurrency': args.concurrency,
+            'seed_seconds': seed_seconds,
+        },
+        'totals': {
+            'requests': total_requests,
+            'workflows': args.workflows,
+            'wall_seconds': wall_seconds,
+            'throughput_rps': total_requests / wall_seconds,
+            'workflows_per_second': args.workflows / wall_seconds,
+            'errors': total_errors,
+            'error_rate': total_errors / total_requests if total_requests else 0,
+            'completed_workflows': recorder.completed,
+            'aborted_at': dict(recorder.aborted),
+        },
+        'routes': summarize(recorder.samples, wall_seconds),
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    output = args.output or os.path.join(
+        ROOT, 'benchmarks', 'results',
+        f"workflow_{report['meta']['git_revision'] or 'local'}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Résultats écrits dans {output}")
+    # Un run avec des erreurs ne mesure pas le workflow complet : code de sortie non nul
+    return 1 if total_errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
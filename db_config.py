@@ -0,0 +1,109 @@
+import os
+import logging
+import sqlite3
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Profils de moteur par backend, surchargeables par variables d'environnement
+SQLITE_PROFILE = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'busy_timeout_ms': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+}
+
+POSTGRES_PROFILE = {
+    'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+    'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+    'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+    'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 300)),
+    'statement_timeout_ms': int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 30000)),
+}
+
+
+def backend_name(database_uri):
+    """Retourne le nom du backend ('sqlite', 'postgresql', ...) d'une URI SQLAlchemy"""
+    scheme = database_uri.split(':', 1)[0]
+    backend = scheme.split('+', 1)[0]
+    return 'postgresql' if backend == 'postgres' else backend
+
+
+def normalize_database_uri(database_uri):
+    """Corrige les URI héritées (schéma postgres://, paramètre charset MySQL sur SQLite)"""
+    if database_uri.startswith('postgres://'):
+        database_uri = 'postgresql://' + database_uri[len('postgres://'):]
+    if backend_name(database_uri) == 'sqlite' and database_uri.endswith('?charset=utf8mb4'):
+        database_uri = database_uri[:-len('?charset=utf8mb4')]
+    return database_uri
+
+
+def build_engine_options(database_uri):
+    """Construit les options du moteur SQLAlchemy adaptées au backend"""
+    backend = backend_name(database_uri)
+
+    if backend == 'sqlite':
+        # Le délai d'attente du driver couvre l'ouverture ; busy_timeout est réappliqué par PRAGMA
+        return {
+            'pool_pre_ping': True,
+            'connect_args': {
+                'timeout': SQLITE_PROFILE['busy_timeout_ms'] / 1000,
+                'check_same_thread': False,
+            },
+        }
+
+    if backend == 'postgresql':
+        return {
+            'pool_pre_ping': True,
+            'pool_size': POSTGRES_PROFILE['pool_size'],
+            'max_overflow': POSTGRES_PROFILE['max_overflow'],
+            'pool_timeout': POSTGRES_PROFILE['pool_timeout'],
+            'pool_recycle': POSTGRES_PROFILE['pool_recycle'],
+            'connect_args': {
+                'options': f"-c statement_timeout={POSTGRES_PROFILE['statement_timeout_ms']}",
+            },
+        }
+
+    return {
+        'pool_recycle': 300,
+        'pool_pre_ping': True,
+    }
+
+
+@event.listens_for(Engine, 'connect')
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """Applique les PRAGMA du profil SQLite à chaque nouvelle connexion"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+
+    cursor = dbapi_connection.cursor()
+    try:
+        # Le mode WAL n'a pas de sens pour une base en mémoire
+        database_file = cursor.execute('PRAGMA database_list').fetchone()[2]
+        if database_file:
+            cursor.execute(f"PRAGMA journal_mode={SQLITE_PROFILE['journal_mode']}")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_PROFILE['synchronous']}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_PROFILE['busy_timeout_ms']}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_PROFILE['mmap_size']}")
+    finally:
+        cursor.close()
+
+
+def check_database_settings(engine):
+    """Vérifie au démarrage les réglages effectifs du moteur et les journalise"""
+    backend = engine.dialect.name
+    settings = {'backend': backend, 'pool': type(engine.pool).__name__}
+
+    with engine.connect() as connection:
+        if backend == 'sqlite':
+            for pragma in ('journal_mode', 'synchronous', 'busy_timeout', 'mmap_size'):
+                settings[pragma] = connection.execute(text(f'PRAGMA {pragma}')).scalar()
+        elif backend == 'postgresql':
+            settings['statement_timeout'] = connection.execute(text('SHOW statement_timeout')).scalar()
+            settings['pool_size'] = engine.pool.size()
+            settings['max_overflow'] = POSTGRES_PROFILE['max_overflow']
+
+    logger.info("Configuration base de données : %s",
+                ', '.join(f'{key}={value}' for key, value in settings.items()))
+    return settings
@@ -0,0 +1,136 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from functools import wraps
+import sqlalchemy as sa
+from sqlalchemy import event, text
+from flask import g, session, has_app_context, has_request_context
+from flask_sqlalchemy.session import Session
+
+logger = logging.getLogger(__name__)
+
+REPLICA_BIND_KEY = 'replica'
+
+# Retard de réplication toléré avant de revenir sur la base primaire
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', 5))
+# Intervalle entre deux mesures du retard de la réplique
+REPLICA_LAG_CHECK_INTERVAL = float(os.environ.get('REPLICA_LAG_CHECK_INTERVAL', 5))
+# Durée pendant laquelle un navigateur qui vient d'écrire reste sur la primaire (lecture après écriture)
+REPLICA_STICKY_SECONDS = float(os.environ.get('REPLICA_STICKY_SECONDS', 10))
+
+_replica_state = {'checked_at': 0.0, 'usable': False, 'lag': None}
+_replica_lock = threading.Lock()
+
+
+def measure_replica_lag(engine):
+    """Mesure le retard de la réplique en secondes (0 pour les backends sans réplication native)"""
+    with engine.connect() as connection:
+        if engine.dialect.name == 'postgresql':
+            lag = connection.execute(text(
+                "SELECT CASE "
+                "WHEN NOT pg_is_in_recovery() THEN 0 "
+                "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+            )).scalar()
+            return float(lag)
+
+        # SQLite (copie locale de la base) : on vérifie seulement que la réplique répond
+        connection.execute(text('SELECT 1'))
+        return 0.0
+
+
+def replica_is_usable(engine):
+    """Indique si la réplique est joignable et suffisamment à jour (résultat mis en cache)"""
+    now = time.monotonic()
+    if now - _replica_state['checked_at'] < REPLICA_LAG_CHECK_INTERVAL:
+        return _replica_state['usable']
+
+    with _replica_lock:
+        if now - _replica_state['checked_at'] < REPLICA_LAG_CHECK_INTERVAL:
+            return _replica_state['usable']
+
+        try:
+            lag = measure_replica_lag(engine)
+        except Exception as e:
+            logger.warning("Réplique injoignable, lectures redirigées vers la primaire : %s", e)
+            lag = None
+
+        usable = lag is not None and lag <= REPLICA_MAX_LAG_SECONDS
+        if lag is not None and not usable:
+            logger.warning("Retard de la réplique %.1fs > %.1fs, lectures redirigées vers la primaire",
+                           lag, REPLICA_MAX_LAG_SECONDS)
+
+        _replica_state.update(checked_at=now, usable=usable, lag=lag)
+        return usable
+
+
+def _recent_write_by_client():
+    """Vrai si le navigateur courant a écrit récemment (lecture après écriture sur la primaire)"""
+    if not has_request_context():
+        return False
+    last_write = session.get('_db_last_write')
+    return last_write is not None and time.time() - last_write < REPLICA_STICKY_SECONDS
+
+
+class RoutingSession(Session):
+    """Session qui envoie les lectures des routes en lecture seule vers la réplique"""
+
+    def _wants_replica(self, clause):
+        if not has_app_context() or not g.get('db_read_only'):
+            return False
+        if REPLICA_BIND_KEY not in self._db.engines:
+            return False
+        # Les écritures et les lectures qui suivent une écriture restent sur la primaire
+        if isinstance(clause, sa.UpdateBase) or self._flushing:
+            return False
+        if self.new or self.dirty or self.deleted or g.get('db_wrote'):
+            return False
+        if _recent_write_by_client():
+            return False
+        return replica_is_usable(self._db.engines[REPLICA_BIND_KEY])
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self._wants_replica(clause):
+            return self._db.engines[REPLICA_BIND_KEY]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_write(session_, flush_context):
+    """Mémorise qu'une écriture a eu lieu pendant la requête"""
+    if has_app_context():
+        g.db_wrote = True
+
+
+@contextmanager
+def replica_reads():
+    """Exécute les requêtes de reporting du bloc sur la réplique si elle est disponible"""
+    previous = g.get('db_read_only', False)
+    g.db_read_only = True
+    try:
+        yield
+    finally:
+        g.db_read_only = previous
+
+
+def read_only_route(view):
+    """Décorateur pour les routes qui ne font que lire (tableau de bord, statistiques, exports)"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with replica_reads():
+            return view(*args, **kwargs)
+    return wrapper
+
+
+def init_replica_routing(app):
+    """Enregistre le suivi des écritures par navigateur pour la lecture après écriture"""
+    if REPLICA_BIND_KEY not in app.config.get('SQLALCHEMY_BINDS', {}):
+        return
+
+    @app.after_request
+    def remember_last_write(response):
+        if g.get('db_wrote'):
+            session['_db_last_write'] = time.time()
+        return response
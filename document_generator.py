@@ -1,62 +1,109 @@
 import os
-from docx import Document
-from docx.shared import Inches
-from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
+import io
+import hashlib
+from collections import namedtuple
 from datetime import datetime
 from app import app
 
+DOCX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+# Document rendu en mémoire : contenu, taille en octets et empreinte SHA-256
+RenderedDocument = namedtuple('RenderedDocument', ['filename', 'content', 'size', 'sha256'])
+
+# Modèle Word utilisé pour le DER
+DER_TEMPLATE_PATH = os.path.join(os.path.dirname(__file__), 'templates_docs', 'der_template.docx')
+
+# Contenu des modèles Word déjà lus, par chemin et date de modification
+_template_cache = {}
+
+def _template_bytes(template_path):
+    # Vérifier si le modèle existe
+    if not os.path.exists(template_path):
+        raise FileNotFoundError(f"Modèle DER non trouvé : {template_path}")
+
+    key = (template_path, os.path.getmtime(template_path))
+    content = _template_cache.get(key)
+    if content is None:
+        with open(template_path, 'rb') as f:
+            content = f.read()
+        for stale in [cached for cached in _template_cache if cached[0] == template_path]:
+            del _template_cache[stale]
+        _template_cache[key] = content
+    return content
+
+def load_template(template_path=DER_TEMPLATE_PATH):
+    """Charge un modèle Word (lu une seule fois depuis le disque)"""
+    # python-docx est chargé au premier rendu pour ne pas ralentir le démarrage des workers
+    from docx import Document
+
+    return Document(io.BytesIO(_template_bytes(template_path)))
+
+def warm_templates():
+    """Importe python-docx et charge les modèles Word avant le premier rendu (processus maître de gunicorn)"""
+    load_template()
+
+def build_der_replacements(client):
+    """Prépare les valeurs des tags du DER pour un client"""
+    return {
+        '{{date_entree_relation}}': client.date_entree_relation.strftime('%d/%m/%Y') if client.date_entree_relation else 'Non renseignée',
+        '{{ville_client}}': client.ville if hasattr(client, 'ville') and client.ville else 'Non renseignée',
+        '{{nom_client}}': client.nom or 'Non renseigné',
+        '{{prenom_client}}': client.prenom or 'Non renseigné',
+        '{{email_client}}': client.email or 'Non renseigné',
+        '{{telephone_client}}': client.telephone or 'Non renseigné',
+        '{{date_naissance_client}}': client.date_naissance.strftime('%d/%m/%Y') if client.date_naissance else 'Non renseignée',
+        '{{adresse_client}}': client.adresse or 'Non renseignée',
+        '{{profession_client}}': client.profession or 'Non renseignée'
+    }
+
+def substitute_placeholders(doc, replacements):
+    """Remplace les tags dans les paragraphes et les tableaux du document"""
+    # Remplacer les tags dans tous les paragraphes
+    for paragraph in doc.paragraphs:
+        for tag, value in replacements.items():
+            if tag in paragraph.text:
+                paragraph.text = paragraph.text.replace(tag, value)
+    
+    # Remplacer les tags dans les tableaux
+    for table in doc.tables:
+        for row in table.rows:
+            for cell in row.cells:
+                for tag, value in replacements.items():
+                    if tag in cell.text:
+                        cell.text = cell.text.replace(tag, value)
+
+def render_to_buffer(doc, filename):
+    """Sérialise un document python-docx en mémoire, sans passer par le disque"""
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    content = buffer.getvalue()
+    return RenderedDocument(filename=filename,
+                            content=content,
+                            size=len(content),
+                            sha256=hashlib.sha256(content).hexdigest())
+
+def render_der_document(client):
+    """Rend le DER d'un client en mémoire et retourne un RenderedDocument"""
+    doc = load_template()
+    substitute_placeholders(doc, build_der_replacements(client))
+    filename = f"DER_{client.nom}_{client.prenom}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.docx"
+    return render_to_buffer(doc, filename)
+
+def store_rendered_document(rendered, output_dir=None):
+    """Écrit un document rendu dans le stockage en une seule écriture et retourne son chemin"""
+    # Créer le dossier de destination s'il n'existe pas
+    output_dir = output_dir or os.path.join(app.root_path, 'generated_docs')
+    os.makedirs(output_dir, exist_ok=True)
+    
+    output_path = os.path.join(output_dir, rendered.filename)
+    with open(output_path, 'wb') as f:
+        f.write(rendered.content)
+    return output_path
+
 def generate_der_document(client):
     """Génère un Document d'Entrée en Relation (DER) pour le client en utilisant un modèle"""
     try:
-        # Chemin vers le modèle DER
-        template_path = os.path.join(os.path.dirname(__file__), 'templates_docs', 'der_template.docx')
-        
-        # Vérifier si le modèle existe
-        if not os.path.exists(template_path):
-            raise FileNotFoundError(f"Modèle DER non trouvé : {template_path}")
-        
-        # Charger le modèle
-        doc = Document(template_path)
-        
-        # Préparer les données de remplacement
-        replacements = {
-            '{{date_entree_relation}}': client.date_entree_relation.strftime('%d/%m/%Y') if client.date_entree_relation else 'Non renseignée',
-            '{{ville_client}}': client.ville if hasattr(client, 'ville') and client.ville else 'Non renseignée',
-            '{{nom_client}}': client.nom or 'Non renseigné',
-            '{{prenom_client}}': client.prenom or 'Non renseigné',
-            '{{email_client}}': client.email or 'Non renseigné',
-            '{{telephone_client}}': client.telephone or 'Non renseigné',
-            '{{date_naissance_client}}': client.date_naissance.strftime('%d/%m/%Y') if client.date_naissance else 'Non renseignée',
-            '{{adresse_client}}': client.adresse or 'Non renseignée',
-            '{{profession_client}}': client.profession or 'Non renseignée'
-        }
-        
-        # Remplacer les tags dans tous les paragraphes
-        for paragraph in doc.paragraphs:
-            for tag, value in replacements.items():
-                if tag in paragraph.text:
-                    paragraph.text = paragraph.text.replace(tag, value)
-        
-        # Remplacer les tags dans les tableaux
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    for tag, value in replacements.items():
-                        if tag in cell.text:
-                            cell.text = cell.text.replace(tag, value)
-        
-        # Créer le dossier de destination s'il n'existe pas
-        output_dir = os.path.join(app.root_path, 'generated_docs')
-        os.makedirs(output_dir, exist_ok=True)
-        
-        # Nom du fichier de sortie
-        filename = f"DER_{client.nom}_{client.prenom}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.docx"
-        output_path = os.path.join(output_dir, filename)
-        
-        # Sauvegarder le document personnalisé
-        doc.save(output_path)
-        
-        return output_path
+        return store_rendered_document(render_der_document(client))
         
     except Exception as e:
         print(f"Erreur lors de la génération du DER : {str(e)}")
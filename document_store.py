@@ -0,0 +1,255 @@
+import os
+import enum
+import hashlib
+import logging
+from datetime import datetime
+from sqlalchemy import event, inspect
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+from models import Document, DER, PieceJustificative, DocumentGenere, DocumentClient, DocumentType, ScanCheckpoint
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_BATCH_SIZE = int(os.environ.get('DOCUMENT_MIGRATION_BATCH_SIZE', 500))
+CHECKPOINT_NAME = 'documents_unifies'
+HASH_CHUNK_SIZE = 1024 * 1024
+
+_INSERTS = {
+    'sqlite': sqlite.insert,
+    'postgresql': postgresql.insert,
+}
+
+# Codes des anciennes tables sans équivalent direct dans DocumentType
+_TYPE_ALIASES = {
+    'RELEVE_COMPTE': DocumentType.RELEVE_BANCAIRE,
+    'DOCUMENT_KYC': DocumentType.KYC_DOCUMENT,
+}
+
+
+def file_features(path):
+    """Empreinte SHA-256 et taille d'un fichier (None si le fichier est absent)"""
+    if not path or not os.path.exists(path):
+        return None, None
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest(), os.path.getsize(path)
+
+
+def _document_type(value):
+    if isinstance(value, DocumentType):
+        return value
+    if value in _TYPE_ALIASES:
+        return _TYPE_ALIASES[value]
+    if value in DocumentType.__members__:
+        return DocumentType[value]
+    # Code ancien inconnu : la ligne est migrée en AUTRE plutôt que de bloquer la migration ou l'écriture
+    logger.warning("Type de document inconnu %r, enregistré comme %s", value, DocumentType.AUTRE.name)
+    return DocumentType.AUTRE
+
+
+def _statut(value):
+    return value.name if isinstance(value, enum.Enum) else value
+
+
+def _from_document(row):
+    return {
+        'type_document': _document_type(row.type_document),
+        'nom_fichier': row.nom_fichier,
+        'nom_original': row.nom_original,
+        'chemin_fichier': row.chemin_fichier,
+        'taille_fichier': row.taille_fichier,
+        'genere_automatiquement': bool(row.genere_automatiquement),
+        'date_creation': row.date_upload,
+        'date_envoi_signature': row.date_envoi_signature,
+        'date_signature': row.date_signature,
+        'signe': bool(row.signe),
+    }
+
+
+def _from_der(row):
+    nom_fichier = os.path.basename(row.fichier_path) if row.fichier_path else None
+    return {
+        'type_document': DocumentType.DER,
+        'nom_fichier': nom_fichier,
+        'nom_original': nom_fichier or DocumentType.DER.value,
+        'chemin_fichier': row.fichier_path,
+        'genere_automatiquement': True,
+        'statut': _statut(row.statut),
+        'date_creation': row.date_creation,
+        'date_envoi_signature': row.date_envoi_signature,
+        'date_signature': row.date_signature,
+        'signe': row.date_signature is not None,
+    }
+
+
+def _from_piece(row):
+    return {
+        'type_document': _document_type(row.type_piece),
+        'nom_fichier': row.nom_fichier,
+        'nom_original': row.nom_fichier,
+        'chemin_fichier': row.fichier_path,
+        'statut': _statut(row.statut),
+        'date_creation': row.date_upload,
+        'date_validation': row.date_validation,
+        'commentaire': row.commentaire,
+    }
+
+
+def _from_generated(row):
+    return {
+        'type_document': _document_type(row.type_document),
+        'nom_fichier': row.nom_fichier,
+        'nom_original': row.nom_fichier,
+        'chemin_fichier': row.fichier_path,
+        'genere_automatiquement': True,
+        'statut': _statut(row.statut),
+        'version': row.version or 1,
+        'date_creation': row.date_generation,
+        'date_envoi_signature': row.date_envoi_signature,
+        'date_signature': row.date_signature,
+        'signe': row.date_signature is not None,
+    }
+
+
+# Anciennes tables : modèle, attribut du chemin et conversion d'une ligne en ligne unifiée
+SOURCES = {
+    'documents': (Document, 'chemin_fichier', _from_document),
+    'der': (DER, 'fichier_path', _from_der),
+    'pieces_justificatives': (PieceJustificative, 'fichier_path', _from_piece),
+    'documents_generes': (DocumentGenere, 'fichier_path', _from_generated),
+}
+_COLUMNS = [column.name for column in DocumentClient.__table__.c if column.name != 'id']
+
+
+def unified_row(source_table, row, with_file=True):
+    """Ligne de documents_clients correspondant à une ligne d'une ancienne table"""
+    _, path_attr, convert = SOURCES[source_table]
+    values = dict.fromkeys(_COLUMNS)
+    values.update({'genere_automatiquement': False, 'signe': False, 'version': 1})
+    values.update(convert(row))
+    values.update({
+        'client_id': row.client_id,
+        'date_creation': values['date_creation'] or datetime.utcnow(),
+        'source_table': source_table,
+        'source_id': row.id,
+    })
+    if with_file:
+        values['empreinte'], size = file_features(getattr(row, path_attr))
+        values['taille_fichier'] = values['taille_fichier'] or size
+    else:
+        # Fichier inchangé : l'empreinte et la taille déjà calculées sont conservées
+        del values['empreinte']
+        if values['taille_fichier'] is None:
+            del values['taille_fichier']
+    return values
+
+
+def _upsert(connection, rows):
+    table = DocumentClient.__table__
+    stmt = _INSERTS[connection.dialect.name](table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.source_table, table.c.source_id],
+        set_={column: stmt.excluded[column] for column in rows[0] if column not in ('source_table', 'source_id')},
+    )
+    connection.execute(stmt, rows)
+
+
+# Couche de compatibilité : toute écriture dans une ancienne table est reportée dans la table unifiée,
+# dans la même transaction
+def _mirror(mapper, connection, target):
+    source_table = target.__table__.name
+    path_attr = SOURCES[source_table][1]
+    history = inspect(target).attrs[path_attr].history
+    # Le fichier n'est relu que s'il est nouveau ou remplacé
+    with_file = history.has_changes() or not history.unchanged
+    _upsert(connection, [unified_row(source_table, target, with_file)])
+
+
+def _remove(mapper, connection, target):
+    table = DocumentClient.__table__
+    connection.execute(table.delete().where(table.c.source_table == target.__table__.name,
+                                            table.c.source_id == target.id))
+
+
+for _model, _, _ in SOURCES.values():
+    event.listen(_model, 'after_insert', _mirror)
+    event.listen(_model, 'after_update', _mirror)
+    event.listen(_model, 'after_delete', _remove)
+
+
+_ready = False
+
+
+def unified_documents_ready():
+    """Vrai une fois la migration des anciennes tables terminée (les lectures passent alors par documents_clients)"""
+    global _ready
+    if not _ready:
+        _ready = db.session.get(ScanCheckpoint, CHECKPOINT_NAME) is not None
+    return _ready
+
+
+def client_documents(client_id):
+    """Tous les fichiers d'un client avec leurs aperçus, en une requête sur l'index (client_id, date_creation)"""
+    return (DocumentClient.query
+            .options(db.joinedload(DocumentClient.apercu))
+            .filter(DocumentClient.client_id == client_id)
+            .order_by(DocumentClient.date_creation.desc(), DocumentClient.id.desc()))
+
+
+def _migrate_table(source_table, batch_size):
+    model, _, _ = SOURCES[source_table]
+    table = DocumentClient.__table__
+    # Statuts et types sont lus bruts : les anciennes tables contiennent des valeurs hors WorkflowStatus
+    # et des codes de type inconnus des énumérations
+    columns = [db.cast(column, db.String(30)).label(column.name)
+               if column.name in ('statut', 'type_piece', 'type_document') else column
+               for column in model.__table__.c]
+    copied = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            db.select(*columns).where(model.id > last_id).order_by(model.id).limit(batch_size)).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        existing = {source_id: complete for source_id, complete in db.session.execute(
+            db.select(table.c.source_id, db.or_(table.c.empreinte.is_not(None), table.c.chemin_fichier.is_(None)))
+            .where(table.c.source_table == source_table, table.c.source_id.in_([row.id for row in rows])))}
+        values = [unified_row(source_table, row) for row in rows if not existing.get(row.id)]
+        if values:
+            # Une ligne déjà recopiée par la couche de compatibilité est à jour : seule l'empreinte y est ajoutée
+            stmt = _INSERTS[db.session.get_bind().dialect.name](table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c.source_table, table.c.source_id],
+                set_={'empreinte': stmt.excluded.empreinte,
+                      'taille_fichier': db.func.coalesce(table.c.taille_fichier, stmt.excluded.taille_fichier)})
+            db.session.execute(stmt, values)
+        db.session.commit()
+        copied += sum(row.id not in existing for row in rows)
+
+    # Lignes supprimées de l'ancienne table pendant la copie
+    removed = db.session.execute(table.delete().where(
+        table.c.source_table == source_table,
+        table.c.source_id.not_in(db.select(model.id)))).rowcount
+    db.session.commit()
+    return copied, removed
+
+
+def migrate_documents(batch_size=MIGRATION_BATCH_SIZE):
+    """Migration en ligne des quatre anciennes tables vers documents_clients, par lots courts
+    (l'application reste en service ; la reprise après interruption ne recopie que les lignes manquantes)"""
+    stats = {}
+    for source_table in SOURCES:
+        stats[source_table] = _migrate_table(source_table, batch_size)
+        logger.info("Documents %s : %d copiés, %d supprimés", source_table, *stats[source_table])
+
+    checkpoint = db.session.get(ScanCheckpoint, CHECKPOINT_NAME)
+    if checkpoint is None:
+        checkpoint = ScanCheckpoint(nom=CHECKPOINT_NAME, date_execution=datetime.utcnow())
+        db.session.add(checkpoint)
+    checkpoint.date_execution = datetime.utcnow()
+    checkpoint.dernier_id = db.session.scalar(db.select(db.func.count(DocumentClient.id)))
+    db.session.commit()
+    return stats
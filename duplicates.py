@@ -0,0 +1,243 @@
+import os
+import re
+import time
+import logging
+import threading
+from datetime import date
+from sqlalchemy import event, inspect
+from app import db
+from db_routing import RoutingSession
+from models import Client, CleDoublon
+from screening import normalize_name, phonetic_key
+
+logger = logging.getLogger(__name__)
+
+# Seuils de score : au-delà, le doublon est signalé comme possible puis probable
+DUPLICATE_POSSIBLE_SCORE = int(os.environ.get('DUPLICATE_POSSIBLE_SCORE', 3))
+DUPLICATE_PROBABLE_SCORE = int(os.environ.get('DUPLICATE_PROBABLE_SCORE', 5))
+# Groupes d'une même clé plus grands que cette taille ignorés dans le rapport (clé non discriminante)
+DUPLICATE_MAX_GROUP = int(os.environ.get('DUPLICATE_MAX_GROUP', 50))
+DUPLICATE_BATCH_SIZE = 1000
+# Paires par page du rapport /doublons
+DUPLICATE_REPORT_PAGE_SIZE = int(os.environ.get('DUPLICATE_REPORT_PAGE_SIZE', 100))
+
+# Poids de chaque clé partagée ; un nom seul n'est pas une clé (trop d'homonymes), il ne compte qu'en complément
+KEY_WEIGHTS = {
+    'EMAIL': 5,
+    'PHONETIQUE_NAISSANCE': 4,
+    'TELEPHONE': 3,
+    'NOM_NAISSANCE': 2,
+    'NOM_VILLE': 2,
+}
+KEY_LABELS = {
+    'EMAIL': "Même adresse email (normalisée)",
+    'PHONETIQUE_NAISSANCE': "Nom proche et même date de naissance",
+    'TELEPHONE': "Même numéro de téléphone",
+    'NOM_NAISSANCE': "Même nom et même date de naissance",
+    'NOM_VILLE': "Même nom et même ville",
+}
+_KEY_FIELDS = ('nom', 'prenom', 'email', 'telephone', 'ville', 'date_naissance')
+
+
+def name_keys(nom, prenom):
+    """Nom normalisé et clé phonétique, indépendants de l'ordre prénom / nom"""
+    tokens = normalize_name(f'{prenom or ""} {nom or ""}')
+    return ' '.join(sorted(tokens)), ' '.join(sorted(phonetic_key(token) for token in tokens))
+
+
+def phone_digits(telephone):
+    """Neuf derniers chiffres du numéro (indicatif +33 / 0 ignoré)"""
+    digits = re.sub(r'\D', '', telephone or '')
+    return digits[-9:] if len(digits) >= 9 else None
+
+
+def normalized_email(email):
+    """Adresse sans sous-adresse (+...) ; points ignorés pour Gmail"""
+    if not email or '@' not in email:
+        return None
+    local, domain = email.strip().lower().rsplit('@', 1)
+    local = local.split('+', 1)[0]
+    if domain in ('gmail.com', 'googlemail.com'):
+        local, domain = local.replace('.', ''), 'gmail.com'
+    return f'{local}@{domain}'
+
+
+def blocking_keys(nom=None, prenom=None, email=None, telephone=None, ville=None, date_naissance=None):
+    """Clés de blocage (type, valeur) d'une fiche client"""
+    keys = []
+    name, phonetic = name_keys(nom, prenom)
+    birth = date_naissance.isoformat() if isinstance(date_naissance, date) else date_naissance
+    email, telephone = normalized_email(email), phone_digits(telephone)
+    if email:
+        keys.append(('EMAIL', email))
+    if telephone:
+        keys.append(('TELEPHONE', telephone))
+    if name and birth:
+        keys.append(('NOM_NAISSANCE', f'{name}|{birth}'))
+        keys.append(('PHONETIQUE_NAISSANCE', f'{phonetic}|{birth}'))
+    city = ' '.join(normalize_name(ville or ''))
+    if name and city:
+        keys.append(('NOM_VILLE', f'{name}|{city}'))
+    return [(key_type, value[:255]) for key_type, value in keys]
+
+
+def client_keys(client):
+    return blocking_keys(**{field: getattr(client, field) for field in _KEY_FIELDS})
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _maintain_keys(session, flush_context):
+    """Tient les clés à jour dans la même transaction que la fiche client"""
+    table = CleDoublon.__table__
+    stale = []
+    rows = []
+    for obj in session.new | session.dirty:
+        if not isinstance(obj, Client):
+            continue
+        state = inspect(obj)
+        if obj not in session.new:
+            if not any(state.attrs[field].history.has_changes() for field in _KEY_FIELDS):
+                continue
+            stale.append(obj.id)
+        rows.extend({'client_id': obj.id, 'type_cle': key_type, 'valeur': value}
+                    for key_type, value in client_keys(obj))
+    stale.extend(obj.id for obj in session.deleted if isinstance(obj, Client))
+    if stale:
+        session.execute(table.delete().where(table.c.client_id.in_(stale)))
+    if rows:
+        session.execute(table.insert(), rows)
+
+
+def _score(keys, candidate, nom, prenom):
+    """Poids des clés partagées, plus un point par concordance du nom normalisé et de la clé phonétique"""
+    return sum(KEY_WEIGHTS[key_type] for key_type in keys) + sum(
+        a == b for a, b in zip(name_keys(candidate.nom, candidate.prenom), name_keys(nom, prenom)))
+
+
+def level(score):
+    if score >= DUPLICATE_PROBABLE_SCORE:
+        return 'PROBABLE'
+    if score >= DUPLICATE_POSSIBLE_SCORE:
+        return 'POSSIBLE'
+    return None
+
+
+def find_duplicates(exclude_client_id=None, limit=10, **fields):
+    """Clients partageant une clé de blocage avec la fiche (une requête sur l'index type_cle/valeur).
+    Les clés sont agrégées par client en SQL avant la limite : une clé très partagée (même nom et même ville)
+    ne peut pas évincer un client partageant l'email"""
+    keys = blocking_keys(**fields)
+    if not keys:
+        return []
+    condition = db.or_(*[db.and_(CleDoublon.type_cle == key_type, CleDoublon.valeur == value)
+                         for key_type, value in keys])
+    if exclude_client_id is not None:
+        condition = db.and_(condition, CleDoublon.client_id != exclude_client_id)
+    weight = db.func.sum(db.case(KEY_WEIGHTS, value=CleDoublon.type_cle, else_=0))
+    matches = (db.select(CleDoublon.client_id, weight.label('poids'),
+                         *[db.func.max(db.case((CleDoublon.type_cle == key_type, 1), else_=0)).label(key_type)
+                           for key_type in KEY_WEIGHTS])
+               .where(condition)
+               .group_by(CleDoublon.client_id)
+               .order_by(weight.desc(), CleDoublon.client_id)
+               .limit(limit * 4)
+               .subquery())
+    rows = db.session.execute(
+        db.select(matches, Client.id, Client.nom, Client.prenom, Client.email, Client.ville, Client.date_naissance)
+        .join(Client, Client.id == matches.c.client_id)).all()
+
+    shared = {row.id: {key_type for key_type in KEY_WEIGHTS if row._mapping[key_type]} for row in rows}
+    candidates = {row.id: row for row in rows}
+    results = []
+    for client_id, key_types in shared.items():
+        candidate = candidates[client_id]
+        score = _score(key_types, candidate, fields.get('nom'), fields.get('prenom'))
+        if level(score):
+            results.append({
+                'client': candidate,
+                'score': score,
+                'niveau': level(score),
+                'motifs': [KEY_LABELS[key_type] for key_type in sorted(key_types, key=KEY_WEIGHTS.get, reverse=True)],
+            })
+    results.sort(key=lambda result: result['score'], reverse=True)
+    return results[:limit]
+
+
+def rebuild_keys(batch_size=DUPLICATE_BATCH_SIZE):
+    """Recalcule les clés de tous les clients (première mise en place ou changement des règles)"""
+    started = time.perf_counter()
+    db.session.execute(db.delete(CleDoublon))
+    count = 0
+    result = db.session.execute(
+        db.select(*[getattr(Client, field) for field in ('id',) + _KEY_FIELDS])
+        .execution_options(yield_per=batch_size))
+    for rows in result.partitions():
+        keys = [{'client_id': row.id, 'type_cle': key_type, 'valeur': value}
+                for row in rows for key_type, value in blocking_keys(**{field: getattr(row, field)
+                                                                        for field in _KEY_FIELDS})]
+        if keys:
+            db.session.execute(CleDoublon.__table__.insert(), keys)
+        count += len(rows)
+    db.session.commit()
+    logger.info("Clés de doublons recalculées pour %d clients en %.1f s", count, time.perf_counter() - started)
+    return count
+
+
+def duplicate_pairs(min_score=DUPLICATE_POSSIBLE_SCORE, max_group=DUPLICATE_MAX_GROUP):
+    """Rapport des paires de clients partageant des clés, par score décroissant"""
+    groups = (db.select(CleDoublon.type_cle, CleDoublon.valeur)
+              .group_by(CleDoublon.type_cle, CleDoublon.valeur)
+              .having(db.func.count().between(2, max_group)))
+    # Jointure sur les clients : une clé orpheline (client supprimé en masse, sans clé étrangère) est ignorée
+    rows = db.session.execute(
+        db.select(CleDoublon.type_cle, CleDoublon.valeur, CleDoublon.client_id)
+        .join(Client, Client.id == CleDoublon.client_id)
+        .where(db.tuple_(CleDoublon.type_cle, CleDoublon.valeur).in_(groups))
+        .order_by(CleDoublon.type_cle, CleDoublon.valeur, CleDoublon.client_id)).all()
+
+    members = {}
+    for row in rows:
+        members.setdefault((row.type_cle, row.valeur), []).append(row.client_id)
+    shared = {}
+    for (key_type, _), client_ids in members.items():
+        for i, first in enumerate(client_ids):
+            for second in client_ids[i + 1:]:
+                shared.setdefault((first, second), set()).add(key_type)
+
+    client_ids = sorted({client_id for pair in shared for client_id in pair})
+    clients = {}
+    for i in range(0, len(client_ids), DUPLICATE_BATCH_SIZE):
+        clients.update((row.id, row) for row in db.session.execute(
+            db.select(Client.id, Client.nom, Client.prenom, Client.email, Client.date_naissance)
+            .where(Client.id.in_(client_ids[i:i + DUPLICATE_BATCH_SIZE]))))
+
+    pairs = []
+    for (first, second), key_types in shared.items():
+        a, b = clients.get(first), clients.get(second)
+        if a is None or b is None:
+            # Client supprimé entre les deux requêtes
+            continue
+        score = _score(key_types, a, b.nom, b.prenom)
+        if score >= min_score:
+            pairs.append({
+                'clients': (a, b),
+                'score': score,
+                'niveau': level(score),
+                'motifs': [KEY_LABELS[key_type] for key_type in sorted(key_types, key=KEY_WEIGHTS.get, reverse=True)],
+            })
+    pairs.sort(key=lambda pair: pair['score'], reverse=True)
+    return pairs
+
+
+_report = (None, None)
+_report_lock = threading.Lock()
+
+
+def cached_duplicate_pairs(version):
+    """Paires de duplicate_pairs() recalculées seulement quand la version des données clients change
+    (une entrée par processus ; les lignes mises en cache ne sont pas liées à une session)"""
+    global _report
+    with _report_lock:
+        if _report[0] != version:
+            _report = (version, duplicate_pairs())
+        return _report[1]
@@ -0,0 +1,62 @@
+"""Profil de production : `gunicorn --config gunicorn_conf.py main:app`
+
+L'application est importée une seule fois dans le processus maître (preload_app) puis les workers
+en sont forkés : templates compilés, modèles Word et modules importés sont partagés en
+copy-on-write au lieu d'être reconstruits dans chaque worker. Pas pour le développement :
+--reload exige que l'application soit chargée dans chaque worker.
+"""
+import gc
+import multiprocessing
+import os
+
+_cpus = multiprocessing.cpu_count()
+
+bind = os.environ.get("GUNICORN_BIND", f"0.0.0.0:{os.environ.get('PORT', '5000')}")
+
+# Les requêtes attendent surtout la base et les fichiers : quelques workers à threads par CPU
+# donnent le débit de nombreux workers sync pour une fraction de la mémoire. Sur un seul CPU,
+# deux workers assurent le service pendant le recyclage de l'un d'eux. Les threads restent sous
+# DB_POOL_SIZE + DB_MAX_OVERFLOW (15 par défaut) pour qu'un worker chargé n'attende jamais son pool.
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.environ.get("GUNICORN_WORKERS", max(2, _cpus)))
+threads = int(os.environ.get("GUNICORN_THREADS", 8 if _cpus == 1 else 4))
+
+preload_app = True
+# Recyclage régulier des workers pour borner la mémoire ; la gigue évite de tous les redémarrer ensemble
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 2000))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 200))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 60))
+graceful_timeout = 30
+keepalive = 5
+
+# Battements de cœur des workers sur tmpfs plutôt que sur un disque de conteneur parfois lent
+if os.path.isdir("/dev/shm"):
+    worker_tmp_dir = "/dev/shm"
+
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG") or None
+errorlog = "-"
+
+
+def when_ready(server):
+    """Préchauffe les caches partagés dans le maître, juste avant le fork des premiers workers"""
+    from app import db, warm_caches
+    from main import app
+
+    with app.app_context():
+        warm_caches()
+        # Les connexions ouvertes par la création du schéma ne doivent pas être héritées par les workers
+        for engine in db.engines.values():
+            engine.dispose()
+    # Les objets créés jusqu'ici ne sont jamais collectés dans les workers : leurs pages restent partagées
+    gc.freeze()
+    server.log.info("Caches warmed, %d workers x %d threads (%s)", workers, threads, worker_class)
+
+
+def post_fork(server, worker):
+    """Chaque worker démarre avec des pools de connexions vides (sans fermer les sockets du parent)"""
+    from app import db
+    from main import app
+
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
@@ -63,6 +63,12 @@ class ObjectifInvestissement(enum.Enum):
 
 class Client(db.Model):
     __tablename__ = 'clients'
+    __table_args__ = (
+        # Recherches par plage de dates des workflows en attente de signature (scanner SLA)
+        db.Index('ix_clients_statut_date_envoi_der', 'statut_workflow', 'date_envoi_der'),
+        db.Index('ix_clients_statut_date_envoi_documents', 'statut_workflow', 'date_envoi_documents'),
+        db.Index('ix_clients_date_derniere_maj', 'date_derniere_maj'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     
@@ -100,6 +106,11 @@ class Client(db.Model):
     date_envoi_documents = db.Column(db.DateTime)
     date_signature_documents = db.Column(db.DateTime)
     date_envoi_souscription = db.Column(db.DateTime)
+    # Enveloppes de signature envoyées : seuls les webhooks de ces enveloppes font avancer le workflow
+    enveloppe_der = db.Column(db.String(100))
+    enveloppe_documents = db.Column(db.String(100))
+    # Filtrage sanctions / PEP en échec : le client est à refiltrer (listé dans /filtrage)
+    date_echec_filtrage = db.Column(db.DateTime)
     
     # Relations
     documents = db.relationship('Document', backref='client', lazy=True, cascade='all, delete-orphan')
@@ -139,6 +150,10 @@ class Document(db.Model):
 
 class QuestionnaireResponse(db.Model):
     __tablename__ = 'questionnaire_responses'
+    __table_args__ = (
+        # Une seule ligne par question et par client, mise à jour en place (INSERT ... ON CONFLICT)
+        db.Index('uq_questionnaire_responses_client_question', 'client_id', 'question_id', unique=True),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     client_id = db.Column(db.Integer, db.ForeignKey('clients.id'), nullable=False)
@@ -147,6 +162,60 @@ class QuestionnaireResponse(db.Model):
     reponse = db.Column(db.Text, nullable=False)
     score = db.Column(db.Integer, default=0)
     date_reponse = db.Column(db.DateTime, default=datetime.utcnow)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # Nombre de modifications de la réponse
+    version_questionnaire = db.Column(db.Integer)  # Version de la définition du questionnaire
+
+# Table unifiée des fichiers clients (alimentée depuis documents, der, pieces_justificatives et documents_generes)
+class DocumentClient(db.Model):
+    __tablename__ = 'documents_clients'
+    __table_args__ = (
+        db.Index('ix_documents_clients_client_date', 'client_id', 'date_creation'),
+        db.Index('uq_documents_clients_source', 'source_table', 'source_id', unique=True),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    client_id = db.Column(db.Integer, db.ForeignKey('clients.id'), nullable=False)
+    type_document = db.Column(db.Enum(DocumentType), nullable=False)  # Discriminant
+    nom_fichier = db.Column(db.String(255))
+    nom_original = db.Column(db.String(255), nullable=False)
+    chemin_fichier = db.Column(db.String(500))
+    taille_fichier = db.Column(db.Integer)
+    empreinte = db.Column(db.String(64), index=True)  # SHA-256 du contenu
+    genere_automatiquement = db.Column(db.Boolean, nullable=False, default=False)
+    statut = db.Column(db.String(30))
+    version = db.Column(db.Integer, nullable=False, default=1)
+    date_creation = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    date_validation = db.Column(db.DateTime)
+    commentaire = db.Column(db.Text)
+    # Suivi signature
+    date_envoi_signature = db.Column(db.DateTime)
+    date_signature = db.Column(db.DateTime)
+    signe = db.Column(db.Boolean, nullable=False, default=False)
+    # Ligne d'origine dans l'ancienne table
+    source_table = db.Column(db.String(30), nullable=False)
+    source_id = db.Column(db.Integer, nullable=False)
+    
+    date_upload = db.synonym('date_creation')
+    
+    client = db.relationship('Client', backref=db.backref('documents_clients', lazy=True))
+    apercu = db.relationship('ApercuFichier', primaryjoin='foreign(DocumentClient.empreinte) == ApercuFichier.empreinte',
+                             viewonly=True, uselist=False)
+
+# Fichiers dérivés d'un scan (vignette, aperçu de la première page), partagés par les fichiers de même contenu
+class ApercuFichier(db.Model):
+    __tablename__ = 'apercus_fichiers'
+    
+    empreinte = db.Column(db.String(64), primary_key=True)  # SHA-256 du fichier après normalisation
+    statut = db.Column(db.String(20), nullable=False)  # TRAITE, SANS_APERCU, ERREUR
+    format = db.Column(db.String(10))
+    largeur = db.Column(db.Integer)
+    hauteur = db.Column(db.Integer)
+    taille_origine = db.Column(db.Integer)
+    taille_finale = db.Column(db.Integer)
+    vignette_path = db.Column(db.String(500))
+    apercu_path = db.Column(db.String(500))
+    erreur = db.Column(db.Text)
+    date_traitement = db.Column(db.DateTime, default=datetime.utcnow)
 
 # Modèle pour les DER (Documents d'Entrée en Relation)
 class DER(db.Model):
@@ -190,6 +259,10 @@ class PieceJustificative(db.Model):
 # Modèle pour les profils investisseur
 class ProfilInvestisseur(db.Model):
     __tablename__ = 'profils_investisseur'
+    __table_args__ = (
+        # Recherche des clients adaptés à un produit (listes IN sur les masques, voir suitability.py)
+        db.Index('ix_profils_investisseur_adequation', 'masque_risques', 'masque_exigences', 'srri_max'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     client_id = db.Column(db.Integer, db.ForeignKey('clients.id'), nullable=False)
@@ -234,6 +307,14 @@ class ProfilInvestisseur(db.Model):
     revenus_annuels = db.Column(db.Numeric(12, 2))
     patrimoine_total = db.Column(db.Numeric(12, 2))
     
+    # Contraintes d'adéquation encodées (recalculées à chaque flush, voir suitability.py)
+    masque_risques = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Risques acceptés
+    masque_exigences = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Garanties exigées
+    srri_max = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rang_horizon = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rang_sfdr = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rang_connaissance = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
     # Dates de suivi
     date_creation = db.Column(db.DateTime, default=datetime.utcnow)
     date_mise_a_jour = db.Column(db.DateTime, default=datetime.utcnow)
@@ -285,9 +366,230 @@ class SuiviWorkflow(db.Model):
         name='etape_workflow_enum'
     ), default='DER_CREATION')
     date_debut = db.Column(db.DateTime, default=datetime.utcnow)
-    date_derniere_action = db.Column(db.DateTime, default=datetime.utcnow)
+    date_derniere_action = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     date_fin = db.Column(db.DateTime)
     notes = db.Column(db.Text)
     
     # Relations
     client = db.relationship('Client', backref='suivi_workflow', uselist=False)
+
+# File des événements de signature reçus par webhook (traités en lot par le worker)
+class SignatureEvent(db.Model):
+    __tablename__ = 'signature_events'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    provider = db.Column(db.String(50), nullable=False)
+    event_id = db.Column(db.String(100), nullable=False, unique=True)  # Identifiant du fournisseur (idempotence)
+    envelope_id = db.Column(db.String(100))
+    client_id = db.Column(db.Integer, db.ForeignKey('clients.id'), index=True)  # NULL : client inconnu (id brut dans payload)
+    type_signature = db.Column(db.Enum('DER', 'DOCUMENTS', name='type_signature_enum'), nullable=False)
+    type_evenement = db.Column(db.String(30), nullable=False)  # signed, declined, expired...
+    date_evenement = db.Column(db.DateTime, nullable=False)
+    date_reception = db.Column(db.DateTime, default=datetime.utcnow)
+    date_traitement = db.Column(db.DateTime, index=True)
+    resultat = db.Column(db.String(30))  # applied, ignored, recorded, unknown_client, unknown_envelope, error
+    payload = db.Column(db.Text)
+
+# Boîte d'envoi transactionnelle : les notifications sont écrites dans le même commit que le
+# changement de statut, puis envoyées par le dispatcher (flask --app app dispatch-notifications)
+class Notification(db.Model):
+    __tablename__ = 'notifications_outbox'
+    __table_args__ = (
+        db.Index('ix_notifications_outbox_statut_prochaine_tentative', 'statut', 'prochaine_tentative'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    client_id = db.Column(db.Integer, db.ForeignKey('clients.id'), nullable=False, index=True)
+    type_notification = db.Column(db.String(50), nullable=False)  # der_signature, documents_signature...
+    destinataire = db.Column(db.String(120), nullable=False)
+    sujet = db.Column(db.String(255), nullable=False)
+    corps = db.Column(db.Text, nullable=False)
+    statut = db.Column(db.Enum('EN_ATTENTE', 'ENVOYE', 'ECHEC', name='statut_notification_enum'),
+                       nullable=False, default='EN_ATTENTE')
+    tentatives = db.Column(db.Integer, nullable=False, default=0)
+    prochaine_tentative = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    derniere_erreur = db.Column(db.Text)
+    date_creation = db.Column(db.DateTime, default=datetime.utcnow)
+    date_envoi = db.Column(db.DateTime)
+
+# Alertes de dépassement de délai levées par le scanner SLA (flask --app app scan-sla)
+class AlerteSLA(db.Model):
+    __tablename__ = 'alertes_sla'
+    __table_args__ = (
+        db.UniqueConstraint('client_id', 'type_alerte', 'date_reference', name='uq_alertes_sla_client_type_reference'),
+        db.Index('ix_alertes_sla_ouvertes', 'date_resolution', 'date_echeance'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    client_id = db.Column(db.Integer, db.ForeignKey('clients.id'), nullable=False, index=True)
+    type_alerte = db.Column(db.Enum('DER_SENT', 'DOCUMENTS_SENT', 'INACTIVITE', name='type_alerte_sla_enum'), nullable=False)
+    date_reference = db.Column(db.DateTime, nullable=False)  # Date d'envoi ou de dernière action
+    date_echeance = db.Column(db.DateTime, nullable=False)
+    date_creation = db.Column(db.DateTime, default=datetime.utcnow)
+    date_resolution = db.Column(db.DateTime)
+    
+    client = db.relationship('Client')
+
+# Point de reprise des traitements incrémentaux (dernière exécution réussie)
+class ScanCheckpoint(db.Model):
+    __tablename__ = 'scan_checkpoints'
+    
+    nom = db.Column(db.String(50), primary_key=True)
+    date_execution = db.Column(db.DateTime, nullable=False)
+    dernier_id = db.Column(db.Integer)  # Dernier identifiant traité, pour les tables en ajout seul
+
+# Journal en ajout seul des changements de statut (alimenté automatiquement à chaque flush)
+class TransitionStatut(db.Model):
+    __tablename__ = 'transitions_statut'
+    __table_args__ = (
+        db.Index('ix_transitions_statut_client_id_id', 'client_id', 'id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    client_id = db.Column(db.Integer, db.ForeignKey('clients.id'), nullable=False)
+    statut_precedent = db.Column(db.Enum(WorkflowStatus))
+    statut = db.Column(db.Enum(WorkflowStatus), nullable=False)
+    date_transition = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    conseiller = db.Column(db.String(100))
+    # Déjà intégrée aux agrégats (les lignes antérieures à cette colonne l'ont été : valeur par défaut vraie)
+    agrege = db.Column(db.Boolean, nullable=False, default=False, server_default=db.text('true'))
+    
+    client = db.relationship('Client')
+
+# Agrégats quotidiens des transitions par statut et par conseiller (flask --app app analytics-rollup)
+class AgregatWorkflowJour(db.Model):
+    __tablename__ = 'agregats_workflow_jour'
+    
+    jour = db.Column(db.Date, primary_key=True)
+    statut = db.Column(db.String(30), primary_key=True)  # Nom du WorkflowStatus
+    conseiller = db.Column(db.String(100), primary_key=True, default='')
+    entrees = db.Column(db.Integer, nullable=False, default=0)  # Clients entrés dans le statut ce jour
+    sorties = db.Column(db.Integer, nullable=False, default=0)  # Clients sortis du statut ce jour
+    duree_totale = db.Column(db.Float, nullable=False, default=0)  # Secondes passées dans le statut (sorties)
+    histogramme = db.Column(db.Text, nullable=False, default='[]')  # Durées par classe logarithmique (JSON)
+
+# Journal d'audit en ajout seul : différences avant/après des données KYC, en JSON compressé (zlib).
+# La colonne mois sert de clé de partition logique (purge et archivage par mois). Pas de partitionnement
+# déclaratif PostgreSQL : la clé primaire devrait inclure la clé de partition, ce que SQLite ne permet pas
+# avec un id auto-incrémenté.
+class JournalAudit(db.Model):
+    __tablename__ = 'journal_audit'
+    __table_args__ = (
+        db.Index('ix_journal_audit_client_id_date_action', 'client_id', 'date_action'),
+        db.Index('ix_journal_audit_mois', 'mois'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    mois = db.Column(db.String(7), nullable=False)  # AAAA-MM
+    date_action = db.Column(db.DateTime, nullable=False)
+    client_id = db.Column(db.Integer)  # Pas de clé étrangère : l'historique survit à la suppression du client
+    table_objet = db.Column(db.String(50), nullable=False)
+    objet_id = db.Column(db.Integer)
+    operation = db.Column(db.String(6), nullable=False)  # INSERT, UPDATE, DELETE
+    conseiller = db.Column(db.String(100))
+    modifications = db.Column(db.LargeBinary, nullable=False)  # {champ: [avant, après]} compressé
+
+# Correspondances du filtrage sanctions / PEP, à revoir par un conseiller
+class ResultatFiltrage(db.Model):
+    __tablename__ = 'resultats_filtrage'
+    __table_args__ = (
+        db.UniqueConstraint('client_id', 'liste', 'entree_id', name='uq_resultats_filtrage_client_entree'),
+        db.Index('ix_resultats_filtrage_statut_date', 'statut', 'date_detection'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    client_id = db.Column(db.Integer, db.ForeignKey('clients.id'), nullable=False, index=True)
+    liste = db.Column(db.String(100), nullable=False)
+    entree_id = db.Column(db.String(100), nullable=False)
+    categorie = db.Column(db.String(20), nullable=False)  # SANCTION ou PEP
+    nom_liste = db.Column(db.String(255), nullable=False)
+    score = db.Column(db.Float, nullable=False)
+    version_liste = db.Column(db.String(40))
+    date_detection = db.Column(db.DateTime, default=datetime.utcnow)
+    statut = db.Column(db.Enum('A_REVOIR', 'FAUX_POSITIF', 'CONFIRME', name='statut_filtrage_enum'),
+                       nullable=False, default='A_REVOIR')
+    date_revue = db.Column(db.DateTime)
+    commentaire = db.Column(db.Text)
+    
+    client = db.relationship('Client', backref='resultats_filtrage')
+
+# Empreinte de chaque entrée des listes de filtrage au dernier refiltrage (calcul des différences)
+class EntreeListeFiltrage(db.Model):
+    __tablename__ = 'entrees_liste_filtrage'
+    
+    liste = db.Column(db.String(100), primary_key=True)
+    entree_id = db.Column(db.String(100), primary_key=True)
+    empreinte = db.Column(db.String(40), nullable=False)
+    date_maj = db.Column(db.DateTime, default=datetime.utcnow)
+
+# Notation de risque LCB-FT courante d'un client (recalculée en bloc à chaque changement des règles)
+class NotationRisque(db.Model):
+    __tablename__ = 'notations_risque'
+    __table_args__ = (
+        db.Index('ix_notations_risque_niveau', 'niveau'),
+    )
+    
+    client_id = db.Column(db.Integer, db.ForeignKey('clients.id'), primary_key=True)
+    score = db.Column(db.Integer, nullable=False)
+    niveau = db.Column(db.Enum('FAIBLE', 'MOYEN', 'ELEVE', name='niveau_risque_enum'), nullable=False)
+    vigilance_renforcee = db.Column(db.Boolean, nullable=False, default=False, index=True)
+    regles = db.Column(db.BigInteger, nullable=False, default=0)  # Masque des règles déclenchées
+    explication = db.Column(db.Text)  # JSON : règles déclenchées avec leurs points
+    version_regles = db.Column(db.String(40), nullable=False)
+    date_calcul = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    client = db.relationship('Client', backref=db.backref('notation_risque', uselist=False))
+
+# Catalogue des produits proposés, avec leurs caractéristiques encodées pour l'adéquation
+class Produit(db.Model):
+    __tablename__ = 'produits'
+    __table_args__ = (
+        db.Index('ix_produits_adequation', 'actif', 'risques', 'garanties', 'srri'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    code = db.Column(db.String(50), unique=True, nullable=False)  # Code ISIN ou interne
+    nom = db.Column(db.String(200), nullable=False)
+    emetteur = db.Column(db.String(200))
+    categorie = db.Column(db.String(100))
+    srri = db.Column(db.Integer, nullable=False)  # Indicateur de risque (1-7)
+    risques = db.Column(db.Integer, nullable=False, default=0)  # Masque des risques portés
+    garanties = db.Column(db.Integer, nullable=False, default=0)  # Masque des garanties offertes
+    horizon_min = db.Column(db.Integer, nullable=False, default=1)  # Rang de l'horizon minimal (1 à 3)
+    rang_sfdr = db.Column(db.Integer, nullable=False, default=0)  # 0 : article 6, 1 : article 8, 2 : article 9
+    connaissance_min = db.Column(db.Integer, nullable=False, default=1)  # Rang de connaissance minimal (1 à 3)
+    public = db.Column(db.Integer, nullable=False, default=7)  # Masque des types d'investisseur visés
+    actif = db.Column(db.Boolean, nullable=False, default=True)
+    date_maj = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# Clés de blocage pour la détection des doublons (recalculées à chaque flush d'un client)
+class CleDoublon(db.Model):
+    __tablename__ = 'cles_doublons'
+    __table_args__ = (
+        db.Index('ix_cles_doublons_type_valeur', 'type_cle', 'valeur'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    client_id = db.Column(db.Integer, nullable=False, index=True)  # Sans clé étrangère : supprimées avec le client
+    type_cle = db.Column(db.String(30), nullable=False)
+    valeur = db.Column(db.String(255), nullable=False)
+
+# Tables d'archives des dossiers terminés (données froides) : mêmes colonnes que les tables actives,
+# sans clés étrangères, avec un seul index sur client_id
+_ARCHIVED_WITHOUT_FK = ('cles_doublons',)
+
+def _archive_table(table):
+    columns = [db.Column(column.name, column.type.copy(), primary_key=column.primary_key, nullable=column.nullable)
+               for column in table.c]
+    if table.name == 'clients':
+        columns.append(db.Column('date_archivage', db.DateTime, nullable=False, index=True))
+    elif not table.c.client_id.primary_key:
+        columns.append(db.Index(f'ix_{table.name}_archive_client_id', 'client_id'))
+    return db.Table(f'{table.name}_archive', db.metadata, *columns)
+
+ARCHIVE_TABLES = {
+    table.name: _archive_table(table)
+    for table in db.metadata.sorted_tables
+    if table.name == 'clients' or table.name in _ARCHIVED_WITHOUT_FK
+    or any(fk.column.table.name == 'clients' for fk in table.foreign_keys)
+}
@@ -0,0 +1,238 @@
+import os
+import asyncio
+import logging
+import smtplib
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from app import db
+from models import Notification
+
+logger = logging.getLogger(__name__)
+
+# Serveur SMTP sortant ; par défaut le simulateur local (flask --app app smtp-stub)
+SMTP_HOST = os.environ.get('SMTP_HOST', 'localhost')
+SMTP_PORT = int(os.environ.get('SMTP_PORT', 1025))
+SMTP_USER = os.environ.get('SMTP_USER')
+SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD')
+SMTP_STARTTLS = os.environ.get('SMTP_STARTTLS', '0').lower() in ('1', 'true', 'yes')
+SMTP_TIMEOUT = float(os.environ.get('SMTP_TIMEOUT', 10))
+NOTIFY_SENDER = os.environ.get('NOTIFY_SENDER', 'conseil@cabinet.example')
+
+# Réglages du dispatcher
+NOTIFY_BATCH_SIZE = int(os.environ.get('NOTIFY_BATCH_SIZE', 100))
+NOTIFY_CONCURRENCY = int(os.environ.get('NOTIFY_CONCURRENCY', 5))
+NOTIFY_RATE_PER_SECOND = float(os.environ.get('NOTIFY_RATE_PER_SECOND', 10))
+NOTIFY_MAX_ATTEMPTS = int(os.environ.get('NOTIFY_MAX_ATTEMPTS', 5))
+NOTIFY_RETRY_BASE_SECONDS = int(os.environ.get('NOTIFY_RETRY_BASE_SECONDS', 60))
+
+# Sujet et corps des messages par type de notification
+MESSAGES = {
+    'der_signature': (
+        "Votre Document d'Entrée en Relation à signer",
+        "Bonjour {prenom} {nom},\n\nVotre Document d'Entrée en Relation vous a été envoyé pour signature "
+        "électronique. Merci de le signer dès que possible.\n\nCordialement,\nVotre conseiller",
+    ),
+    'documents_signature': (
+        "Vos documents à signer",
+        "Bonjour {prenom} {nom},\n\nVos documents (rapport d'adéquation, lettre de mission, profil investisseur) "
+        "vous ont été envoyés pour signature électronique.\n\nCordialement,\nVotre conseiller",
+    ),
+    'subscription_forms': (
+        "Vos bulletins de souscription",
+        "Bonjour {prenom} {nom},\n\nVos bulletins de souscription vous ont été envoyés. "
+        "Merci de nous les retourner complétés.\n\nCordialement,\nVotre conseiller",
+    ),
+    'relance': (
+        "Rappel : {etape}",
+        "Bonjour {prenom} {nom},\n\nNous n'avons pas encore reçu votre retour concernant : {etape}. "
+        "N'hésitez pas à nous contacter si vous avez besoin d'aide.\n\nCordialement,\nVotre conseiller",
+    ),
+}
+
+
+def queue_notification(client, kind, **context):
+    """Ajoute une notification à la boîte d'envoi, dans la transaction en cours (sans commit)"""
+    subject, body = MESSAGES[kind]
+    values = {'prenom': client.prenom, 'nom': client.nom, **context}
+    notification = Notification(
+        client_id=client.id,
+        type_notification=kind,
+        destinataire=client.email,
+        sujet=subject.format(**values),
+        corps=body.format(**values),
+        statut='EN_ATTENTE',
+        tentatives=0,
+        prochaine_tentative=datetime.utcnow(),
+    )
+    db.session.add(notification)
+    return notification
+
+
+def build_email(notification):
+    message = EmailMessage()
+    message['From'] = NOTIFY_SENDER
+    message['To'] = notification.destinataire
+    message['Subject'] = notification.sujet
+    message['Message-ID'] = f'<notification-{notification.id}@{NOTIFY_SENDER.split("@")[-1]}>'
+    message.set_content(notification.corps)
+    return message
+
+
+def _smtp_send(message):
+    with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT) as smtp:
+        if SMTP_STARTTLS:
+            smtp.starttls()
+        if SMTP_USER:
+            smtp.login(SMTP_USER, SMTP_PASSWORD)
+        smtp.send_message(message)
+
+
+class RateLimiter:
+    """Espace les envois pour ne pas dépasser un débit donné (messages par seconde)"""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._next_slot = 0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            delay = self._next_slot - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next_slot = max(self._next_slot, loop.time()) + self.interval
+
+
+async def _send(message, semaphore, limiter, send):
+    async with semaphore:
+        await limiter.wait()
+        try:
+            # smtplib est bloquant : l'envoi est délégué à un thread
+            await asyncio.to_thread(send, message)
+            return None
+        except Exception as e:
+            return str(e) or e.__class__.__name__
+
+
+def _claim_batch(batch_size):
+    query = (db.select(Notification)
+             .where(Notification.statut == 'EN_ATTENTE', Notification.prochaine_tentative <= datetime.utcnow())
+             .order_by(Notification.prochaine_tentative, Notification.id)
+             .limit(batch_size)
+             .with_for_update(skip_locked=True))
+    return db.session.scalars(query).all()
+
+
+async def dispatch_batch(batch_size=NOTIFY_BATCH_SIZE, concurrency=NOTIFY_CONCURRENCY,
+                         rate=NOTIFY_RATE_PER_SECOND, send=_smtp_send):
+    """Envoie un lot de notifications dues ; retourne (envoyées, en échec)"""
+    notifications = _claim_batch(batch_size)
+    if not notifications:
+        return 0, 0
+
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = RateLimiter(rate)
+    errors = await asyncio.gather(*(
+        _send(build_email(notification), semaphore, limiter, send) for notification in notifications))
+
+    now = datetime.utcnow()
+    sent = failed = 0
+    for notification, error in zip(notifications, errors):
+        notification.tentatives += 1
+        if error is None:
+            notification.statut = 'ENVOYE'
+            notification.date_envoi = now
+            notification.derniere_erreur = None
+            sent += 1
+            continue
+        failed += 1
+        notification.derniere_erreur = error
+        if notification.tentatives >= NOTIFY_MAX_ATTEMPTS:
+            notification.statut = 'ECHEC'
+            logger.error("Notification %s abandonnée après %d tentatives : %s",
+                         notification.id, notification.tentatives, error)
+        else:
+            # Nouvel essai avec un délai exponentiel
+            delay = NOTIFY_RETRY_BASE_SECONDS * 2 ** (notification.tentatives - 1)
+            notification.prochaine_tentative = now + timedelta(seconds=delay)
+
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return sent, failed
+
+
+async def run_dispatcher(loop=False, interval=5.0):
+    """Vide la boîte d'envoi ; avec loop=True, continue à la surveiller"""
+    while True:
+        sent, failed = await dispatch_batch()
+        if sent or failed:
+            logger.info("Notifications : %d envoyée(s), %d en échec", sent, failed)
+        elif not loop:
+            return
+        else:
+            await asyncio.sleep(interval)
+
+
+class SMTPStub:
+    """Serveur SMTP minimal pour les tests : accepte tous les messages et les écrit dans un dossier"""
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.received = 0
+        os.makedirs(output_dir, exist_ok=True)
+
+    async def handle(self, reader, writer):
+        async def reply(line):
+            writer.write(f'{line}\r\n'.encode())
+            await writer.drain()
+
+        await reply('220 smtp-stub ESMTP')
+        recipients = []
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command[:4].upper()
+            if verb in ('HELO', 'EHLO'):
+                await reply('250 smtp-stub')
+            elif verb == 'MAIL':
+                recipients = []
+                await reply('250 OK')
+            elif verb == 'RCPT':
+                recipients.append(command.split(':', 1)[-1].strip())
+                await reply('250 OK')
+            elif verb == 'DATA':
+                await reply('354 Fin du message par <CRLF>.<CRLF>')
+                lines = []
+                while True:
+                    data = await reader.readline()
+                    if not data or data in (b'.\r\n', b'.\n'):
+                        break
+                    lines.append(data[1:] if data.startswith(b'..') else data)
+                self.received += 1
+                path = os.path.join(self.output_dir, f'{datetime.utcnow():%Y%m%d_%H%M%S}_{self.received:06d}.eml')
+                with open(path, 'wb') as f:
+                    f.writelines(lines)
+                logger.info("Message reçu pour %s (%s)", ', '.join(recipients), path)
+                await reply('250 OK')
+            elif verb == 'QUIT':
+                await reply('221 Bye')
+                break
+            elif verb in ('RSET', 'NOOP'):
+                await reply('250 OK')
+            else:
+                await reply('502 Commande non gérée')
+        writer.close()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port)
+        logger.info("Simulateur SMTP à l'écoute sur %s:%d", host, port)
+        async with server:
+            await server.serve_forever()
@@ -0,0 +1,191 @@
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from markupsafe import Markup
+from flask import current_app, request, session, make_response
+
+logger = logging.getLogger(__name__)
+
+# Backend du cache de fragments : 'lru' (en mémoire, par processus), 'redis' (partagé) ou 'none'
+PAGE_CACHE_BACKEND = os.environ.get('PAGE_CACHE_BACKEND', 'lru')
+PAGE_CACHE_MAX_BYTES = int(os.environ.get('PAGE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+PAGE_CACHE_URL = os.environ.get('PAGE_CACHE_URL', 'redis://localhost:6379/0')
+PAGE_CACHE_TTL = int(os.environ.get('PAGE_CACHE_TTL', 24 * 3600))
+
+
+class LRUCache:
+    """Cache en mémoire avec éviction des entrées les moins récemment utilisées selon leur taille"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= len(previous)
+            self._entries[key] = value
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+
+class RedisCache:
+    """Cache partagé entre workers et serveurs via un serveur Redis local"""
+
+    def __init__(self, url, ttl):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("PAGE_CACHE_BACKEND=redis nécessite le paquet 'redis'") from e
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key):
+        try:
+            value = self.client.get(key)
+        except Exception as e:
+            logger.warning("Cache Redis indisponible : %s", e)
+            return None
+        return value.decode('utf-8') if value is not None else None
+
+    def set(self, key, value):
+        try:
+            self.client.set(key, value.encode('utf-8'), ex=self.ttl)
+        except Exception as e:
+            logger.warning("Cache Redis indisponible : %s", e)
+
+    def clear(self):
+        self.client.flushdb()
+
+
+class NullCache:
+    """Cache désactivé"""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def clear(self):
+        pass
+
+
+def create_cache_backend():
+    """Instancie le backend configuré par PAGE_CACHE_BACKEND"""
+    if PAGE_CACHE_BACKEND == 'redis':
+        return RedisCache(PAGE_CACHE_URL, PAGE_CACHE_TTL)
+    if PAGE_CACHE_BACKEND == 'none':
+        return NullCache()
+    return LRUCache(PAGE_CACHE_MAX_BYTES)
+
+
+def _templates_fingerprint(app):
+    """Empreinte des templates, pour ne pas resservir d'anciens fragments après un déploiement"""
+    digest = hashlib.sha1()
+    template_dir = os.path.join(app.root_path, app.template_folder)
+    for name in sorted(os.listdir(template_dir)):
+        stat = os.stat(os.path.join(template_dir, name))
+        digest.update(f'{name}:{stat.st_mtime_ns}:{stat.st_size}'.encode())
+    return digest.hexdigest()[:12]
+
+
+def fragment_key(*parts):
+    """Construit la clé d'un fragment à partir de son nom et de sa version"""
+    namespace = current_app.extensions['page_cache_namespace']
+    return ':'.join(['frag', namespace] + [str(part) for part in parts])
+
+
+def cached_fragment(key, caller):
+    """Rend le corps d'un bloc {% call cached_fragment(...) %} ou le reprend du cache"""
+    cache = current_app.extensions['page_cache']
+    html = cache.get(key)
+    if html is None:
+        html = str(caller())
+        cache.set(key, html)
+    return Markup(html)
+
+
+class LazyResult:
+    """Résultat de requête évalué au premier accès (aucune requête si le fragment est en cache)"""
+
+    def __init__(self, query):
+        self._query = query
+        self._items = None
+
+    def _load(self):
+        if self._items is None:
+            self._items = self._query.all()
+        return self._items
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def __bool__(self):
+        return bool(self._load())
+
+
+def page_etag(*parts):
+    """ETag d'une page à partir du nom du template et de la version des données affichées"""
+    # Les messages flash en attente doivent être affichés : la page n'est pas cacheable
+    if session.get('_flashes'):
+        return None
+    namespace = current_app.extensions['page_cache_namespace']
+    raw = ':'.join([namespace] + [str(part) for part in parts])
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def not_modified(etag):
+    """Retourne une réponse 304 si le navigateur possède déjà cette version de la page"""
+    if etag and request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+        _set_cache_headers(response, etag)
+        return response
+    return None
+
+
+def cacheable_response(html, etag):
+    """Réponse HTML revalidable par ETag"""
+    response = make_response(html)
+    if etag:
+        _set_cache_headers(response, etag)
+    return response
+
+
+def _set_cache_headers(response, etag):
+    response.set_etag(etag, weak=True)
+    # Pages propres au conseiller : revalidation systématique, jamais de cache partagé
+    response.headers['Cache-Control'] = 'private, no-cache'
+
+
+def init_page_cache(app):
+    """Installe le backend de cache et les fonctions de fragments dans Jinja"""
+    app.extensions['page_cache'] = create_cache_backend()
+    app.extensions['page_cache_namespace'] = _templates_fingerprint(app)
+    app.jinja_env.globals['cached_fragment'] = cached_fragment
+    app.jinja_env.globals['fragment_key'] = fragment_key
@@ -0,0 +1,165 @@
+import json
+import hashlib
+from datetime import datetime
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+from models import QuestionnaireResponse, RiskTolerance
+from audit import record_changes
+
+# Version de la définition du questionnaire, à incrémenter à chaque modification des questions ou des scores
+QUESTIONNAIRE_VERSION = 1
+
+# Questions et réponses proposées (ordre d'affichage) : source unique du formulaire, du score calculé par le
+# serveur et de la définition publiée pour le navigateur
+QUESTIONS = [
+    {'id': 'q1', 'text': 'Quelle est votre expérience en matière d\'investissement?', 'options': [
+        {'value': 'debutant', 'score': 1, 'label': 'Débutant', 'hint': 'Aucune expérience ou très limitée'},
+        {'value': 'intermediaire', 'score': 3, 'label': 'Intermédiaire', 'hint': 'Quelques investissements, connaissance de base'},
+        {'value': 'avance', 'score': 5, 'label': 'Avancé', 'hint': 'Expérience significative, connaissance approfondie'},
+    ]},
+    {'id': 'q2', 'text': 'Quel est votre horizon d\'investissement principal?', 'options': [
+        {'value': 'court', 'score': 1, 'label': 'Court terme', 'hint': 'Moins de 2 ans'},
+        {'value': 'moyen', 'score': 3, 'label': 'Moyen terme', 'hint': '2 à 5 ans'},
+        {'value': 'long', 'score': 5, 'label': 'Long terme', 'hint': 'Plus de 5 ans'},
+    ]},
+    {'id': 'q3', 'text': 'Comment réagissez-vous face aux fluctuations du marché?', 'options': [
+        {'value': 'vente_panique', 'score': 1, 'label': 'Je vends immédiatement', 'hint': 'La baisse me fait paniquer'},
+        {'value': 'inquiet', 'score': 2, 'label': 'Je suis très inquiet', 'hint': 'J\'envisage de vendre rapidement'},
+        {'value': 'attente', 'score': 3, 'label': 'J\'attends que ça se tasse', 'hint': 'Je ne change rien à court terme'},
+        {'value': 'opportunite', 'score': 4, 'label': 'Je vois une opportunité', 'hint': 'C\'est normal, les marchés fluctuent'},
+        {'value': 'achats', 'score': 5, 'label': 'J\'en profite pour acheter', 'hint': 'Les baisses sont des opportunités'},
+    ]},
+    {'id': 'q4', 'text': 'Quel pourcentage de votre patrimoine souhaitez-vous investir?', 'options': [
+        {'value': 'moins_10', 'score': 1, 'label': 'Moins de 10%', 'hint': 'Investissement très prudent'},
+        {'value': '10_25', 'score': 2, 'label': '10% à 25%', 'hint': 'Approche équilibrée'},
+        {'value': '25_50', 'score': 3, 'label': '25% à 50%', 'hint': 'Investissement significatif'},
+        {'value': '50_75', 'score': 4, 'label': '50% à 75%', 'hint': 'Approche dynamique'},
+        {'value': 'plus_75', 'score': 5, 'label': 'Plus de 75%', 'hint': 'Investisseur très actif'},
+    ]},
+    {'id': 'q5', 'text': 'Quel est votre objectif principal d\'investissement?', 'options': [
+        {'value': 'preservation', 'score': 1, 'label': 'Préserver mon capital', 'hint': 'Sécurité avant tout'},
+        {'value': 'revenus', 'score': 2, 'label': 'Générer des revenus réguliers', 'hint': 'Priorité aux dividendes/coupons'},
+        {'value': 'croissance_moderee', 'score': 3, 'label': 'Croissance modérée', 'hint': 'Équilibre sécurité/rendement'},
+        {'value': 'croissance', 'score': 4, 'label': 'Croissance du capital', 'hint': 'Accepter plus de risque pour plus de rendement'},
+        {'value': 'croissance_aggressive', 'score': 5, 'label': 'Croissance agressive', 'hint': 'Maximiser le potentiel de gain'},
+    ]},
+]
+for _question in QUESTIONS:
+    _question['scores'] = {option['value']: option['score'] for option in _question['options']}
+
+# Profils de risque par score total maximal (le dernier profil couvre tous les scores supérieurs)
+PROFILES = [
+    {
+        'id': 'prudent', 'max_score': 7, 'tolerance': RiskTolerance.FAIBLE, 'profil_score': 1,
+        'name': 'Profil Prudent', 'description': 'Investisseur privilégiant la sécurité du capital', 'color': 'success',
+        'recommendations': ['Fonds euros et obligations d\'État', 'Maximum 20% d\'actifs risqués',
+                            'Épargne réglementée pour la liquidité'],
+    },
+    {
+        'id': 'equilibre', 'max_score': 14, 'tolerance': RiskTolerance.MOYENNE, 'profil_score': 3,
+        'name': 'Profil Équilibré', 'description': 'Investisseur recherchant un compromis rendement/risque', 'color': 'warning',
+        'recommendations': ['Mix 60% sécurité / 40% croissance', 'Fonds mixtes diversifiés', 'SCPI et immobilier locatif'],
+    },
+    {
+        'id': 'dynamique', 'max_score': None, 'tolerance': RiskTolerance.ELEVEE, 'profil_score': 5,
+        'name': 'Profil Dynamique', 'description': 'Investisseur orienté croissance à long terme', 'color': 'danger',
+        'recommendations': ['70% d\'actifs de croissance', 'Actions européennes et internationales',
+                            'Produits structurés et thématiques'],
+    },
+]
+
+
+def profile_for_score(total_score):
+    """Profil de risque correspondant à un score total"""
+    for profile in PROFILES:
+        if profile['max_score'] is None or total_score <= profile['max_score']:
+            return profile
+
+
+def _build_definition():
+    """Définition publiée pour le navigateur (JSON) et son empreinte, calculées une seule fois"""
+    definition = {
+        'version': QUESTIONNAIRE_VERSION,
+        'questions': [{'id': q['id'], 'text': q['text'], 'scores': q['scores']} for q in QUESTIONS],
+        'profiles': [{key: value for key, value in profile.items() if key != 'tolerance'} for profile in PROFILES],
+    }
+    body = json.dumps(definition, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return body, hashlib.sha1(body).hexdigest()[:12]
+
+
+DEFINITION_JSON, DEFINITION_FINGERPRINT = _build_definition()
+
+
+_INSERTS = {
+    'sqlite': sqlite.insert,
+    'postgresql': postgresql.insert,
+}
+
+
+def score_answers(form):
+    """Réponses retenues {question_id: (réponse, score)} et score total"""
+    answers = {}
+    for question in QUESTIONS:
+        reponse = form.get(question['id'])
+        if reponse:
+            answers[question['id']] = (reponse, question['scores'].get(reponse, 0))
+    return answers, sum(score for _, score in answers.values())
+
+
+def save_answers(client, answers):
+    """Enregistre les réponses d'un client : un seul INSERT ... ON CONFLICT pour les réponses modifiées"""
+    table = QuestionnaireResponse.__table__
+    existing = {row.question_id: row for row in db.session.execute(
+        db.select(table.c.question_id, table.c.reponse, table.c.score).where(table.c.client_id == client.id))}
+
+    now = datetime.utcnow()
+    texts = {question['id']: question['text'] for question in QUESTIONS}
+    rows = []
+    changes = []
+    for question_id, (reponse, score) in answers.items():
+        previous = existing.get(question_id)
+        if previous is not None and previous.reponse == reponse and previous.score == score:
+            continue
+        rows.append({
+            'client_id': client.id,
+            'question_id': question_id,
+            'question_text': texts[question_id],
+            'reponse': reponse,
+            'score': score,
+            'date_reponse': now,
+            'version': 1,
+            'version_questionnaire': QUESTIONNAIRE_VERSION,
+        })
+        changes.append(('UPDATE' if previous else 'INSERT', {
+            'question_id': [question_id, question_id],
+            'reponse': [previous.reponse if previous else None, reponse],
+            'score': [previous.score if previous else None, score],
+        }))
+    removed = [question_id for question_id in existing if question_id not in answers]
+
+    if rows:
+        insert = _INSERTS[db.session.get_bind().dialect.name]
+        stmt = insert(table).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.client_id, table.c.question_id],
+            set_={
+                'question_text': stmt.excluded.question_text,
+                'reponse': stmt.excluded.reponse,
+                'score': stmt.excluded.score,
+                'date_reponse': stmt.excluded.date_reponse,
+                'version': table.c.version + 1,
+                'version_questionnaire': stmt.excluded.version_questionnaire,
+            },
+        )
+        db.session.execute(stmt)
+    if removed:
+        db.session.execute(db.delete(table).where(table.c.client_id == client.id, table.c.question_id.in_(removed)))
+        changes.extend(('DELETE', {'question_id': [question_id, question_id],
+                                   'reponse': [existing[question_id].reponse, None]})
+                       for question_id in removed)
+
+    if changes:
+        # Requêtes hors ORM : l'historique est transmis explicitement au journal d'audit
+        record_changes(db.session, 'questionnaire_responses', client.id, changes)
+        client.date_derniere_maj = now
+    return len(changes)
@@ -0,0 +1,265 @@
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from datetime import datetime
+import sqlalchemy as sa
+from sqlalchemy import event
+from app import db
+from db_routing import RoutingSession
+from models import Client, ResultatFiltrage, EntreeListeFiltrage, ScanCheckpoint
+from screening import NameIndex, ScreeningLists, client_full_name
+
+logger = logging.getLogger(__name__)
+
+RESCREEN_WORKERS = int(os.environ.get('RESCREEN_WORKERS', os.cpu_count() or 1))
+# En dessous de ce nombre de noms à rechercher, les recherches restent dans le processus courant
+RESCREEN_PARALLEL_MIN = int(os.environ.get('RESCREEN_PARALLEL_MIN', 500))
+RESCREEN_BATCH_SIZE = int(os.environ.get('RESCREEN_BATCH_SIZE', 1000))
+CHECKPOINT_NAME = 'refiltrage'
+
+_PENDING_KEY = 'client_index_pending'
+_SCREENED_FIELDS = ('nom', 'prenom', 'date_naissance')
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+class ClientIndex:
+    """Index des noms de tous les clients : construit une fois depuis la table, puis tenu à jour par les événements du modèle"""
+
+    def __init__(self):
+        self.index = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self.index is None:
+            with self._lock:
+                if self.index is None:
+                    self.index = self._build()
+        return self.index
+
+    def _build(self):
+        started = time.perf_counter()
+        index = NameIndex()
+        rows = db.session.execute(
+            db.select(Client.id, Client.prenom, Client.nom, Client.date_naissance)
+            .execution_options(yield_per=RESCREEN_BATCH_SIZE))
+        for row in rows:
+            index.add(row.id, f'{row.prenom} {row.nom}', _iso(row.date_naissance))
+        logger.info("Index des clients construit : %d clients en %.0f ms",
+                    len(index), (time.perf_counter() - started) * 1000)
+        return index
+
+    def apply(self, changes):
+        """Applique des changements [(client_id, nom complet ou None si supprimé, date de naissance)]"""
+        if self.index is None:
+            return
+        with self._lock:
+            for client_id, name, date_naissance in changes:
+                self.index.remove(client_id)
+                if name is not None:
+                    self.index.add(client_id, name, date_naissance)
+
+
+_client_index = ClientIndex()
+
+
+def client_index():
+    return _client_index
+
+
+def _queue_client_change(target, deleted=False):
+    session = sa.inspect(target).session
+    if session is None:
+        return
+    change = (target.id, None, None) if deleted else (target.id, client_full_name(target), _iso(target.date_naissance))
+    session.info.setdefault(_PENDING_KEY, []).append(change)
+
+
+@event.listens_for(Client, 'after_insert')
+def _client_inserted(mapper, connection, target):
+    _queue_client_change(target)
+
+
+@event.listens_for(Client, 'after_update')
+def _client_updated(mapper, connection, target):
+    state = sa.inspect(target)
+    if any(state.attrs[field].history.has_changes() for field in _SCREENED_FIELDS):
+        _queue_client_change(target)
+
+
+@event.listens_for(Client, 'after_delete')
+def _client_deleted(mapper, connection, target):
+    _queue_client_change(target, deleted=True)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _apply_client_changes(session):
+    changes = session.info.pop(_PENDING_KEY, None)
+    if changes:
+        _client_index.apply(changes)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_client_changes(session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+def diff_entries(entries):
+    """Entrées ajoutées ou modifiées et clés supprimées depuis le dernier refiltrage"""
+    snapshot = {(row.liste, row.entree_id): row.empreinte for row in db.session.execute(
+        db.select(EntreeListeFiltrage.liste, EntreeListeFiltrage.entree_id, EntreeListeFiltrage.empreinte))}
+    added = [entry for key, entry in entries.items() if key not in snapshot]
+    changed = [entry for key, entry in entries.items() if key in snapshot and snapshot[key] != entry.empreinte]
+    removed = [key for key in snapshot if key not in entries]
+    return added, changed, removed
+
+
+# Index partagé avec les processus de recherche (hérité au fork, sans sérialisation)
+_search_index = None
+
+
+def _search_chunk(queries):
+    return [(ref, match) for ref, name, date_naissance in queries
+            for match in _search_index.search(name, date_naissance)]
+
+
+def search_many(index, queries, workers=RESCREEN_WORKERS):
+    """Recherche une liste de (référence, nom, date de naissance) dans un index, répartie sur plusieurs processus"""
+    global _search_index
+    _search_index = index
+    try:
+        if (workers <= 1 or len(queries) < RESCREEN_PARALLEL_MIN
+                or 'fork' not in multiprocessing.get_all_start_methods()):
+            return _search_chunk(queries)
+        size = -(-len(queries) // (workers * 4))
+        chunks = [queries[i:i + size] for i in range(0, len(queries), size)]
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            return [hit for part in pool.imap_unordered(_search_chunk, chunks) for hit in part]
+    finally:
+        _search_index = None
+
+
+def _collect(hits, entry, client_id, score, nom):
+    key = (client_id, entry.liste, entry.entree_id)
+    if key not in hits or score > hits[key][1]:
+        hits[key] = (entry, score, nom)
+
+
+def _write_hits(hits, version, now):
+    """Insère en bloc les correspondances nouvelles (les correspondances déjà revues sont conservées)"""
+    client_ids = sorted({client_id for client_id, _, _ in hits})
+    existing_clients = set()
+    known = set()
+    for i in range(0, len(client_ids), RESCREEN_BATCH_SIZE):
+        batch = client_ids[i:i + RESCREEN_BATCH_SIZE]
+        existing_clients.update(db.session.scalars(db.select(Client.id).where(Client.id.in_(batch))))
+        known.update(db.session.execute(
+            db.select(ResultatFiltrage.client_id, ResultatFiltrage.liste, ResultatFiltrage.entree_id)
+            .where(ResultatFiltrage.client_id.in_(batch))).all())
+
+    rows = [{
+        'client_id': client_id,
+        'liste': liste,
+        'entree_id': entree_id,
+        'categorie': entry.categorie,
+        'nom_liste': nom,
+        'score': score,
+        'version_liste': version,
+        'date_detection': now,
+        'statut': 'A_REVOIR',
+    } for (client_id, liste, entree_id), (entry, score, nom) in hits.items()
+        if client_id in existing_clients and (client_id, liste, entree_id) not in known]
+    for i in range(0, len(rows), RESCREEN_BATCH_SIZE):
+        db.session.execute(db.insert(ResultatFiltrage), rows[i:i + RESCREEN_BATCH_SIZE])
+    return len(rows)
+
+
+def _save_snapshot(added, changed, removed, now):
+    table = EntreeListeFiltrage
+    if added:
+        rows = [{'liste': e.liste, 'entree_id': e.entree_id, 'empreinte': e.empreinte, 'date_maj': now} for e in added]
+        for i in range(0, len(rows), RESCREEN_BATCH_SIZE):
+            db.session.execute(db.insert(table), rows[i:i + RESCREEN_BATCH_SIZE])
+    if changed:
+        db.session.execute(db.update(table), [
+            {'liste': e.liste, 'entree_id': e.entree_id, 'empreinte': e.empreinte, 'date_maj': now} for e in changed])
+    by_list = {}
+    for liste, entree_id in removed:
+        by_list.setdefault(liste, []).append(entree_id)
+    for liste, ids in by_list.items():
+        for i in range(0, len(ids), RESCREEN_BATCH_SIZE):
+            db.session.execute(db.delete(table).where(table.liste == liste,
+                                                      table.entree_id.in_(ids[i:i + RESCREEN_BATCH_SIZE])))
+
+
+def rescreen_clients(lists=None, workers=RESCREEN_WORKERS, full=False):
+    """Refiltrage incrémental : seules les entrées de liste ajoutées ou modifiées sont recherchées
+    dans l'index des clients, et seuls les clients créés ou modifiés depuis le dernier passage
+    sont recherchés dans l'index complet des listes"""
+    started = time.perf_counter()
+    now = datetime.utcnow()
+    lists = lists or ScreeningLists()
+    lists.refresh(force=True)
+    if not lists.entries:
+        # Dossier vide ou mal configuré : l'empreinte des listes n'est pas effacée
+        logger.warning("Refiltrage ignoré : aucune entrée de liste chargée")
+        return None
+
+    checkpoint = db.session.get(ScanCheckpoint, CHECKPOINT_NAME)
+    since = checkpoint.date_execution if checkpoint and not full else None
+    if full:
+        db.session.execute(db.delete(EntreeListeFiltrage))
+    added, changed, removed = diff_entries(lists.entries)
+
+    # Clients modifiés ailleurs depuis le dernier passage : index rafraîchi et recherche dans les listes
+    changed_clients = []
+    if since is not None:
+        changed_clients = [(row.id, f'{row.prenom} {row.nom}', _iso(row.date_naissance)) for row in db.session.execute(
+            db.select(Client.id, Client.prenom, Client.nom, Client.date_naissance)
+            .where(Client.date_derniere_maj > since))]
+        _client_index.apply(changed_clients)
+
+    hits = {}
+    delta = added + changed
+    if delta:
+        queries = [((entry, nom), nom, entry.date_naissance) for entry in delta for nom in entry.noms]
+        for (entry, nom), match in search_many(_client_index.get(), queries, workers):
+            _collect(hits, entry, match.key, match.score, nom)
+    if changed_clients:
+        for client_id, match in search_many(lists.index, changed_clients, workers):
+            _collect(hits, lists.entries[match.key], client_id, match.score, match.nom)
+
+    written = _write_hits(hits, lists.fingerprint, now) if hits else 0
+    # Clients dont le filtrage avait échoué et qui viennent d'être recherchés (tous en passage complet)
+    retried = (db.update(Client)
+               .where(Client.date_echec_filtrage.is_not(None), Client.date_echec_filtrage <= now)
+               .values(date_echec_filtrage=None, date_derniere_maj=Client.date_derniere_maj))
+    if since is not None:
+        retried = retried.where(Client.date_derniere_maj > since)
+    db.session.execute(retried)
+    _save_snapshot(added, changed, removed, now)
+    if checkpoint is None:
+        checkpoint = ScanCheckpoint(nom=CHECKPOINT_NAME, date_execution=now)
+        db.session.add(checkpoint)
+    checkpoint.date_execution = now
+
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    stats = {
+        'ajoutees': len(added),
+        'modifiees': len(changed),
+        'supprimees': len(removed),
+        'clients_modifies': len(changed_clients),
+        'correspondances': written,
+        'duree_s': round(time.perf_counter() - started, 2),
+    }
+    logger.info("Refiltrage : %s", stats)
+    return stats
@@ -0,0 +1,314 @@
+import os
+import json
+import math
+import time
+import hashlib
+import logging
+from datetime import date, datetime
+from sqlalchemy import event, inspect
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+from db_routing import RoutingSession
+from models import Client, ProfilInvestisseur, ResultatFiltrage, NotationRisque, TypeSouscripteur
+
+# NumPy accélère l'évaluation des règles par colonnes ; on s'en passe s'il n'est pas installé
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Fichier JSON des règles (même structure que DEFAULT_RULES) ; à défaut, les règles par défaut
+RISK_RULES_PATH = os.environ.get('RISK_RULES_PATH')
+RISK_BATCH_SIZE = int(os.environ.get('RISK_BATCH_SIZE', 5000))
+
+# Champs lus par la notation : leur modification déclenche un nouveau calcul
+RATING_FIELDS = {
+    Client: ('revenus_mensuels', 'patrimoine_total', 'charges_mensuelles', 'date_naissance'),
+    ProfilInvestisseur: ('revenus_annuels', 'patrimoine_total', 'type_souscripteur'),
+}
+
+# Variables disponibles pour les règles, calculées pour chaque client
+VARIABLES = {
+    'revenus_annuels': "Revenus annuels (profil investisseur, sinon revenus mensuels x 12)",
+    'patrimoine': "Patrimoine total (profil investisseur, sinon fiche client)",
+    'ratio_patrimoine_revenus': "Patrimoine rapporté aux revenus annuels",
+    'taux_charges': "Charges mensuelles rapportées aux revenus mensuels",
+    'age': "Âge en années",
+    'personne_morale': "1 si le souscripteur est une personne morale",
+    'revenus_manquants': "1 si aucun revenu n'est renseigné",
+    'correspondances_pep': "Correspondances PEP non écartées",
+    'correspondances_sanction': "Correspondances sanctions non écartées",
+}
+
+DEFAULT_RULES = {
+    'regles': [
+        {'id': 'patrimoine_eleve', 'libelle': "Patrimoine supérieur à 1 M€",
+         'variable': 'patrimoine', 'operateur': '>=', 'seuil': 1000000, 'points': 15},
+        {'id': 'patrimoine_disproportionne', 'libelle': "Patrimoine supérieur à 30 ans de revenus",
+         'variable': 'ratio_patrimoine_revenus', 'operateur': '>', 'seuil': 30, 'points': 25},
+        {'id': 'charges_elevees', 'libelle': "Charges supérieures à 60 % des revenus",
+         'variable': 'taux_charges', 'operateur': '>', 'seuil': 0.6, 'points': 10},
+        {'id': 'revenus_inconnus', 'libelle': "Revenus non renseignés",
+         'variable': 'revenus_manquants', 'operateur': '==', 'seuil': 1, 'points': 10},
+        {'id': 'personne_morale', 'libelle': "Souscription par une personne morale",
+         'variable': 'personne_morale', 'operateur': '==', 'seuil': 1, 'points': 15},
+        {'id': 'jeune_client', 'libelle': "Client de moins de 25 ans",
+         'variable': 'age', 'operateur': '<', 'seuil': 25, 'points': 5},
+        {'id': 'pep', 'libelle': "Personne politiquement exposée (correspondance non écartée)",
+         'variable': 'correspondances_pep', 'operateur': '>=', 'seuil': 1, 'points': 35,
+         'vigilance_renforcee': True},
+        {'id': 'sanction', 'libelle': "Correspondance avec une liste de sanctions non écartée",
+         'variable': 'correspondances_sanction', 'operateur': '>=', 'seuil': 1, 'points': 60,
+         'vigilance_renforcee': True},
+    ],
+    # Niveau retenu : premier palier dont le score maximal n'est pas dépassé
+    'niveaux': [
+        {'niveau': 'FAIBLE', 'score_max': 24},
+        {'niveau': 'MOYEN', 'score_max': 49},
+        {'niveau': 'ELEVE', 'score_max': None},
+    ],
+    # Vigilance renforcée au-delà de ce score, ou si une règle marquée vigilance_renforcee est déclenchée
+    'vigilance_renforcee_score': 50,
+}
+
+_OPERATORS = {
+    '>': lambda values, threshold: values > threshold,
+    '>=': lambda values, threshold: values >= threshold,
+    '<': lambda values, threshold: values < threshold,
+    '<=': lambda values, threshold: values <= threshold,
+    '==': lambda values, threshold: values == threshold,
+}
+
+_INSERTS = {
+    'sqlite': sqlite.insert,
+    'postgresql': postgresql.insert,
+}
+
+
+class RiskRules:
+    """Règles validées, avec leur empreinte (version enregistrée avec chaque notation)"""
+
+    def __init__(self, config):
+        self.rules = config['regles']
+        self.levels = config['niveaux']
+        self.edd_score = config.get('vigilance_renforcee_score')
+        if len(self.rules) > 62:
+            raise ValueError("62 règles au maximum (masque des règles déclenchées sur 64 bits)")
+        for rule in self.rules:
+            if rule['variable'] not in VARIABLES:
+                raise ValueError(f"Règle {rule['id']} : variable inconnue {rule['variable']}")
+            if rule['operateur'] not in _OPERATORS:
+                raise ValueError(f"Règle {rule['id']} : opérateur inconnu {rule['operateur']}")
+        self.edd_mask = sum(1 << i for i, rule in enumerate(self.rules) if rule.get('vigilance_renforcee'))
+        self.version = hashlib.sha1(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()
+        self._explanations = {}
+
+    def level(self, score):
+        for level in self.levels:
+            if level['score_max'] is None or score <= level['score_max']:
+                return level['niveau']
+        return self.levels[-1]['niveau']
+
+    def explain(self, mask):
+        """Explication JSON d'un masque de règles, calculée une fois par combinaison"""
+        if mask not in self._explanations:
+            self._explanations[mask] = json.dumps(
+                [{'id': rule['id'], 'libelle': rule['libelle'], 'points': rule['points']}
+                 for i, rule in enumerate(self.rules) if mask >> i & 1], ensure_ascii=False)
+        return self._explanations[mask]
+
+    def needs_edd(self, score, mask):
+        return bool(mask & self.edd_mask) or (self.edd_score is not None and score >= self.edd_score)
+
+
+def load_rules(path=None):
+    path = path or RISK_RULES_PATH
+    if not path:
+        return RiskRules(DEFAULT_RULES)
+    with open(path, encoding='utf-8') as f:
+        return RiskRules(json.load(f))
+
+
+def _rating_query():
+    """Données de notation par client : fiche, dernier profil investisseur, correspondances non écartées"""
+    latest_profile = (db.select(db.func.max(ProfilInvestisseur.id).label('id'))
+                      .group_by(ProfilInvestisseur.client_id).subquery())
+    hits = (db.select(
+                ResultatFiltrage.client_id,
+                db.func.sum(db.case((ResultatFiltrage.categorie == 'PEP', 1), else_=0)).label('pep'),
+                db.func.sum(db.case((ResultatFiltrage.categorie != 'PEP', 1), else_=0)).label('sanction'))
+            .where(ResultatFiltrage.statut != 'FAUX_POSITIF')
+            .group_by(ResultatFiltrage.client_id).subquery())
+    profile = (db.select(ProfilInvestisseur.client_id, ProfilInvestisseur.revenus_annuels,
+                         ProfilInvestisseur.patrimoine_total, ProfilInvestisseur.type_souscripteur)
+               .join(latest_profile, latest_profile.c.id == ProfilInvestisseur.id).subquery())
+    return (db.select(Client.id, Client.revenus_mensuels, Client.patrimoine_total, Client.charges_mensuelles,
+                      Client.date_naissance, profile.c.revenus_annuels.label('profil_revenus'),
+                      profile.c.patrimoine_total.label('profil_patrimoine'), profile.c.type_souscripteur,
+                      hits.c.pep, hits.c.sanction)
+            .outerjoin(profile, profile.c.client_id == Client.id)
+            .outerjoin(hits, hits.c.client_id == Client.id)
+            .order_by(Client.id))
+
+
+def _number(value):
+    return math.nan if value is None else float(value)
+
+
+def _ratio(numerator, denominator):
+    return numerator / denominator if denominator > 0 else math.nan
+
+
+def features(rows, today=None):
+    """Colonnes des variables pour un lot de lignes (NaN pour une donnée absente)"""
+    today = today or date.today()
+    columns = {name: [] for name in VARIABLES}
+    for row in rows:
+        revenus_mensuels = _number(row.revenus_mensuels)
+        revenus = _number(row.profil_revenus)
+        if math.isnan(revenus):
+            revenus = revenus_mensuels * 12
+        patrimoine = _number(row.profil_patrimoine)
+        if math.isnan(patrimoine):
+            patrimoine = _number(row.patrimoine_total)
+        columns['revenus_annuels'].append(revenus)
+        columns['patrimoine'].append(patrimoine)
+        columns['ratio_patrimoine_revenus'].append(_ratio(patrimoine, revenus))
+        columns['taux_charges'].append(_ratio(_number(row.charges_mensuelles), revenus_mensuels))
+        columns['age'].append((today - row.date_naissance).days / 365.25 if row.date_naissance else math.nan)
+        columns['personne_morale'].append(float(row.type_souscripteur == TypeSouscripteur.PERSONNE_MORALE))
+        columns['revenus_manquants'].append(float(math.isnan(revenus)))
+        columns['correspondances_pep'].append(float(row.pep or 0))
+        columns['correspondances_sanction'].append(float(row.sanction or 0))
+    return columns
+
+
+def evaluate(columns, rules):
+    """Scores et masques des règles déclenchées pour chaque ligne (NumPy si disponible)"""
+    if np is not None:
+        size = len(next(iter(columns.values())))
+        scores = np.zeros(size, dtype=np.int64)
+        masks = np.zeros(size, dtype=np.int64)
+        arrays = {}
+        with np.errstate(invalid='ignore'):
+            for i, rule in enumerate(rules.rules):
+                values = arrays.get(rule['variable'])
+                if values is None:
+                    values = arrays[rule['variable']] = np.asarray(columns[rule['variable']], dtype=np.float64)
+                # Les comparaisons avec NaN (donnée absente) sont fausses : la règle ne se déclenche pas
+                triggered = _OPERATORS[rule['operateur']](values, rule['seuil'])
+                scores += triggered * rule['points']
+                masks |= triggered.astype(np.int64) << i
+        return scores.tolist(), masks.tolist()
+
+    scores = []
+    masks = []
+    for row in zip(*(columns[rule['variable']] for rule in rules.rules)):
+        score = mask = 0
+        for i, (rule, value) in enumerate(zip(rules.rules, row)):
+            if _OPERATORS[rule['operateur']](value, rule['seuil']):
+                score += rule['points']
+                mask |= 1 << i
+        scores.append(score)
+        masks.append(mask)
+    return scores, masks
+
+
+def _ratings(client_ids, scores, masks, rules, now):
+    return [{
+        'client_id': client_id,
+        'score': score,
+        'niveau': rules.level(score),
+        'vigilance_renforcee': rules.needs_edd(score, mask),
+        'regles': mask,
+        'explication': rules.explain(mask),
+        'version_regles': rules.version,
+        'date_calcul': now,
+    } for client_id, score, mask in zip(client_ids, scores, masks)]
+
+
+def _save_ratings(rows):
+    table = NotationRisque.__table__
+    insert = _INSERTS[db.session.get_bind().dialect.name]
+    stmt = insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.client_id],
+        set_={column: stmt.excluded[column] for column in
+              ('score', 'niveau', 'vigilance_renforcee', 'regles', 'explication', 'version_regles', 'date_calcul')},
+    )
+    db.session.execute(stmt, rows)
+
+
+def _rate_ids(client_ids, rules=None):
+    rules = rules or _current_rules()
+    rows = db.session.execute(_rating_query().where(Client.id.in_(client_ids))).all()
+    scores, masks = evaluate(features(rows), rules)
+    ratings = _ratings([row.id for row in rows], scores, masks, rules, datetime.utcnow())
+    if ratings:
+        _save_ratings(ratings)
+    return ratings
+
+
+def rate_client(client, rules=None):
+    """Note un client (à l'entrée en relation ou après une revue de filtrage), sans commit"""
+    return _rate_ids([client.id], rules)[0]
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _rerate_changed_clients(session, flush_context):
+    """Recalcule la notation, dans la même transaction, des clients dont la fiche financière ou le profil
+    investisseur a changé (les nouveaux clients sont notés par l'entrée en relation, après le filtrage)"""
+    client_ids = set()
+    for obj in session.new | session.dirty:
+        fields = RATING_FIELDS.get(type(obj))
+        if fields is None or (isinstance(obj, Client) and obj in session.new):
+            continue
+        state = inspect(obj)
+        if obj in session.new or any(state.attrs[field].history.has_changes() for field in fields):
+            client_ids.add(obj.id if isinstance(obj, Client) else obj.client_id)
+    client_ids.discard(None)
+    if client_ids:
+        _rate_ids(client_ids)
+
+
+def rate_all_clients(rules=None, batch_size=RISK_BATCH_SIZE):
+    """Recalcule la notation de tout le portefeuille par lots de colonnes (pagination par id, une transaction
+    par lot : l'écriture ne bloque pas l'application sur SQLite)"""
+    started = time.perf_counter()
+    rules = rules or _current_rules()
+    now = datetime.utcnow()
+    stats = {'clients': 0, 'eleve': 0, 'vigilance_renforcee': 0}
+    last_id = 0
+    while True:
+        rows = db.session.execute(_rating_query().where(Client.id > last_id).limit(batch_size)).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        scores, masks = evaluate(features(rows), rules)
+        ratings = _ratings([row.id for row in rows], scores, masks, rules, now)
+        try:
+            _save_ratings(ratings)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        stats['clients'] += len(ratings)
+        stats['eleve'] += sum(rating['niveau'] == 'ELEVE' for rating in ratings)
+        stats['vigilance_renforcee'] += sum(rating['vigilance_renforcee'] for rating in ratings)
+
+    stats['duree_s'] = round(time.perf_counter() - started, 2)
+    stats['numpy'] = np is not None
+    logger.info("Notation des risques (règles %s) : %s", rules.version[:12], stats)
+    return stats
+
+
+_rules = None
+
+
+def _current_rules():
+    global _rules
+    if _rules is None:
+        _rules = load_rules()
+    return _rules
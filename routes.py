@@ -1,14 +1,37 @@
-from flask import render_template, request, redirect, url_for, flash, send_file, jsonify
+from flask import render_template, request, redirect, url_for, flash, send_file, jsonify, Response, abort
 from werkzeug.utils import secure_filename
 from app import app, db
-from models import Client, Document, QuestionnaireResponse, WorkflowStatus, DocumentType, RiskTolerance, InvestmentHorizon, DER, PieceJustificative, ProfilInvestisseur, DocumentGenere, SuiviWorkflow
-from document_generator import generate_der_document
+from models import Client, Document, QuestionnaireResponse, WorkflowStatus, DocumentType, RiskTolerance, InvestmentHorizon, TypeInvestisseur, NiveauConnaissance, ClassificationSFDR, TypeSouscripteur, DER, PieceJustificative, ProfilInvestisseur, DocumentGenere, SuiviWorkflow, ResultatFiltrage, NotationRisque, Produit, DocumentClient, ApercuFichier
+from document_generator import render_der_document, store_rendered_document, DOCX_MIMETYPE
+from db_routing import read_only_route
+from page_cache import LazyResult, fragment_key, page_etag, not_modified, cacheable_response
+from workflow import WORKFLOW_STEPS, can_transition
+from signature import get_signature_provider, webhooks_enabled, send_envelope, enqueue_events, record_signature, SignatureError
+from notifications import queue_notification
+from sla import overdue_alerts, SLA_LABELS
+from analytics import workflow_report, last_rollup, format_duration
+from screening import screen_client, record_hits
+from risk_rating import rate_client
+from suitability import products_for_profile, profiles_for_product, check_adequacy, product_labels
+from duplicates import find_duplicates, cached_duplicate_pairs, DUPLICATE_REPORT_PAGE_SIZE
+from document_store import unified_documents_ready, client_documents
+from archive import (restore_client, archived_client, archived_rows, archived_documents, archived_document,
+                     search_archived_clients)
+from questionnaire import score_answers, save_answers, profile_for_score, QUESTIONS, DEFINITION_JSON, DEFINITION_FINGERPRINT
 import os
+import json
+import logging
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
 # Configuration des extensions de fichiers autorisées
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'doc', 'docx'}
 
+# Métadonnées des statuts accessibles dans tous les templates
+app.jinja_env.globals['workflow_steps'] = WORKFLOW_STEPS
+app.jinja_env.filters['duree'] = format_duration
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -17,20 +40,10 @@ def calculate_workflow_progress(client):
     if not client:
         return 0
     
-    progress = 0
     total_steps = 6  # Nombre total d'étapes
     
-    # Étape 1: Client créé (16.67%)
-    if client.statut_workflow.name in ['CREATED', 'DER_GENERATED', 'DER_SENT', 'DER_SIGNED', 'DOCUMENTS_UPLOADED', 'QUESTIONNAIRE_COMPLETED', 'COMPLETED']:
-        progress += 1
-    
-    # Étape 2: DER généré (33.33%)
-    if client.statut_workflow.name in ['DER_GENERATED', 'DER_SENT', 'DER_SIGNED', 'DOCUMENTS_UPLOADED', 'QUESTIONNAIRE_COMPLETED', 'COMPLETED']:
-        progress += 1
-    
-    # Étape 3: DER signé (50%)
-    if client.statut_workflow.name in ['DER_SIGNED', 'DOCUMENTS_UPLOADED', 'QUESTIONNAIRE_COMPLETED', 'COMPLETED']:
-        progress += 1
+    # Étapes 1 à 3 (client créé, DER généré, DER signé) : déduites du statut
+    progress = WORKFLOW_STEPS[client.statut_workflow].status_steps
     
     # Étape 4: Documents téléchargés (66.67%) - Vérification réelle des 4 documents requis
     from models import Document, DocumentType
@@ -48,7 +61,7 @@ def calculate_workflow_progress(client):
     if all_required_uploaded:
         progress += 1
         # Mettre à jour automatiquement le statut si tous les documents sont téléchargés
-        if client.statut_workflow.name == 'DER_SIGNED':
+        if client.statut_workflow == WorkflowStatus.DER_SIGNED:
             client.statut_workflow = WorkflowStatus.DOCUMENTS_UPLOADED
             from app import db
             db.session.commit()
@@ -59,37 +72,68 @@ def calculate_workflow_progress(client):
     if profil:
         progress += 1
         # Mettre à jour automatiquement le statut si le questionnaire est complété
-        if client.statut_workflow.name == 'DOCUMENTS_UPLOADED':
+        if client.statut_workflow == WorkflowStatus.DOCUMENTS_UPLOADED:
             client.statut_workflow = WorkflowStatus.QUESTIONNAIRE_COMPLETED
             from app import db
             db.session.commit()
     
     # Étape 6: Processus terminé (100%) - Mettre à jour automatiquement si toutes les étapes sont complètes
-    if progress == 5 and client.statut_workflow.name != 'COMPLETED':
+    if progress == 5 and client.statut_workflow != WorkflowStatus.COMPLETED:
         client.statut_workflow = WorkflowStatus.COMPLETED
         from app import db
         db.session.commit()
         progress += 1
-    elif client.statut_workflow.name == 'COMPLETED':
+    elif client.statut_workflow == WorkflowStatus.COMPLETED:
         progress += 1
     
     return round((progress / total_steps) * 100)
 
+def client_version(client):
+    """Version des données affichées pour un client : dernière mise à jour et derniers mouvements de documents"""
+    model = DocumentClient if unified_documents_ready() else Document
+    doc_stats = db.session.query(
+        db.func.count(model.id),
+        db.func.max(model.date_upload),
+        db.func.max(model.date_envoi_signature),
+        db.func.max(model.date_signature)
+    ).filter(model.client_id == client.id).one()
+    if model is DocumentClient:
+        # Les aperçus produits en tâche de fond modifient aussi la page
+        doc_stats = tuple(doc_stats) + (db.session.scalar(
+            db.select(db.func.count(ApercuFichier.empreinte))
+            .join(DocumentClient, DocumentClient.empreinte == ApercuFichier.empreinte)
+            .where(DocumentClient.client_id == client.id)),)
+    return (client.id, client.statut_workflow.name, client.date_derniere_maj, model.__tablename__) + tuple(doc_stats)
+
+def clients_version():
+    """Version de la liste des clients : nombre de clients et dernière mise à jour"""
+    return db.session.query(
+        db.func.count(Client.id),
+        db.func.max(Client.date_derniere_maj),
+        db.func.max(Client.date_creation)
+    ).one()
+
 
 @app.route('/')
+@read_only_route
 def index():
     """Page d'accueil avec statistiques"""
+    etag = page_etag('index', *clients_version())
+    response = not_modified(etag)
+    if response:
+        return response
+    
     total_clients = Client.query.count()
     clients_en_cours = Client.query.filter(Client.statut_workflow != WorkflowStatus.COMPLETED).count()
     clients_completes = Client.query.filter_by(statut_workflow=WorkflowStatus.COMPLETED).count()
     
     clients_recents = Client.query.order_by(Client.date_creation.desc()).limit(5).all()
     
-    return render_template('index.html', 
+    return cacheable_response(render_template('index.html', 
                          total_clients=total_clients,
                          clients_en_cours=clients_en_cours,
                          clients_completes=clients_completes,
-                         clients_recents=clients_recents)
+                         clients_recents=clients_recents), etag)
 
 @app.route('/onboarding', methods=['GET', 'POST'])
 def client_onboarding():
@@ -102,6 +146,7 @@ def client_onboarding():
                 email=request.form['email'].strip().lower(),
                 telephone=request.form['telephone'].strip(),
                 ville=request.form['ville'].strip(),
+                date_naissance=datetime.strptime(request.form['date_naissance'], '%Y-%m-%d').date() if request.form.get('date_naissance') else None,
                 date_entree_relation=datetime.strptime(request.form['date_entree_relation'], '%Y-%m-%d').date() if request.form.get('date_entree_relation') else datetime.now().date(),
                 statut_workflow=WorkflowStatus.CREATED
             )
@@ -109,8 +154,50 @@ def client_onboarding():
             db.session.add(client)
             db.session.commit()
             
-            # Générer automatiquement le DER
-            der_path = generate_der_document(client)
+            # Doublons probables (clés de blocage indexées, écrites au flush de la fiche)
+            try:
+                duplicates = [d for d in find_duplicates(exclude_client_id=client.id, nom=client.nom, prenom=client.prenom,
+                                                         email=client.email, telephone=client.telephone,
+                                                         ville=client.ville, date_naissance=client.date_naissance)
+                              if d['niveau'] == 'PROBABLE']
+                if duplicates:
+                    names = ', '.join(f"{d['client'].prenom} {d['client'].nom} (#{d['client'].id})" for d in duplicates)
+                    flash(f'Doublon probable avec un client existant : {names}. Vérifiez avant de poursuivre.', 'warning')
+            except Exception:
+                logger.exception("Erreur lors de la recherche de doublons du client %s", client.id)
+            
+            # Filtrage sanctions / PEP (index des listes en mémoire)
+            try:
+                screening_hits = screen_client(client)
+                if screening_hits:
+                    record_hits(client.id, screening_hits)
+                    db.session.commit()
+                    flash(f'{len(screening_hits)} correspondance(s) possible(s) avec les listes de sanctions / PEP : vérification requise.', 'warning')
+            except Exception:
+                # Le filtrage ne doit pas échouer en silence : le client reste en attente de filtrage
+                db.session.rollback()
+                logger.exception("Erreur lors du filtrage sanctions / PEP du client %s", client.id)
+                client.date_echec_filtrage = datetime.utcnow()
+                db.session.commit()
+                flash('Filtrage sanctions / PEP impossible : le client est en attente de filtrage (page Filtrage).', 'error')
+            
+            # Notation de risque LCB-FT (tient compte des correspondances du filtrage)
+            try:
+                rating = rate_client(client)
+                db.session.commit()
+                if rating['vigilance_renforcee']:
+                    flash(f'Risque LCB-FT {rating["niveau"].lower()} (score {rating["score"]}) : vigilance renforcée requise.', 'warning')
+            except Exception:
+                db.session.rollback()
+                logger.exception("Erreur lors de la notation de risque du client %s", client.id)
+            
+            # Générer automatiquement le DER (rendu en mémoire puis écrit en une seule fois)
+            try:
+                rendered_der = render_der_document(client)
+                der_path = store_rendered_document(rendered_der)
+            except Exception:
+                logger.exception("Erreur lors de la génération du DER du client %s", client.id)
+                der_path = None
             if der_path:
                 der_doc = Document(
                     client_id=client.id,
@@ -118,7 +205,7 @@ def client_onboarding():
                     nom_original=f"DER_{client.nom}_{client.prenom}.docx",
                     type_document=DocumentType.DER,
                     chemin_fichier=der_path,
-                    taille_fichier=os.path.getsize(der_path),
+                    taille_fichier=rendered_der.size,
                     genere_automatiquement=True
                 )
                 db.session.add(der_doc)
@@ -199,6 +286,12 @@ def upload_documents(client_id):
             flash('Type de fichier non autorisé', 'error')
     
     documents = Document.query.filter_by(client_id=client_id, genere_automatiquement=False).all()
+    # Aperçus des scans, par identifiant de document (via la table unifiée)
+    previews = dict(db.session.execute(
+        db.select(DocumentClient.source_id, ApercuFichier)
+        .join(ApercuFichier, ApercuFichier.empreinte == DocumentClient.empreinte)
+        .where(DocumentClient.source_table == 'documents', DocumentClient.client_id == client_id,
+               ApercuFichier.vignette_path.is_not(None))).all())
     
     # Calculer la progression des documents obligatoires
     required_docs = [
@@ -218,6 +311,7 @@ def upload_documents(client_id):
     return render_template('upload_documents.html', 
                          client=client, 
                          documents=documents, 
+                         previews=previews, 
                          DocumentType=DocumentType,
                          required_docs_count=required_docs_count,
                          all_required_uploaded=all_required_uploaded,
@@ -230,44 +324,14 @@ def questionnaire(client_id):
     
     if request.method == 'POST':
         try:
-            # Supprimer les anciennes réponses
-            QuestionnaireResponse.query.filter_by(client_id=client_id).delete()
-            
-            total_score = 0
-            questions_data = [
-                {'id': 'q1', 'text': 'Quelle est votre expérience en matière d\'investissement?', 'scores': {'debutant': 1, 'intermediaire': 3, 'avance': 5}},
-                {'id': 'q2', 'text': 'Quel est votre horizon d\'investissement principal?', 'scores': {'court': 1, 'moyen': 3, 'long': 5}},
-                {'id': 'q3', 'text': 'Comment réagissez-vous face aux fluctuations du marché?', 'scores': {'vente_panique': 1, 'inquiet': 2, 'attente': 3, 'opportunite': 4, 'achats': 5}},
-                {'id': 'q4', 'text': 'Quel pourcentage de votre patrimoine souhaitez-vous investir?', 'scores': {'moins_10': 1, '10_25': 2, '25_50': 3, '50_75': 4, 'plus_75': 5}},
-                {'id': 'q5', 'text': 'Quel est votre objectif principal d\'investissement?', 'scores': {'preservation': 1, 'revenus': 2, 'croissance_moderee': 3, 'croissance': 4, 'croissance_aggressive': 5}},
-            ]
-            
-            # Enregistrer les réponses et calculer le score
-            for question in questions_data:
-                reponse = request.form.get(question['id'])
-                if reponse:
-                    score = question['scores'].get(reponse, 0)
-                    total_score += score
-                    
-                    response = QuestionnaireResponse(
-                        client_id=client_id,
-                        question_id=question['id'],
-                        question_text=question['text'],
-                        reponse=reponse,
-                        score=score
-                    )
-                    db.session.add(response)
+            # Enregistrer les réponses (mise à jour en place) et calculer le score
+            answers, total_score = score_answers(request.form)
+            save_answers(client, answers)
             
             # Déterminer le profil basé sur le score total
-            if total_score <= 7:
-                tolerance_risque = RiskTolerance.FAIBLE
-                profil_score = 1
-            elif total_score <= 14:
-                tolerance_risque = RiskTolerance.MOYENNE
-                profil_score = 3
-            else:
-                tolerance_risque = RiskTolerance.ELEVEE
-                profil_score = 5
+            profile = profile_for_score(total_score)
+            tolerance_risque = profile['tolerance']
+            profil_score = profile['profil_score']
             
             # Déterminer l'horizon basé sur la réponse à la question 2
             horizon_reponse = request.form.get('q2')
@@ -294,38 +358,253 @@ def questionnaire(client_id):
             db.session.rollback()
             flash(f'Erreur lors de l\'enregistrement: {str(e)}', 'error')
     
-    return render_template('questionnaire.html', client=client)
+    definition_url = url_for('questionnaire_definition', fingerprint=DEFINITION_FINGERPRINT)
+    return render_template('questionnaire.html', client=client, questions=QUESTIONS, definition_url=definition_url)
 
-    
-    return redirect(url_for('client_details', client_id=client_id))
+@app.route('/questionnaire/definition.<fingerprint>.json')
+def questionnaire_definition(fingerprint):
+    """Définition du questionnaire (questions, scores, profils) pour le calcul côté navigateur"""
+    if fingerprint != DEFINITION_FINGERPRINT:
+        return redirect(url_for('questionnaire_definition', fingerprint=DEFINITION_FINGERPRINT))
+    response = Response(DEFINITION_JSON, mimetype='application/json')
+    # L'URL change avec le contenu : le navigateur peut la garder indéfiniment
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    response.set_etag(DEFINITION_FINGERPRINT)
+    return response.make_conditional(request)
 
 @app.route('/dashboard')
+@read_only_route
 def dashboard():
     """Tableau de bord des clients"""
-    clients = Client.query.order_by(Client.date_derniere_maj.desc()).all()
-    return render_template('dashboard.html', clients=clients, WorkflowStatus=WorkflowStatus)
+    query = request.args.get('q', '').strip()
+    etag = page_etag('dashboard', query, *clients_version())
+    response = not_modified(etag)
+    if response:
+        return response
+    
+    clients = Client.query.order_by(Client.date_derniere_maj.desc())
+    archived_clients = []
+    if query:
+        # La recherche porte aussi sur les dossiers archivés
+        pattern = f'%{query}%'
+        clients = clients.filter(db.or_(Client.nom.ilike(pattern), Client.prenom.ilike(pattern), Client.email.ilike(pattern)))
+        archived_clients = search_archived_clients(query)
+    return cacheable_response(render_template('dashboard.html', clients=clients.all(), archived_clients=archived_clients,
+                                              query=query, WorkflowStatus=WorkflowStatus), etag)
+
+@app.route('/relances')
+@read_only_route
+def overdue():
+    """Dossiers en retard relevés par le scanner SLA"""
+    return render_template('overdue.html', alerts=overdue_alerts(), labels=SLA_LABELS, now=datetime.utcnow())
+
+@app.route('/filtrage')
+def screening_review():
+    """Correspondances sanctions / PEP à revoir"""
+    statut = request.args.get('statut', 'A_REVOIR')
+    hits = (ResultatFiltrage.query
+            .options(db.joinedload(ResultatFiltrage.client))
+            .filter_by(statut=statut)
+            .order_by(ResultatFiltrage.date_detection.desc())
+            .limit(500)
+            .all())
+    pending_clients = (Client.query
+                       .filter(Client.date_echec_filtrage.is_not(None))
+                       .order_by(Client.date_echec_filtrage)
+                       .limit(500)
+                       .all())
+    return render_template('screening_review.html', hits=hits, statut=statut, pending_clients=pending_clients)
+
+@app.route('/filtrage/client/<int:client_id>/relancer', methods=['POST'])
+def rescreen_pending_client(client_id):
+    """Relancer le filtrage d'un client dont le filtrage a échoué"""
+    client = Client.query.get_or_404(client_id)
+    try:
+        screening_hits = screen_client(client)
+        record_hits(client.id, screening_hits)
+        client.date_echec_filtrage = None
+        db.session.flush()
+        rate_client(client)
+        db.session.commit()
+        flash(f'Filtrage effectué pour {client.prenom} {client.nom} : {len(screening_hits)} correspondance(s)', 'success')
+    except Exception as e:
+        db.session.rollback()
+        logger.exception("Erreur lors du filtrage sanctions / PEP du client %s", client_id)
+        flash(f'Filtrage toujours impossible : {str(e)}', 'error')
+    return redirect(url_for('screening_review'))
+
+@app.route('/doublons')
+@read_only_route
+def duplicates_report():
+    """Rapport des doublons possibles dans la base clients, paginé ; les paires ne sont recalculées
+    que lorsque les clients changent"""
+    niveau = request.args.get('niveau', 'PROBABLE')
+    page = max(request.args.get('page', 1, type=int), 1)
+    version = clients_version()
+    etag = page_etag('doublons', niveau, page, *version)
+    response = not_modified(etag)
+    if response:
+        return response
+    pairs = cached_duplicate_pairs(tuple(version))
+    if niveau == 'PROBABLE':
+        pairs = [pair for pair in pairs if pair['niveau'] == 'PROBABLE']
+    start = (page - 1) * DUPLICATE_REPORT_PAGE_SIZE
+    html = render_template('duplicates_report.html', pairs=pairs[start:start + DUPLICATE_REPORT_PAGE_SIZE],
+                           total=len(pairs), niveau=niveau, page=page, first=start + 1,
+                           has_next=start + DUPLICATE_REPORT_PAGE_SIZE < len(pairs))
+    return cacheable_response(html, etag)
+
+@app.route('/filtrage/<int:hit_id>/revue', methods=['POST'])
+def review_screening_hit(hit_id):
+    """Enregistrer la décision du conseiller sur une correspondance"""
+    hit = ResultatFiltrage.query.get_or_404(hit_id)
+    decision = request.form.get('decision')
+    if decision not in ('FAUX_POSITIF', 'CONFIRME'):
+        flash('Décision invalide', 'error')
+        return redirect(url_for('screening_review'))
+    hit.statut = decision
+    hit.date_revue = datetime.utcnow()
+    hit.commentaire = request.form.get('commentaire', '').strip() or None
+    db.session.flush()
+    # La décision modifie les correspondances retenues dans la notation de risque
+    rate_client(hit.client)
+    db.session.commit()
+    flash(f'Correspondance {hit.nom_liste} marquée comme {"faux positif" if decision == "FAUX_POSITIF" else "confirmée"}', 'success')
+    return redirect(url_for('screening_review'))
+
+@app.route('/produits')
+@read_only_route
+def products():
+    """Catalogue des produits"""
+    produits = Produit.query.order_by(Produit.actif.desc(), Produit.srri, Produit.nom).all()
+    return render_template('products.html', produits=produits, product_labels=product_labels)
+
+@app.route('/produits/<int:product_id>/clients')
+@read_only_route
+def product_clients(product_id):
+    """Clients pour lesquels un produit est adapté"""
+    produit = Produit.query.get_or_404(product_id)
+    query = profiles_for_product(produit)
+    return render_template('product_clients.html', produit=produit, total=query.count(),
+                           matches=query.limit(500).all(), product_labels=product_labels)
+
+@app.route('/client/<int:client_id>/adequation')
+@read_only_route
+def client_adequacy(client_id):
+    """Produits adaptés au profil investisseur d'un client, et contrôle d'un produit donné"""
+    client = Client.query.get_or_404(client_id)
+    profil = (ProfilInvestisseur.query.filter_by(client_id=client_id)
+              .order_by(ProfilInvestisseur.id.desc()).first())
+    if not profil:
+        flash('Le profil investisseur doit être complété avant le contrôle d\'adéquation', 'error')
+        return redirect(url_for('client_details', client_id=client_id))
+    
+    checked = None
+    code = request.args.get('produit', '').strip()
+    if code:
+        produit = Produit.query.filter_by(code=code).first()
+        if produit:
+            checked = (produit, check_adequacy(profil, produit))
+        else:
+            flash(f'Produit {code} introuvable dans le catalogue', 'error')
+    
+    return render_template('client_adequacy.html', client=client, profil=profil,
+                           produits=products_for_profile(profil).all(), checked=checked,
+                           product_labels=product_labels)
+
+@app.route('/statistiques')
+@read_only_route
+def workflow_statistics():
+    """Entonnoir, durées par étape et débit par conseiller (agrégats quotidiens)"""
+    days = request.args.get('jours', 365, type=int)
+    checkpoint = last_rollup()
+    etag = page_etag('statistiques', days, checkpoint.dernier_id if checkpoint else 0, datetime.utcnow().date())
+    response = not_modified(etag)
+    if response:
+        return response
+    
+    report = workflow_report(days)
+    return cacheable_response(render_template('statistics.html', report=report, days=days, checkpoint=checkpoint), etag)
 
 @app.route('/client/<int:client_id>')
 def client_details(client_id):
     """Détails d'un client"""
-    client = Client.query.get_or_404(client_id)
-    documents = Document.query.filter_by(client_id=client_id).all()
-    responses = QuestionnaireResponse.query.filter_by(client_id=client_id).all()
+    client = db.session.get(Client, client_id)
+    if client is None:
+        return archived_client_details(client_id)
     
-    # Calculer la progression du workflow
+    # Calculer la progression du workflow (peut faire avancer le statut du client)
     progress = calculate_workflow_progress(client)
     
-    return render_template('client_details.html', 
+    rating = db.session.get(NotationRisque, client_id)
+    version = client_version(client) + (progress, rating.date_calcul if rating else None)
+    etag = page_etag('client_details', *version)
+    response = not_modified(etag)
+    if response:
+        return response
+    
+    # Les listes ne sont chargées que si le fragment n'est pas déjà en cache
+    if unified_documents_ready():
+        # Tous les fichiers du client (documents, DER, pièces, documents générés) en une requête indexée
+        documents = LazyResult(client_documents(client_id))
+        download_endpoint = 'download_client_document'
+    else:
+        documents = LazyResult(Document.query.filter_by(client_id=client_id))
+        download_endpoint = 'download_document'
+    responses = LazyResult(QuestionnaireResponse.query.filter_by(client_id=client_id))
+    
+    return cacheable_response(render_template('client_details.html', 
                          client=client, 
                          documents=documents, 
+                         download_endpoint=download_endpoint, 
                          responses=responses,
                          DocumentType=DocumentType,
-                         progress=progress)
+                         progress=progress,
+                         rating=rating,
+                         rating_rules=json.loads(rating.explication or '[]') if rating else [],
+                         details_fragment_key=fragment_key('client_details', *version)), etag)
+
+def archived_client_details(client_id):
+    """Détails d'un client archivé, lus dans les tables d'archives (lecture seule)"""
+    client = archived_client(client_id)
+    if client is None:
+        abort(404)
+    
+    version = ('archive', client.id, client.date_archivage)
+    etag = page_etag('client_details', *version)
+    response = not_modified(etag)
+    if response:
+        return response
+    
+    ratings = archived_rows('notations_risque', client_id)
+    rating = ratings[0] if ratings else None
+    return cacheable_response(render_template('client_details.html', 
+                         client=client, 
+                         archived=True,
+                         documents=archived_documents(client_id), 
+                         download_endpoint='download_client_document' if unified_documents_ready() else 'download_document', 
+                         responses=archived_rows('questionnaire_responses', client_id),
+                         DocumentType=DocumentType,
+                         progress=100,
+                         rating=rating,
+                         rating_rules=json.loads(rating.explication or '[]') if rating else [],
+                         details_fragment_key=fragment_key('client_details', *version)), etag)
+
+@app.route('/client/<int:client_id>/restaurer', methods=['POST'])
+def restore_archived_client(client_id):
+    """Remettre un dossier archivé dans les tables actives"""
+    if not restore_client(client_id):
+        abort(404)
+    db.session.commit()
+    flash('Dossier client restauré depuis les archives.', 'success')
+    return redirect(url_for('client_details', client_id=client_id))
 
 @app.route('/download/<int:document_id>')
 def download_document(document_id):
     """Téléchargement d'un document"""
-    document = Document.query.get_or_404(document_id)
+    document = db.session.get(Document, document_id) or archived_document('documents', document_id)
+    if document is None:
+        abort(404)
     
     if os.path.exists(document.chemin_fichier):
         return send_file(document.chemin_fichier, 
@@ -335,13 +614,66 @@ def download_document(document_id):
         flash('Fichier introuvable', 'error')
         return redirect(url_for('dashboard'))
 
+@app.route('/documents/<int:document_id>/download')
+def download_client_document(document_id):
+    """Téléchargement d'un fichier de la table unifiée"""
+    document = db.session.get(DocumentClient, document_id) or archived_document('documents_clients', document_id)
+    if document is None:
+        abort(404)
+    
+    if document.chemin_fichier and os.path.exists(document.chemin_fichier):
+        return send_file(document.chemin_fichier, 
+                        as_attachment=True, 
+                        download_name=document.nom_original)
+    else:
+        flash('Fichier introuvable', 'error')
+        return redirect(url_for('client_details', client_id=document.client_id))
+
+@app.route('/apercus/<empreinte>/<kind>.jpg')
+def document_preview_image(empreinte, kind):
+    """Vignette ou aperçu d'un scan (fichier adressé par son contenu, mis en cache sans limite)"""
+    apercu = db.session.get(ApercuFichier, empreinte)
+    path = getattr(apercu, f'{kind}_path', None) if apercu and kind in ('vignette', 'apercu') else None
+    if not path or not os.path.exists(path):
+        abort(404)
+    return send_file(path, mimetype='image/jpeg', max_age=31536000)
+
+@app.route('/der_preview/<int:client_id>')
+def der_preview(client_id):
+    """Aperçu ou téléchargement du DER rendu à la volée, sans écriture sur disque"""
+    client = Client.query.get_or_404(client_id)
+    
+    try:
+        rendered = render_der_document(client)
+    except Exception as e:
+        flash(f'Erreur lors de la génération du DER: {str(e)}', 'error')
+        return redirect(url_for('client_details', client_id=client_id))
+    
+    disposition = 'attachment' if request.args.get('download') else 'inline'
+    response = Response(rendered.content, mimetype=DOCX_MIMETYPE)
+    response.headers['Content-Disposition'] = f'{disposition}; filename="{secure_filename(rendered.filename)}"'
+    response.headers['Content-Length'] = str(rendered.size)
+    response.set_etag(rendered.sha256)
+    return response
+
 @app.route('/send_der/<int:client_id>')
 def send_der_signature(client_id):
     """Envoyer le DER en signature"""
     client = Client.query.get_or_404(client_id)
-    if client.statut_workflow == WorkflowStatus.DER_GENERATED:
+    if can_transition(client, WorkflowStatus.DER_SENT):
+        der = DER.query.filter_by(client_id=client_id).order_by(DER.id.desc()).first()
+        try:
+            send_envelope(client, 'DER', [der] if der else [])
+        except SignatureError as e:
+            flash(f'Erreur lors de l\'envoi en signature : {str(e)}', 'error')
+            return redirect(url_for('client_details', client_id=client_id))
         client.statut_workflow = WorkflowStatus.DER_SENT
         client.date_envoi_der = datetime.utcnow()
+        if der:
+            der.statut = WorkflowStatus.DER_SENT
+            if not der.date_envoi_signature:
+                der.date_envoi_signature = client.date_envoi_der
+        queue_notification(client, 'der_signature')
         db.session.commit()
         flash(f'DER envoyé en signature pour {client.prenom} {client.nom}', 'success')
     else:
@@ -352,9 +684,7 @@ def send_der_signature(client_id):
 def confirm_der_signed(client_id):
     """Confirmer la signature du DER"""
     client = Client.query.get_or_404(client_id)
-    if client.statut_workflow == WorkflowStatus.DER_SENT:
-        client.statut_workflow = WorkflowStatus.DER_SIGNED
-        client.date_signature_der = datetime.utcnow()
+    if record_signature(client, 'DER'):
         db.session.commit()
         flash(f'DER signé confirmé pour {client.prenom} {client.nom}. Vous pouvez maintenant demander les documents KYC.', 'success')
     else:
@@ -434,16 +764,22 @@ def generate_final_documents(client_id):
 def send_documents_signature(client_id):
     """Envoyer tous les documents en signature"""
     client = Client.query.get_or_404(client_id)
-    if client.statut_workflow == WorkflowStatus.DOCUMENTS_GENERATED:
+    if can_transition(client, WorkflowStatus.DOCUMENTS_SENT):
+        documents = Document.query.filter_by(client_id=client_id, genere_automatiquement=True).all()
+        try:
+            send_envelope(client, 'DOCUMENTS', documents)
+        except SignatureError as e:
+            flash(f'Erreur lors de l\'envoi en signature : {str(e)}', 'error')
+            return redirect(url_for('client_details', client_id=client_id))
         client.statut_workflow = WorkflowStatus.DOCUMENTS_SENT
         client.date_envoi_documents = datetime.utcnow()
         
         # Marquer tous les documents générés automatiquement comme envoyés en signature
-        documents = Document.query.filter_by(client_id=client_id, genere_automatiquement=True).all()
         for doc in documents:
             if not doc.date_envoi_signature:
                 doc.date_envoi_signature = datetime.utcnow()
         
+        queue_notification(client, 'documents_signature')
         db.session.commit()
         flash(f'Documents envoyés en signature pour {client.prenom} {client.nom}', 'success')
     else:
@@ -454,29 +790,34 @@ def send_documents_signature(client_id):
 def confirm_documents_signed(client_id):
     """Confirmer la signature de tous les documents"""
     client = Client.query.get_or_404(client_id)
-    if client.statut_workflow == WorkflowStatus.DOCUMENTS_SENT:
-        client.statut_workflow = WorkflowStatus.DOCUMENTS_SIGNED
-        client.date_signature_documents = datetime.utcnow()
-        
-        # Marquer tous les documents comme signés
-        documents = Document.query.filter_by(client_id=client_id, genere_automatiquement=True).all()
-        for doc in documents:
-            doc.date_signature = datetime.utcnow()
-            doc.signe = True
-        
+    if record_signature(client, 'DOCUMENTS'):
         db.session.commit()
         flash(f'Signature des documents confirmée pour {client.prenom} {client.nom}. Vous pouvez maintenant envoyer les bulletins de souscription.', 'success')
     else:
         flash('Impossible de confirmer la signature dans cet état', 'error')
     return redirect(url_for('client_details', client_id=client_id))
 
+@app.route('/webhooks/signature', methods=['POST'])
+def signature_webhook():
+    """Réception des événements du fournisseur de signature (traités ensuite par le worker)"""
+    if not webhooks_enabled():
+        return jsonify({'error': 'Réception des webhooks désactivée (SIGNATURE_WEBHOOK_SECRET non défini)'}), 503
+    provider = get_signature_provider()
+    try:
+        events = provider.parse_webhook(request.get_data(), request.headers)
+    except SignatureError as e:
+        return jsonify({'error': str(e)}), 400
+    queued = enqueue_events(provider, events)
+    return jsonify({'received': len(events), 'queued': queued}), 202
+
 @app.route('/send_subscription_forms/<int:client_id>')
 def send_subscription_forms(client_id):
     """Envoyer les bulletins de souscription"""
     client = Client.query.get_or_404(client_id)
-    if client.statut_workflow == WorkflowStatus.DOCUMENTS_SIGNED:
+    if can_transition(client, WorkflowStatus.SUBSCRIPTION_SENT):
         client.statut_workflow = WorkflowStatus.SUBSCRIPTION_SENT
         client.date_envoi_souscription = datetime.utcnow()
+        queue_notification(client, 'subscription_forms')
         db.session.commit()
         flash(f'Bulletins de souscription envoyés pour {client.prenom} {client.nom}', 'success')
     else:
@@ -584,7 +925,7 @@ def upload_piece_justificative(client_id):
                 type_piece=type_piece,
                 nom_fichier=filename,
                 fichier_path=upload_path,
-                statut='EN_ATTENTE'
+                statut=WorkflowStatus.DOCUMENTS_UPLOADED
             )
             
             db.session.add(piece)
@@ -668,12 +1009,12 @@ def complete_kyc(client_id):
             # Type d'investisseur
             type_inv = request.form.get('type_investisseur')
             if type_inv:
-                profil.type_investisseur = TypeInvestisseur(type_inv)
+                profil.type_investisseur = TypeInvestisseur[type_inv]
             
             # Connaissance et expérience
             niveau_conn = request.form.get('niveau_connaissance')
             if niveau_conn:
-                profil.niveau_connaissance = NiveauConnaissance(niveau_conn)
+                profil.niveau_connaissance = NiveauConnaissance[niveau_conn]
             
             # Capacité financière et tolérance au risque
             profil.garantie_capital = request.form.get('garantie_capital') == 'on'
@@ -688,7 +1029,7 @@ def complete_kyc(client_id):
             # Tolérance au risque et durée d'investissement
             tolerance = request.form.get('tolerance_risque')
             if tolerance:
-                profil.tolerance_risque = RiskTolerance(tolerance)
+                profil.tolerance_risque = RiskTolerance[tolerance]
             
             srri = request.form.get('srri_score')
             if srri:
@@ -696,7 +1037,7 @@ def complete_kyc(client_id):
             
             horizon = request.form.get('horizon_investissement')
             if horizon:
-                profil.horizon_investissement = InvestmentHorizon(horizon)
+                profil.horizon_investissement = InvestmentHorizon[horizon]
             
             duree = request.form.get('duree_investissement_annees')
             if duree:
@@ -705,7 +1046,7 @@ def complete_kyc(client_id):
             # Critères et risques liés à la durabilité
             sfdr = request.form.get('classification_sfdr')
             if sfdr:
-                profil.classification_sfdr = ClassificationSFDR(sfdr)
+                profil.classification_sfdr = ClassificationSFDR[sfdr]
             
             profil.objectif_investissement_durable = request.form.get('objectif_investissement_durable') == 'on'
             
@@ -720,7 +1061,7 @@ def complete_kyc(client_id):
             # Objectifs et besoins du client
             type_sous = request.form.get('type_souscripteur')
             if type_sous:
-                profil.type_souscripteur = TypeSouscripteur(type_sous)
+                profil.type_souscripteur = TypeSouscripteur[type_sous]
             
             # Objectifs d'investissement (multiple selection)
             objectifs_selected = request.form.getlist('objectifs_investissement')
@@ -764,7 +1105,8 @@ def complete_kyc(client_id):
     # Récupérer le profil existant s'il y en a un
     profil = ProfilInvestisseur.query.filter_by(client_id=client.id).first()
     
-    return render_template('complete_kyc.html', client=client, profil=profil)
+    return render_template('complete_kyc.html', client=client, profil=profil,
+                           progress=WORKFLOW_STEPS[client.statut_workflow].progress)
 
 @app.route('/generate_documents/<int:client_id>')
 def generate_documents(client_id):
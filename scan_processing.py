@@ -0,0 +1,177 @@
+import os
+import logging
+import multiprocessing
+from datetime import datetime
+from sqlalchemy.dialects import postgresql, sqlite
+from app import app, db
+from models import Document, DocumentClient, ApercuFichier
+from document_store import file_features
+
+# Pillow (images) et pypdfium2 (première page des PDF) sont facultatifs (extra « scans ») : sans eux, les fichiers restent en attente
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = ImageOps = None
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_FOLDER = os.environ.get('PREVIEW_FOLDER', os.path.join(app.config['UPLOAD_FOLDER'], 'apercus'))
+SCAN_WORKERS = int(os.environ.get('SCAN_WORKERS', os.cpu_count() or 1))
+SCAN_BATCH_SIZE = int(os.environ.get('SCAN_BATCH_SIZE', 50))
+# Plus grand côté d'un scan conservé (A4 à 300 dpi) ; au-delà, l'image est réduite
+IMAGE_MAX_DIMENSION = int(os.environ.get('IMAGE_MAX_DIMENSION', 2480))
+IMAGE_JPEG_QUALITY = int(os.environ.get('IMAGE_JPEG_QUALITY', 85))
+THUMBNAIL_SIZE = 160
+PREVIEW_SIZE = 800
+
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+PDF_EXTENSIONS = {'pdf'}
+
+_INSERTS = {
+    'sqlite': sqlite.insert,
+    'postgresql': postgresql.insert,
+}
+
+
+def _extension(path):
+    return path.rsplit('.', 1)[-1].lower() if '.' in path else ''
+
+
+def _save_derived(image, empreinte, kind, size):
+    derived = image.copy()
+    derived.thumbnail((size, size))
+    if derived.mode not in ('RGB', 'L'):
+        derived = derived.convert('RGB')
+    path = os.path.join(PREVIEW_FOLDER, f'{empreinte}_{kind}.jpg')
+    derived.save(path, 'JPEG', quality=80, optimize=True)
+    return path
+
+
+def normalize_image(path):
+    """Réduit une image trop grande et retire ses métadonnées (EXIF, commentaires) ; le fichier n'est remplacé
+    que si le résultat est plus léger ou si des métadonnées ont été retirées. Retourne l'image normalisée"""
+    with Image.open(path) as original:
+        image_format = original.format
+        had_metadata = bool(original.info.get('exif') or original.info.get('icc_profile') or original.info.get('comment'))
+        if getattr(original, 'is_animated', False):
+            # GIF animé : conservé tel quel, seule la première image sert aux aperçus
+            return original.convert('RGB'), False
+        image = ImageOps.exif_transpose(original)
+    resized = max(image.size) > IMAGE_MAX_DIMENSION
+    if resized:
+        image.thumbnail((IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION), Image.LANCZOS)
+
+    options = {'optimize': True}
+    if image_format == 'JPEG':
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        options.update(quality=IMAGE_JPEG_QUALITY, progressive=True)
+    # Seule la transparence est conservée des informations de l'image (Pillow réécrit le reste de image.info)
+    image.info = {key: value for key, value in image.info.items() if key == 'transparency'}
+
+    temporary = f'{path}.tmp'
+    image.save(temporary, image_format, **options)
+    if resized or had_metadata or os.path.getsize(temporary) < os.path.getsize(path):
+        os.replace(temporary, path)
+        return image, True
+    os.remove(temporary)
+    return image, False
+
+
+def process_file(item):
+    """Traite un fichier (exécuté dans un processus du pool, sans accès à la base)"""
+    empreinte, path = item
+    result = {'source': empreinte, 'path': path, 'changed': False,
+              'apercu': {'statut': 'SANS_APERCU', 'taille_origine': os.path.getsize(path) if os.path.exists(path) else None}}
+    try:
+        extension = _extension(path)
+        if extension in IMAGE_EXTENSIONS and Image is not None:
+            image, result['changed'] = normalize_image(path)
+            image_format = extension
+        elif extension in PDF_EXTENSIONS and pdfium is not None and Image is not None:
+            pdf = pdfium.PdfDocument(path)
+            try:
+                page = pdf[0]
+                # Rendu à la taille de l'aperçu (les pages sont en points, 72 par pouce)
+                image = page.render(scale=PREVIEW_SIZE / max(page.get_size())).to_pil()
+            finally:
+                pdf.close()
+            image_format = 'pdf'
+        else:
+            return result
+        if result['changed']:
+            empreinte, _ = file_features(path)
+        os.makedirs(PREVIEW_FOLDER, exist_ok=True)
+        result['apercu'].update({
+            'statut': 'TRAITE',
+            'format': image_format,
+            'largeur': image.width,
+            'hauteur': image.height,
+            'vignette_path': _save_derived(image, empreinte, 'vignette', THUMBNAIL_SIZE),
+            'apercu_path': _save_derived(image, empreinte, 'apercu', PREVIEW_SIZE),
+        })
+    except Exception as e:
+        result['apercu'].update({'statut': 'ERREUR', 'erreur': str(e)})
+    result['apercu'].update({'empreinte': empreinte, 'taille_finale': os.path.getsize(path) if os.path.exists(path) else None,
+                             'date_traitement': datetime.utcnow()})
+    return result
+
+
+def pending_files(limit=SCAN_BATCH_SIZE):
+    """Fichiers (empreinte, chemin) sans aperçu enregistré, un par contenu. Les PDF restent en attente
+    tant que pypdfium2 n'est pas installé, plutôt que d'être enregistrés sans aperçu"""
+    extensions = IMAGE_EXTENSIONS | (PDF_EXTENSIONS if pdfium is not None else set())
+    return db.session.execute(
+        db.select(DocumentClient.empreinte, db.func.min(DocumentClient.chemin_fichier))
+        .outerjoin(ApercuFichier, ApercuFichier.empreinte == DocumentClient.empreinte)
+        .where(ApercuFichier.empreinte.is_(None), DocumentClient.empreinte.is_not(None),
+               db.or_(*[DocumentClient.chemin_fichier.ilike(f'%.{extension}') for extension in extensions]))
+        .group_by(DocumentClient.empreinte)
+        .limit(limit)).all()
+
+
+def _record(results):
+    table = DocumentClient.__table__
+    for result in results:
+        apercu = result['apercu']
+        if result['changed']:
+            # Contenu normalisé : nouvelle empreinte et nouvelle taille pour toutes les lignes du même fichier
+            db.session.execute(table.update()
+                               .where(table.c.empreinte == result['source'], table.c.chemin_fichier == result['path'])
+                               .values(empreinte=apercu['empreinte'], taille_fichier=apercu['taille_finale']))
+            db.session.execute(Document.__table__.update()
+                               .where(Document.__table__.c.chemin_fichier == result['path'])
+                               .values(taille_fichier=apercu['taille_finale']))
+    rows = [result['apercu'] for result in results]
+    columns = {column for row in rows for column in row}
+    rows = [{column: row.get(column) for column in columns} for row in rows]
+    stmt = _INSERTS[db.session.get_bind().dialect.name](ApercuFichier.__table__).on_conflict_do_nothing(
+        index_elements=['empreinte'])
+    db.session.execute(stmt, rows)
+    db.session.commit()
+
+
+def process_pending(workers=SCAN_WORKERS, batch_size=SCAN_BATCH_SIZE):
+    """Traite les scans en attente par lots, sur un pool de processus ; retourne le nombre de fichiers traités"""
+    if Image is None:
+        logger.warning("Pillow n'est pas installé : normalisation et aperçus désactivés")
+        return 0
+    if pdfium is None:
+        logger.warning("pypdfium2 n'est pas installé : les PDF restent en attente d'aperçu")
+    processed = 0
+    while True:
+        items = [tuple(row) for row in pending_files(batch_size)]
+        if not items:
+            return processed
+        if workers <= 1 or len(items) == 1 or 'fork' not in multiprocessing.get_all_start_methods():
+            results = [process_file(item) for item in items]
+        else:
+            with multiprocessing.get_context('fork').Pool(min(workers, len(items))) as pool:
+                results = pool.map(process_file, items)
+        _record(results)
+        processed += len(results)
+        logger.info("%d scan(s) traité(s), %d normalisé(s)", len(results), sum(result['changed'] for result in results))
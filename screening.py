@@ -0,0 +1,356 @@
+import os
+import re
+import math
+import csv
+import glob
+import time
+import hashlib
+import logging
+import threading
+import unicodedata
+import xml.etree.ElementTree as ET
+from collections import namedtuple, defaultdict, Counter
+from functools import lru_cache
+from itertools import chain
+from datetime import datetime
+from difflib import SequenceMatcher
+from app import db
+from models import ResultatFiltrage
+
+logger = logging.getLogger(__name__)
+
+# Dossier des listes (consolidée UE en CSV, consolidée ONU en XML, ou CSV simple id;nom;prenom;...)
+SCREENING_LISTS_DIR = os.environ.get('SCREENING_LISTS_DIR', 'screening_lists')
+SCREENING_THRESHOLD = float(os.environ.get('SCREENING_THRESHOLD', 0.85))
+# Intervalle minimal entre deux vérifications de modification des fichiers de listes
+SCREENING_RELOAD_INTERVAL = float(os.environ.get('SCREENING_RELOAD_INTERVAL', 60))
+
+# Part minimale des trigrammes de la requête qu'un nom doit partager pour être évalué
+MIN_TRIGRAM_SHARE = 0.4
+# Nombre maximal de noms évalués par requête (les plus proches en trigrammes)
+MAX_CANDIDATES = 48
+
+# Particules ignorées dans la comparaison (« Jean de La Fontaine » ~ « Jean Lafontaine »)
+_PARTICLES = {'de', 'du', 'des', 'd', 'la', 'le', 'les', 'l', 'van', 'von', 'der', 'den',
+              'ben', 'bin', 'ibn', 'el', 'al', 'di', 'da', 'dos', 'y'}
+_LIGATURES = str.maketrans({'œ': 'oe', 'æ': 'ae', 'ß': 'ss', 'ø': 'o', 'đ': 'd', 'ł': 'l'})
+
+# Règles phonétiques simplifiées pour le français (appliquées dans l'ordre)
+_PHONETIC_RULES = [(re.compile(pattern), replacement) for pattern, replacement in [
+    (r'ph', 'f'), (r'gu(?=[eiy])', 'g'), (r'g(?=[eiy])', 'j'), (r'qu', 'k'), (r'q', 'k'),
+    (r'sch', 's'), (r'ch', 's'), (r'sh', 's'), (r'c(?=[eiy])', 's'), (r'ck', 'k'), (r'c', 'k'),
+    (r'w', 'v'), (r'y', 'i'), (r'z', 's'), (r'x', 'ks'), (r'eau', 'o'), (r'au', 'o'),
+    (r'ai|ei', 'e'), (r'ou', 'u'), (r'h', ''), (r'([a-z])\1+', r'\1'),
+    (r'(?<=.)[stxdz]$', ''), (r'(?<=..)e$', ''),
+]]
+_VOWELS = re.compile(r'[aeiou]+')
+
+ListEntry = namedtuple('ListEntry', ['liste', 'entree_id', 'noms', 'date_naissance', 'categorie', 'empreinte'])
+Match = namedtuple('Match', ['key', 'nom', 'score'])
+
+
+class ScreeningUnavailable(Exception):
+    """Aucune liste chargée : le filtrage ne peut pas conclure (il ne doit jamais valider un client par défaut)"""
+
+
+def normalize_name(value):
+    """Jetons normalisés d'un nom : minuscules, sans accents, ligatures ni particules"""
+    value = unicodedata.normalize('NFKD', value.lower().translate(_LIGATURES))
+    value = ''.join(char for char in value if not unicodedata.combining(char))
+    return [token for token in re.sub(r'[^a-z0-9]+', ' ', value).split() if token not in _PARTICLES]
+
+
+@lru_cache(maxsize=65536)
+def phonetic_key(token):
+    """Clé phonétique d'un jeton : première lettre puis squelette consonantique"""
+    for pattern, replacement in _PHONETIC_RULES:
+        token = pattern.sub(replacement, token)
+    return token[:1] + _VOWELS.sub('', token[1:]) if token else token
+
+
+def _trigrams(tokens):
+    text = f"  {' '.join(sorted(tokens))} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+@lru_cache(maxsize=262144)
+def _token_similarity(a, b):
+    # Les mêmes paires de jetons (prénoms courants) reviennent d'une requête à l'autre
+    if a == b:
+        return 1.0
+    if phonetic_key(a) == phonetic_key(b):
+        return 0.95
+    return SequenceMatcher(None, a, b).ratio()
+
+
+def name_similarity(tokens_a, tokens_b):
+    """Similarité symétrique entre deux noms, indépendante de l'ordre des jetons"""
+    if not tokens_a or not tokens_b:
+        return 0.0
+    forward = sum(max(_token_similarity(a, b) for b in tokens_b) for a in tokens_a)
+    backward = sum(max(_token_similarity(b, a) for a in tokens_a) for b in tokens_b)
+    return (forward + backward) / (len(tokens_a) + len(tokens_b))
+
+
+def _birth_year(value):
+    match = re.match(r'(\d{4})', str(value)) if value else None
+    return int(match.group(1)) if match else None
+
+
+def adjust_for_birth_date(score, date_a, date_b):
+    """Renforce le score si les dates de naissance concordent, le réduit si les années diffèrent"""
+    year_a, year_b = _birth_year(date_a), _birth_year(date_b)
+    if year_a is None or year_b is None:
+        return score
+    if str(date_a)[:10] == str(date_b)[:10]:
+        return min(1.0, score + 0.05)
+    if abs(year_a - year_b) > 1:
+        return score * 0.7
+    return score
+
+
+class NameIndex:
+    """Index en mémoire pour la recherche approchée de noms (blocage par trigrammes et clés phonétiques)"""
+
+    def __init__(self):
+        self._names = []                    # (clé, nom affiché, jetons, date de naissance) ou None si retiré
+        self._by_key = defaultdict(list)
+        self._trigrams = defaultdict(list)
+        self._phonetic = defaultdict(list)
+
+    def __len__(self):
+        return len(self._by_key)
+
+    def add(self, key, name, date_naissance=None):
+        tokens = normalize_name(name)
+        if not tokens:
+            return
+        position = len(self._names)
+        self._names.append((key, name, tokens, date_naissance))
+        self._by_key[key].append(position)
+        for trigram in _trigrams(tokens):
+            self._trigrams[trigram].append(position)
+        for phonetic in {phonetic_key(token) for token in tokens}:
+            self._phonetic[phonetic].append(position)
+
+    def remove(self, key):
+        for position in self._by_key.pop(key, []):
+            self._names[position] = None
+
+    def _candidates(self, tokens):
+        # Filtrage par préfixe : un nom partageant au moins `minimum` trigrammes de la requête figure
+        # dans l'une des listes des (n - minimum + 1) trigrammes les plus rares ; seules ces listes
+        # sont comptées, les trigrammes fréquents (prénoms courants) ne sont jamais parcourus
+        query_trigrams = _trigrams(tokens)
+        minimum = max(1, math.ceil(MIN_TRIGRAM_SHARE * len(query_trigrams)))
+        postings = sorted((self._trigrams.get(trigram, ()) for trigram in query_trigrams), key=len)
+        counts = Counter(chain.from_iterable(postings[:len(postings) - minimum + 1]))
+        candidates = {position for position, _ in counts.most_common(MAX_CANDIDATES)}
+
+        # Variantes orthographiques (Mohamed / Muhammad) : tous les jetons doivent se retrouver phonétiquement ;
+        # l'intersection part de la liste la plus courte
+        keys = sorted({phonetic_key(token) for token in tokens}, key=lambda key: len(self._phonetic.get(key, ())))
+        if keys:
+            phonetic = set(self._phonetic.get(keys[0], ()))
+            for key in keys[1:]:
+                if not phonetic:
+                    break
+                phonetic.intersection_update(self._phonetic.get(key, ()))
+            candidates.update(phonetic)
+        return candidates
+
+    def search(self, name, date_naissance=None, threshold=SCREENING_THRESHOLD):
+        """Meilleure correspondance par clé au-dessus du seuil, par score décroissant"""
+        tokens = normalize_name(name)
+        if not tokens:
+            return []
+        best = {}
+        for position in self._candidates(tokens):
+            entry = self._names[position]
+            if entry is None:
+                continue
+            key, display, entry_tokens, entry_date = entry
+            score = adjust_for_birth_date(name_similarity(tokens, entry_tokens), date_naissance, entry_date)
+            if score >= threshold and (key not in best or score > best[key].score):
+                best[key] = Match(key, display, round(score, 3))
+        return sorted(best.values(), key=lambda match: match.score, reverse=True)
+
+
+def _entry(liste, entree_id, noms, date_naissance, categorie):
+    noms = sorted({nom.strip() for nom in noms if nom and nom.strip()})
+    empreinte = hashlib.sha1('|'.join(noms + [date_naissance or '', categorie]).encode('utf-8')).hexdigest()
+    return ListEntry(liste, str(entree_id), tuple(noms), date_naissance, categorie, empreinte)
+
+
+def _default_category(path):
+    return 'PEP' if 'pep' in os.path.basename(path).lower() else 'SANCTION'
+
+
+def parse_eu_csv(path):
+    """Liste consolidée de l'UE (CSV séparé par des points-virgules, une ligne par alias)"""
+    liste = os.path.splitext(os.path.basename(path))[0]
+    names = defaultdict(set)
+    births = {}
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f, delimiter=';'):
+            subject = (row.get('Entity_SubjectType_ClassificationCode') or row.get('Entity_SubjectType') or 'person')
+            if subject.lower() not in ('person', 'p'):
+                continue
+            entity_id = row.get('Entity_LogicalId')
+            whole = row.get('NameAlias_WholeName') or ' '.join(
+                filter(None, [row.get('NameAlias_FirstName'), row.get('NameAlias_LastName')]))
+            if entity_id and whole:
+                names[entity_id].add(whole)
+            if entity_id and row.get('BirthDate_BirthDate'):
+                births.setdefault(entity_id, row['BirthDate_BirthDate'])
+    category = _default_category(path)
+    return [_entry(liste, entity_id, aliases, births.get(entity_id), category) for entity_id, aliases in names.items()]
+
+
+def parse_un_xml(path):
+    """Liste consolidée du Conseil de sécurité de l'ONU (XML, personnes physiques)"""
+    liste = os.path.splitext(os.path.basename(path))[0]
+    category = _default_category(path)
+    entries = []
+    for individual in ET.parse(path).getroot().iter('INDIVIDUAL'):
+        parts = [individual.findtext(tag) for tag in ('FIRST_NAME', 'SECOND_NAME', 'THIRD_NAME', 'FOURTH_NAME')]
+        aliases = [' '.join(filter(None, parts))]
+        aliases += [alias.findtext('ALIAS_NAME') for alias in individual.iter('INDIVIDUAL_ALIAS')]
+        birth = individual.find('INDIVIDUAL_DATE_OF_BIRTH')
+        date_naissance = None
+        if birth is not None:
+            date_naissance = birth.findtext('DATE') or birth.findtext('YEAR')
+        entries.append(_entry(liste, individual.findtext('DATAID'), aliases, date_naissance, category))
+    return entries
+
+
+def parse_simple_csv(path):
+    """CSV simple : id;nom;prenom;date_naissance;alias (séparés par |);categorie"""
+    liste = os.path.splitext(os.path.basename(path))[0]
+    default_category = _default_category(path)
+    entries = []
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f, delimiter=';'):
+            names = [f"{row.get('prenom', '')} {row.get('nom', '')}"]
+            names += (row.get('alias') or '').split('|')
+            entries.append(_entry(liste, row['id'], names, row.get('date_naissance') or None,
+                                  (row.get('categorie') or default_category).upper()))
+    return entries
+
+
+def parse_list_file(path):
+    if path.lower().endswith('.xml'):
+        return parse_un_xml(path)
+    with open(path, encoding='utf-8-sig') as f:
+        header = f.readline()
+    return parse_eu_csv(path) if 'Entity_LogicalId' in header else parse_simple_csv(path)
+
+
+def list_files(directory=None):
+    directory = directory or SCREENING_LISTS_DIR
+    return sorted(glob.glob(os.path.join(directory, '*.csv')) + glob.glob(os.path.join(directory, '*.xml')))
+
+
+def _files_fingerprint(paths):
+    digest = hashlib.sha1()
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f'{path}:{stat.st_mtime_ns}:{stat.st_size}'.encode())
+    return digest.hexdigest()
+
+
+def load_entries(directory=None):
+    entries = []
+    for path in list_files(directory):
+        try:
+            entries.extend(parse_list_file(path))
+        except (OSError, ET.ParseError, csv.Error, KeyError) as e:
+            logger.error("Liste de filtrage illisible %s : %s", path, e)
+    return entries
+
+
+def build_list_index(entries):
+    index = NameIndex()
+    for entry in entries:
+        for nom in entry.noms:
+            index.add((entry.liste, entry.entree_id), nom, entry.date_naissance)
+    return index
+
+
+class ScreeningLists:
+    """Listes chargées et leur index, rechargés quand les fichiers changent"""
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.fingerprint = None
+        self.entries = {}
+        self.index = NameIndex()
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked_at < SCREENING_RELOAD_INTERVAL:
+            return
+        with self._lock:
+            self._checked_at = now
+            paths = list_files(self.directory)
+            fingerprint = _files_fingerprint(paths)
+            if fingerprint == self.fingerprint:
+                return
+            started = time.perf_counter()
+            entries = load_entries(self.directory)
+            self.entries = {(entry.liste, entry.entree_id): entry for entry in entries}
+            self.index = build_list_index(entries)
+            self.fingerprint = fingerprint
+            if not paths:
+                logger.warning("Aucune liste de filtrage dans %s", self.directory or SCREENING_LISTS_DIR)
+            logger.info("Listes de filtrage chargées : %d entrées en %.0f ms",
+                        len(entries), (time.perf_counter() - started) * 1000)
+
+    def screen(self, name, date_naissance=None):
+        self.refresh()
+        if not self.entries:
+            raise ScreeningUnavailable(
+                f"Aucune liste de filtrage chargée depuis {self.directory or SCREENING_LISTS_DIR}")
+        return [(self.entries[match.key], match) for match in self.index.search(name, date_naissance)]
+
+
+_lists = ScreeningLists()
+
+
+def screening_lists():
+    return _lists
+
+
+def client_full_name(client):
+    return f'{client.prenom} {client.nom}'
+
+
+def screen_client(client):
+    """Filtre un client contre les listes chargées ; retourne [(ListEntry, Match)]"""
+    return _lists.screen(client_full_name(client), client.date_naissance.isoformat() if client.date_naissance else None)
+
+
+def record_hits(client_id, hits, version_liste=None):
+    """Ajoute à la table de revue les correspondances non encore enregistrées (sans commit)"""
+    known = set(db.session.execute(
+        db.select(ResultatFiltrage.liste, ResultatFiltrage.entree_id)
+        .where(ResultatFiltrage.client_id == client_id)).all())
+    added = 0
+    for entry, match in hits:
+        if (entry.liste, entry.entree_id) in known:
+            continue
+        db.session.add(ResultatFiltrage(
+            client_id=client_id,
+            liste=entry.liste,
+            entree_id=entry.entree_id,
+            categorie=entry.categorie,
+            nom_liste=match.nom,
+            score=match.score,
+            version_liste=version_liste or _lists.fingerprint,
+            date_detection=datetime.utcnow(),
+            statut='A_REVOIR',
+        ))
+        added += 1
+    return added
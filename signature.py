@@ -0,0 +1,237 @@
+import os
+import hmac
+import json
+import uuid
+import hashlib
+import logging
+from datetime import datetime
+from sqlalchemy.dialects import postgresql, sqlite
+from app import app, db
+from models import Client, Document, DER, SignatureEvent, WorkflowStatus
+from workflow import apply_transition
+# Les signatures sont aussi reportées dans documents_clients (hors serveur web, routes n'est pas importé)
+import document_store  # noqa: F401
+
+logger = logging.getLogger(__name__)
+
+# Fournisseur de signature électronique : 'mock' (simulateur local) par défaut
+SIGNATURE_PROVIDER = os.environ.get('SIGNATURE_PROVIDER', 'mock')
+SIGNATURE_WEBHOOK_SECRET = os.environ.get('SIGNATURE_WEBHOOK_SECRET')
+SIGNATURE_BATCH_SIZE = int(os.environ.get('SIGNATURE_BATCH_SIZE', 200))
+
+SIGNATURE_HEADER = 'X-Signature'
+
+# Sans secret, n'importe qui pourrait forger un webhook signé : la réception des webhooks est désactivée
+# (503), le reste du back-office et la confirmation manuelle des signatures restent disponibles
+if not SIGNATURE_WEBHOOK_SECRET:
+    logger.warning("SIGNATURE_WEBHOOK_SECRET non défini : réception des webhooks de signature désactivée")
+
+_INSERTS = {
+    'sqlite': sqlite.insert,
+    'postgresql': postgresql.insert,
+}
+
+# Colonne du client qui conserve l'enveloppe envoyée, par type de signature
+ENVELOPE_FIELDS = {
+    'DER': 'enveloppe_der',
+    'DOCUMENTS': 'enveloppe_documents',
+}
+
+# Statut cible du client lorsqu'une enveloppe est signée
+SIGNED_STATUS = {
+    'DER': WorkflowStatus.DER_SIGNED,
+    'DOCUMENTS': WorkflowStatus.DOCUMENTS_SIGNED,
+}
+
+
+class SignatureError(Exception):
+    """Erreur de communication avec le fournisseur de signature"""
+
+
+class SignatureProvider:
+    """Interface d'un fournisseur de signature électronique"""
+
+    name = None
+
+    def send_envelope(self, client, kind, documents):
+        """Envoie les documents en signature ; retourne l'identifiant de l'enveloppe"""
+        raise NotImplementedError
+
+    def parse_webhook(self, body, headers):
+        """Vérifie un webhook entrant et retourne la liste des événements normalisés"""
+        raise NotImplementedError
+
+
+class MockSignatureProvider(SignatureProvider):
+    """Simulateur local : enveloppes fictives et webhooks signés en HMAC-SHA256"""
+
+    name = 'mock'
+
+    def __init__(self, secret):
+        self.secret = secret.encode('utf-8') if secret else None
+        self.envelopes = {}
+
+    def send_envelope(self, client, kind, documents):
+        envelope_id = f'mock-{uuid.uuid4().hex}'
+        self.envelopes[envelope_id] = {
+            'client_id': client.id,
+            'kind': kind,
+            'documents': [doc.id for doc in documents],
+        }
+        logger.info("Enveloppe %s (%s) envoyée pour le client %s", envelope_id, kind, client.id)
+        return envelope_id
+
+    def sign(self, body):
+        if self.secret is None:
+            raise SignatureError("Aucun secret de webhook configuré")
+        return hmac.new(self.secret, body, hashlib.sha256).hexdigest()
+
+    def build_webhook(self, client_id, kind, event_type='envelope.signed', envelope_id=None, event_id=None):
+        """Construit le corps et les en-têtes d'un webhook tel que le fournisseur l'enverrait"""
+        event = {
+            'id': event_id or f'evt-{uuid.uuid4().hex}',
+            'type': event_type,
+            'envelope_id': envelope_id or f'mock-{uuid.uuid4().hex}',
+            'occurred_at': datetime.utcnow().isoformat(),
+            'metadata': {'client_id': client_id, 'kind': kind},
+        }
+        body = json.dumps({'events': [event]}).encode('utf-8')
+        return body, {SIGNATURE_HEADER: self.sign(body), 'Content-Type': 'application/json'}
+
+    def parse_webhook(self, body, headers):
+        expected = self.sign(body)
+        if not hmac.compare_digest(expected, headers.get(SIGNATURE_HEADER, '')):
+            raise SignatureError("Signature du webhook invalide")
+        try:
+            payload = json.loads(body)
+            return [{
+                'event_id': event['id'],
+                'envelope_id': event.get('envelope_id'),
+                'client_id': int(event['metadata']['client_id']),
+                'type_signature': event['metadata']['kind'],
+                'type_evenement': event['type'].rsplit('.', 1)[-1],
+                'date_evenement': datetime.fromisoformat(event['occurred_at']),
+                'payload': json.dumps(event),
+            } for event in payload['events']]
+        except (ValueError, KeyError, TypeError) as e:
+            raise SignatureError(f"Webhook mal formé : {str(e)}") from e
+
+
+_PROVIDERS = {
+    'mock': lambda: MockSignatureProvider(SIGNATURE_WEBHOOK_SECRET),
+}
+_provider = None
+
+
+def webhooks_enabled():
+    """Les webhooks ne sont acceptés que si un secret permet d'en vérifier la signature"""
+    return bool(SIGNATURE_WEBHOOK_SECRET)
+
+
+def get_signature_provider():
+    """Instance du fournisseur configuré par SIGNATURE_PROVIDER"""
+    global _provider
+    if _provider is None:
+        if SIGNATURE_PROVIDER not in _PROVIDERS:
+            raise RuntimeError(f"Fournisseur de signature inconnu : {SIGNATURE_PROVIDER}")
+        _provider = _PROVIDERS[SIGNATURE_PROVIDER]()
+    return _provider
+
+
+def send_envelope(client, kind, documents):
+    """Envoie l'enveloppe au fournisseur et conserve son identifiant sur le client (sans valider la transaction)"""
+    envelope_id = get_signature_provider().send_envelope(client, kind, documents)
+    setattr(client, ENVELOPE_FIELDS[kind], envelope_id)
+    return envelope_id
+
+
+def enqueue_events(provider, events):
+    """Ajoute les événements à la file en une seule insertion ; ceux déjà reçus (même event_id) sont ignorés.
+    Les événements d'un client inconnu sont conservés, déjà traités (resultat unknown_client)"""
+    events = [event for event in events if event['type_signature'] in SIGNED_STATUS]
+    if not events:
+        return 0
+    known_clients = set(db.session.scalars(
+        db.select(Client.id).where(Client.id.in_({event['client_id'] for event in events}))))
+    now = datetime.utcnow()
+    rows = []
+    for event in events:
+        known = event['client_id'] in known_clients
+        rows.append(dict(event, provider=provider.name, date_reception=now,
+                         client_id=event['client_id'] if known else None,
+                         resultat=None if known else 'unknown_client',
+                         date_traitement=None if known else now))
+    table = SignatureEvent.__table__
+    # Livraison concurrente ou répétée : les doublons sont ignorés, les autres événements du lot sont conservés
+    insert = _INSERTS[db.session.get_bind().dialect.name]
+    queued = db.session.scalars(insert(table).values(rows)
+                                .on_conflict_do_nothing(index_elements=['event_id'])
+                                .returning(table.c.event_id)).all()
+    db.session.commit()
+    return len(queued)
+
+
+def record_signature(client, kind, signed_at=None):
+    """Reporte la signature sur le client et ses documents ; False si elle n'est pas possible dans l'état actuel
+    (seul chemin vers DER_SIGNED / DOCUMENTS_SIGNED : webhooks, confirmations manuelles et API)"""
+    signed_at = signed_at or datetime.utcnow()
+    if not apply_transition(client, SIGNED_STATUS[kind]):
+        return False
+    if kind == 'DER':
+        client.date_signature_der = signed_at
+        der = DER.query.filter_by(client_id=client.id).order_by(DER.id.desc()).first()
+        if der:
+            der.date_signature = signed_at
+            der.statut = WorkflowStatus.DER_SIGNED
+    else:
+        client.date_signature_documents = signed_at
+        documents = Document.query.filter_by(client_id=client.id, genere_automatiquement=True, signe=False).all()
+        for doc in documents:
+            doc.date_signature = signed_at
+            doc.signe = True
+    return True
+
+
+def _process_event(event, client):
+    if client is None:
+        return 'unknown_client'
+    if event.envelope_id is None or event.envelope_id != getattr(client, ENVELOPE_FIELDS[event.type_signature]):
+        # Enveloppe jamais envoyée par l'application (ou remplacée depuis) : la confirmation manuelle reste possible
+        return 'unknown_envelope'
+    if event.type_evenement != 'signed':
+        # Refus ou expiration : enregistré pour le conseiller, sans changement de statut
+        return 'recorded'
+    return 'applied' if record_signature(client, event.type_signature, event.date_evenement) else 'ignored'
+
+
+def process_signature_events(batch_size=SIGNATURE_BATCH_SIZE):
+    """Traite un lot d'événements en attente, chacun dans un point de sauvegarde : un événement en erreur est
+    marqué (resultat error) sans bloquer les suivants ; retourne le nombre traité"""
+    query = (db.select(SignatureEvent)
+             .where(SignatureEvent.date_traitement.is_(None))
+             .order_by(SignatureEvent.id)
+             .limit(batch_size)
+             .with_for_update(skip_locked=True))
+    events = db.session.scalars(query).all()
+    if not events:
+        return 0
+
+    clients = {client.id: client for client in
+               Client.query.filter(Client.id.in_({event.client_id for event in events})).all()}
+    now = datetime.utcnow()
+    for event in events:
+        try:
+            with db.session.begin_nested():
+                event.resultat = _process_event(event, clients.get(event.client_id))
+                event.date_traitement = now
+        except Exception:
+            logger.exception("Échec du traitement de l'événement de signature %s", event.event_id)
+            event.resultat = 'error'
+            event.date_traitement = now
+
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(events)
@@ -0,0 +1,132 @@
+import os
+import logging
+from collections import namedtuple
+from datetime import datetime, timedelta
+from app import db
+from models import Client, SuiviWorkflow, AlerteSLA, ScanCheckpoint, WorkflowStatus
+from notifications import queue_notification
+
+logger = logging.getLogger(__name__)
+
+SLA_DER_DAYS = int(os.environ.get('SLA_DER_DAYS', 7))
+SLA_DOCUMENTS_DAYS = int(os.environ.get('SLA_DOCUMENTS_DAYS', 7))
+SLA_INACTIVITY_DAYS = int(os.environ.get('SLA_INACTIVITY_DAYS', 30))
+
+CHECKPOINT_NAME = 'sla'
+
+# Règle de délai : statut surveillé (None pour l'inactivité), date de référence et relance client
+SlaRule = namedtuple('SlaRule', ['type_alerte', 'label', 'delay', 'status', 'relance'])
+
+SLA_RULES = [
+    SlaRule('DER_SENT', 'signature du DER', timedelta(days=SLA_DER_DAYS), WorkflowStatus.DER_SENT, True),
+    SlaRule('DOCUMENTS_SENT', 'signature des documents', timedelta(days=SLA_DOCUMENTS_DAYS),
+            WorkflowStatus.DOCUMENTS_SENT, True),
+    SlaRule('INACTIVITE', 'dossier sans action', timedelta(days=SLA_INACTIVITY_DAYS), None, False),
+]
+
+SLA_LABELS = {rule.type_alerte: rule.label for rule in SLA_RULES}
+
+_REFERENCE_COLUMNS = {
+    'DER_SENT': Client.date_envoi_der,
+    'DOCUMENTS_SENT': Client.date_envoi_documents,
+}
+
+
+def _overdue_query(rule, lower, cutoff):
+    """Dossiers devenus en retard dans la fenêtre ]lower, cutoff] (requête par plage sur un index)"""
+    if rule.status is not None:
+        column = _REFERENCE_COLUMNS[rule.type_alerte]
+        query = db.select(Client.id, column).where(Client.statut_workflow == rule.status)
+    else:
+        column = SuiviWorkflow.date_derniere_action
+        query = db.select(SuiviWorkflow.client_id, column).where(SuiviWorkflow.etape_courante != 'TERMINE')
+    query = query.where(column <= cutoff)
+    if lower is not None:
+        query = query.where(column > lower)
+    return query
+
+
+def _raise_alerts(rule, rows, now):
+    """Insère en bloc les alertes absentes et programme les relances ; retourne le nombre d'alertes créées"""
+    if not rows:
+        return 0
+    client_ids = {client_id for client_id, _ in rows}
+    existing = set(db.session.execute(
+        db.select(AlerteSLA.client_id, AlerteSLA.date_reference)
+        .where(AlerteSLA.type_alerte == rule.type_alerte, AlerteSLA.client_id.in_(client_ids))).all())
+    new_rows = [(client_id, reference) for client_id, reference in rows if (client_id, reference) not in existing]
+    if not new_rows:
+        return 0
+
+    db.session.execute(db.insert(AlerteSLA), [{
+        'client_id': client_id,
+        'type_alerte': rule.type_alerte,
+        'date_reference': reference,
+        'date_echeance': reference + rule.delay,
+        'date_creation': now,
+    } for client_id, reference in new_rows])
+
+    if rule.relance:
+        clients = Client.query.filter(Client.id.in_({client_id for client_id, _ in new_rows})).all()
+        for client in clients:
+            queue_notification(client, 'relance', etape=rule.label)
+    return len(new_rows)
+
+
+def _resolve_alerts(since, now):
+    """Clôt les alertes ouvertes dont le dossier a avancé depuis le dernier passage"""
+    moved = db.select(AlerteSLA.id, Client.statut_workflow, AlerteSLA.type_alerte).join(
+        Client, Client.id == AlerteSLA.client_id).where(
+        AlerteSLA.date_resolution.is_(None),
+        AlerteSLA.type_alerte.in_(list(_REFERENCE_COLUMNS)),
+        Client.date_derniere_maj > since,
+    )
+    # Les types d'alerte portent le nom du statut surveillé
+    ids = [alert_id for alert_id, status, type_alerte in db.session.execute(moved) if status.name != type_alerte]
+
+    resumed = db.select(AlerteSLA.id).join(SuiviWorkflow, SuiviWorkflow.client_id == AlerteSLA.client_id).where(
+        AlerteSLA.date_resolution.is_(None),
+        AlerteSLA.type_alerte == 'INACTIVITE',
+        SuiviWorkflow.date_derniere_action > since,
+        SuiviWorkflow.date_derniere_action > AlerteSLA.date_reference,
+    )
+    ids.extend(db.session.scalars(resumed))
+
+    if ids:
+        db.session.execute(db.update(AlerteSLA).where(AlerteSLA.id.in_(ids)).values(date_resolution=now))
+    return len(ids)
+
+
+def scan_sla(now=None):
+    """Passage incrémental : seules les lignes entrées en retard ou modifiées depuis le point de reprise sont lues"""
+    now = now or datetime.utcnow()
+    checkpoint = db.session.get(ScanCheckpoint, CHECKPOINT_NAME)
+    since = checkpoint.date_execution if checkpoint else None
+
+    raised = 0
+    for rule in SLA_RULES:
+        lower = since - rule.delay if since else None
+        rows = db.session.execute(_overdue_query(rule, lower, now - rule.delay)).all()
+        raised += _raise_alerts(rule, rows, now)
+    resolved = _resolve_alerts(since, now) if since else 0
+
+    if checkpoint is None:
+        checkpoint = ScanCheckpoint(nom=CHECKPOINT_NAME, date_execution=now)
+        db.session.add(checkpoint)
+    checkpoint.date_execution = now
+
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return raised, resolved
+
+
+def overdue_alerts():
+    """Alertes ouvertes, de la plus ancienne échéance à la plus récente"""
+    return (AlerteSLA.query
+            .options(db.joinedload(AlerteSLA.client))
+            .filter(AlerteSLA.date_resolution.is_(None))
+            .order_by(AlerteSLA.date_echeance)
+            .all())
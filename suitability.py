@@ -0,0 +1,214 @@
+import enum
+import json
+from sqlalchemy import event
+from app import db
+from db_routing import RoutingSession
+from models import (Client, ProfilInvestisseur, Produit, RiskTolerance, InvestmentHorizon, ClassificationSFDR,
+                    NiveauConnaissance, TypeInvestisseur)
+
+
+class Caracteristique(enum.IntFlag):
+    """Caractéristiques d'un produit : risques portés (bits 0-4) et garanties offertes (bits 5-7)"""
+    PERTE_LIMITEE = 1
+    PERTE_CAPITAL = 2
+    PERTE_EXCEDANT_CAPITAL = 4
+    RENDEMENT_VARIABLE = 8
+    ILLIQUIDITE = 16
+    GARANTIE_CAPITAL = 32
+    RENDEMENT_GARANTI = 64
+    LIQUIDITE_IMMEDIATE = 128
+
+
+RISQUES = (Caracteristique.PERTE_LIMITEE | Caracteristique.PERTE_CAPITAL | Caracteristique.PERTE_EXCEDANT_CAPITAL
+           | Caracteristique.RENDEMENT_VARIABLE | Caracteristique.ILLIQUIDITE)
+GARANTIES = Caracteristique.GARANTIE_CAPITAL | Caracteristique.RENDEMENT_GARANTI | Caracteristique.LIQUIDITE_IMMEDIATE
+
+LABELS = {
+    Caracteristique.PERTE_LIMITEE: "Perte limitée du capital",
+    Caracteristique.PERTE_CAPITAL: "Perte totale du capital",
+    Caracteristique.PERTE_EXCEDANT_CAPITAL: "Perte excédant le capital",
+    Caracteristique.RENDEMENT_VARIABLE: "Rendement variable",
+    Caracteristique.ILLIQUIDITE: "Risque de liquidité",
+    Caracteristique.GARANTIE_CAPITAL: "Garantie du capital",
+    Caracteristique.RENDEMENT_GARANTI: "Rendement garanti",
+    Caracteristique.LIQUIDITE_IMMEDIATE: "Liquidité immédiate",
+}
+
+HORIZON_RANKS = {InvestmentHorizon.COURT: 1, InvestmentHorizon.MOYEN: 2, InvestmentHorizon.LONG: 3}
+SFDR_RANKS = {ClassificationSFDR.ARTICLE_6: 0, ClassificationSFDR.ARTICLE_8: 1, ClassificationSFDR.ARTICLE_9: 2}
+KNOWLEDGE_RANKS = {NiveauConnaissance.FAIBLE_BASIQUE: 1, NiveauConnaissance.INVESTISSEUR_INFORME: 2,
+                   NiveauConnaissance.INVESTISSEUR_CONFIRME: 3}
+INVESTOR_BITS = {TypeInvestisseur.NON_PROFESSIONNEL: 1, TypeInvestisseur.PROFESSIONNEL: 2,
+                 TypeInvestisseur.CONTREPARTIE_ELIGIBLE: 4}
+# SRRI maximal déduit de la tolérance au risque quand le score SRRI n'est pas renseigné
+SRRI_BY_TOLERANCE = {RiskTolerance.FAIBLE: 3, RiskTolerance.MOYENNE: 5, RiskTolerance.ELEVEE: 7}
+
+# Accepter une perte plus large vaut acceptation des pertes moindres
+_LOSS_IMPLIES = {
+    'perte_limitee_capital': Caracteristique.PERTE_LIMITEE,
+    'risque_perte_capital': Caracteristique.PERTE_LIMITEE | Caracteristique.PERTE_CAPITAL,
+    'perte_excedant_capital': (Caracteristique.PERTE_LIMITEE | Caracteristique.PERTE_CAPITAL
+                               | Caracteristique.PERTE_EXCEDANT_CAPITAL),
+    'risque_evolution_rendement': Caracteristique.RENDEMENT_VARIABLE,
+    'risque_liquidite': Caracteristique.ILLIQUIDITE,
+}
+_REQUIREMENTS = {
+    'garantie_capital': Caracteristique.GARANTIE_CAPITAL,
+    'rendement_garanti': Caracteristique.RENDEMENT_GARANTI,
+    'liquidite_immediate': Caracteristique.LIQUIDITE_IMMEDIATE,
+}
+
+
+def submasks(mask):
+    """Tous les sous-ensembles d'un masque (2^k valeurs pour k bits)"""
+    sub = mask
+    while True:
+        yield sub
+        if sub == 0:
+            return
+        sub = (sub - 1) & mask
+
+
+def supersets(mask, universe):
+    return [mask | sub for sub in submasks(universe & ~mask)]
+
+
+def encode_profile(profil):
+    """Encode les réponses du profil investisseur en masques et rangs comparables à ceux des produits"""
+    accepted = 0
+    for field, flags in _LOSS_IMPLIES.items():
+        if getattr(profil, field):
+            accepted |= flags
+    required = 0
+    for field, flag in _REQUIREMENTS.items():
+        if getattr(profil, field):
+            required |= flag
+    sfdr = SFDR_RANKS.get(profil.classification_sfdr, 0)
+    if profil.objectif_investissement_durable:
+        sfdr = SFDR_RANKS[ClassificationSFDR.ARTICLE_9]
+
+    profil.masque_risques = int(accepted)
+    profil.masque_exigences = int(required)
+    profil.srri_max = profil.srri_score or SRRI_BY_TOLERANCE.get(profil.tolerance_risque, 0)
+    profil.rang_horizon = HORIZON_RANKS.get(profil.horizon_investissement, 0)
+    profil.rang_sfdr = sfdr
+    profil.rang_connaissance = KNOWLEDGE_RANKS.get(profil.niveau_connaissance, 0)
+
+
+@event.listens_for(RoutingSession, 'before_flush')
+def _encode_profiles(session, flush_context, instances):
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, ProfilInvestisseur):
+            encode_profile(obj)
+
+
+def products_for_profile(profil, include_inactive=False):
+    """Produits adaptés à un profil : sous-ensembles des risques acceptés, sur-ensembles des garanties exigées"""
+    query = Produit.query.filter(
+        Produit.risques.in_(list(submasks(profil.masque_risques & RISQUES))),
+        Produit.garanties.in_(supersets(profil.masque_exigences, GARANTIES)),
+        Produit.srri <= profil.srri_max,
+        Produit.horizon_min <= profil.rang_horizon,
+        Produit.rang_sfdr >= profil.rang_sfdr,
+        Produit.connaissance_min <= profil.rang_connaissance,
+        Produit.public.in_(supersets(INVESTOR_BITS.get(profil.type_investisseur, 0), sum(INVESTOR_BITS.values()))),
+    )
+    if not include_inactive:
+        query = query.filter(Produit.actif.is_(True))
+    return query.order_by(Produit.srri, Produit.nom)
+
+
+def profiles_for_product(produit):
+    """Profils (avec leur client) pour lesquels le produit est adapté"""
+    investor_types = [investor_type for investor_type, bit in INVESTOR_BITS.items() if produit.public & bit]
+    return (db.session.query(ProfilInvestisseur, Client)
+            .join(Client, Client.id == ProfilInvestisseur.client_id)
+            .filter(
+                ProfilInvestisseur.masque_risques.in_(supersets(produit.risques, RISQUES)),
+                ProfilInvestisseur.masque_exigences.in_(list(submasks(produit.garanties & GARANTIES))),
+                ProfilInvestisseur.srri_max >= produit.srri,
+                ProfilInvestisseur.rang_horizon >= produit.horizon_min,
+                ProfilInvestisseur.rang_sfdr <= produit.rang_sfdr,
+                ProfilInvestisseur.rang_connaissance >= produit.connaissance_min,
+                ProfilInvestisseur.type_investisseur.in_(investor_types),
+            )
+            .order_by(Client.nom, Client.prenom))
+
+
+def check_adequacy(profil, produit):
+    """Motifs d'inadéquation d'un produit pour un profil (liste vide : produit adapté)"""
+    reasons = []
+    if not produit.actif:
+        reasons.append("Produit retiré du catalogue")
+    for flag in Caracteristique(produit.risques & ~profil.masque_risques & RISQUES):
+        reasons.append(f"Risque non accepté par le client : {LABELS[flag]}")
+    for flag in Caracteristique(profil.masque_exigences & ~produit.garanties & GARANTIES):
+        reasons.append(f"Garantie exigée par le client absente : {LABELS[flag]}")
+    if produit.srri > profil.srri_max:
+        reasons.append(f"SRRI {produit.srri} supérieur au maximum du client ({profil.srri_max})")
+    if produit.horizon_min > profil.rang_horizon:
+        reasons.append("Horizon de placement recommandé plus long que celui du client")
+    if produit.rang_sfdr < profil.rang_sfdr:
+        reasons.append("Classification SFDR insuffisante au regard des préférences de durabilité")
+    if produit.connaissance_min > profil.rang_connaissance:
+        reasons.append("Connaissances financières du client insuffisantes pour ce produit")
+    if not produit.public & INVESTOR_BITS.get(profil.type_investisseur, 0):
+        reasons.append("Produit non destiné à ce type d'investisseur")
+    return reasons
+
+
+def product_labels(produit):
+    return [LABELS[flag] for flag in Caracteristique(produit.risques | produit.garanties)]
+
+
+def _flags(names):
+    value = 0
+    for name in names or []:
+        value |= Caracteristique[name]
+    return int(value)
+
+
+def import_products(path):
+    """Charge ou met à jour le catalogue depuis un fichier JSON (liste de produits, clé : code)"""
+    with open(path, encoding='utf-8') as f:
+        items = json.load(f)
+    existing = {produit.code: produit for produit in Produit.query}
+    created = updated = 0
+    for item in items:
+        produit = existing.get(item['code'])
+        if produit is None:
+            produit = Produit(code=item['code'])
+            db.session.add(produit)
+            created += 1
+        else:
+            updated += 1
+        produit.nom = item['nom']
+        produit.emetteur = item.get('emetteur')
+        produit.categorie = item.get('categorie')
+        produit.srri = int(item['srri'])
+        produit.risques = _flags(item.get('risques')) & RISQUES
+        produit.garanties = _flags(item.get('garanties')) & GARANTIES
+        produit.horizon_min = HORIZON_RANKS[InvestmentHorizon[item.get('horizon_min', 'COURT')]]
+        produit.rang_sfdr = SFDR_RANKS[ClassificationSFDR[item.get('sfdr', 'ARTICLE_6')]]
+        produit.connaissance_min = KNOWLEDGE_RANKS[NiveauConnaissance[item.get('connaissance_min', 'FAIBLE_BASIQUE')]]
+        produit.public = sum(INVESTOR_BITS[TypeInvestisseur[name]]
+                             for name in item.get('public', [investor_type.name for investor_type in INVESTOR_BITS]))
+        produit.actif = item.get('actif', True)
+    db.session.commit()
+    return created, updated
+
+
+def encode_all_profiles(batch_size=1000):
+    """Calcule les masques des profils enregistrés avant l'ajout du moteur d'adéquation"""
+    count = 0
+    last_id = 0
+    while True:
+        profils = (ProfilInvestisseur.query.filter(ProfilInvestisseur.id > last_id)
+                   .order_by(ProfilInvestisseur.id).limit(batch_size).all())
+        if not profils:
+            return count
+        for profil in profils:
+            encode_profile(profil)
+        last_id = profils[-1].id
+        count += len(profils)
+        db.session.commit()
@@ -0,0 +1,40 @@
+"""Configuration commune des tests : base SQLite temporaire, recréée pour chaque test"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Fixée avant le premier import de l'application (la configuration est lue à l'import des modules)
+_TMP = tempfile.mkdtemp(prefix='kyc-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_TMP, 'test.db')}"
+os.environ['SCHEMA_AUTO_CREATE'] = '0'
+os.environ['JINJA_CACHE_DIR'] = ''
+os.environ['AUDIT_SPILL_DIR'] = os.path.join(_TMP, 'audit_spill')
+os.environ.setdefault('SIGNATURE_WEBHOOK_SECRET', 'test-secret')
+
+
+@pytest.fixture(scope='session')
+def app():
+    from main import app
+    app.config['TESTING'] = True
+    return app
+
+
+@pytest.fixture
+def db(app):
+    """Schéma vide pour chaque test"""
+    from app import db
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield db
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app, db):
+    return app.test_client()
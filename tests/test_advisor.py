@@ -0,0 +1,43 @@
+"""Attribution des actions au conseiller (user-038) : l'en-tête n'est cru que du proxy de confiance"""
+import ipaddress
+
+import pytest
+
+import workflow
+
+PROXY = '10.0.0.1'
+
+
+@pytest.fixture
+def advisor_for(app, monkeypatch):
+    """Conseiller vu par l'application pour une requête passée par le même ProxyFix qu'en production"""
+    monkeypatch.setattr(workflow, 'TRUSTED_PROXIES', [ipaddress.ip_network(PROXY)])
+    seen = {}
+
+    def endpoint(environ, start_response):
+        with app.request_context(environ):
+            seen['advisor'] = workflow.current_advisor()
+        start_response('204 No Content', [])
+        return [b'']
+
+    monkeypatch.setattr(app.wsgi_app, 'app', endpoint)
+    client = app.test_client()
+
+    def request(remote_addr, **headers):
+        client.get('/', environ_base={'REMOTE_ADDR': remote_addr}, headers=headers)
+        return seen['advisor']
+    return request
+
+
+def test_header_from_trusted_proxy(advisor_for):
+    assert advisor_for(PROXY, **{'X-Forwarded-For': '192.0.2.10', 'X-Remote-User': 'alice'}) == 'alice'
+
+
+def test_forged_forwarded_for_is_ignored(advisor_for):
+    assert advisor_for('203.0.113.9', **{'X-Forwarded-For': PROXY, 'X-Remote-User': 'mallory'}) is None
+
+
+def test_header_ignored_without_trusted_proxy(app, monkeypatch):
+    monkeypatch.setattr(workflow, 'TRUSTED_PROXIES', [])
+    with app.test_request_context('/', headers={'X-Remote-User': 'alice'}, environ_base={'REMOTE_ADDR': PROXY}):
+        assert workflow.current_advisor() is None
@@ -0,0 +1,56 @@
+"""API v1 (user-034) : statut du workflow et transitions autorisées"""
+import pytest
+
+from models import Client, WorkflowStatus
+
+TRANSITIONS = '/api/v1/workflow/transitions'
+
+
+@pytest.fixture
+def clients(db):
+    rows = [
+        Client(nom='Durand', prenom='Paul', email='paul@example.fr', statut_workflow=WorkflowStatus.DER_SENT),
+        Client(nom='Petit', prenom='Anne', email='anne@example.fr', statut_workflow=WorkflowStatus.CREATED),
+    ]
+    db.session.add_all(rows)
+    db.session.commit()
+    return rows
+
+
+def test_workflow_without_status_is_created(client, db):
+    legacy = Client(nom='Ancien', prenom='Dossier', email='ancien@example.fr')
+    db.session.add(legacy)
+    db.session.commit()
+    db.session.execute(Client.__table__.update().values(statut_workflow=None))
+    db.session.commit()
+
+    response = client.get(f'/api/v1/workflow?ids={legacy.id}')
+    assert response.status_code == 200
+    assert response.get_json()['data'][0]['status'] == 'CREATED'
+
+
+def test_transition_with_side_effects_is_refused(client, clients):
+    response = client.post(TRANSITIONS, json={'transitions': [
+        {'client_id': clients[0].id, 'status': 'DER_SIGNED'},
+        {'client_id': clients[1].id, 'status': 'DOCUMENTS_UPLOADED'},
+    ]})
+    assert response.status_code == 409
+    assert 'DOCUMENTS_UPLOADED' in response.get_json()['error']
+
+
+def test_signature_confirmation_is_applied_once(client, db, clients):
+    payload = {'transitions': [{'client_id': clients[0].id, 'status': 'DER_SIGNED'}]}
+    first = client.post(TRANSITIONS, json=payload).get_json()['data'][0]
+    second = client.post(TRANSITIONS, json=payload).get_json()['data'][0]
+
+    assert first['applied'] is True
+    assert second['applied'] is False
+    client_row = db.session.get(Client, clients[0].id)
+    assert client_row.statut_workflow == WorkflowStatus.DER_SIGNED
+    assert client_row.date_signature_der is not None
+
+
+def test_unknown_client_is_reported(client, clients):
+    response = client.post(TRANSITIONS, json={'transitions': [{'client_id': 999, 'status': 'DER_SIGNED'}]})
+    assert response.get_json()['data'][0] == {'client_id': 999, 'status': 'DER_SIGNED', 'applied': False,
+                                              'error': 'Client introuvable'}
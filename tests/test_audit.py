@@ -0,0 +1,91 @@
+"""Journal d'audit (user-039) : capture des différences, modes d'écriture, secours disque et historique paginé"""
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import audit
+from audit import AuditWriter, compress_changes, decompress_changes
+from models import Client, JournalAudit
+
+
+def _entries(db):
+    return db.session.scalars(db.select(JournalAudit).order_by(JournalAudit.id)).all()
+
+
+def _wait_for_entries(db, app, count, timeout=5.0):
+    app.extensions['audit_writer'].flush()
+    deadline = time.monotonic() + timeout
+    while len(_entries(db)) < count and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return _entries(db)
+
+
+@pytest.fixture
+def kyc_client(db):
+    client = Client(nom='Moreau', prenom='Lucie', email='lucie@example.fr', ville='Lyon')
+    db.session.add(client)
+    db.session.commit()
+    return client
+
+
+def test_update_is_written_after_commit(app, db, kyc_client):
+    _wait_for_entries(db, app, 1)
+    kyc_client.ville = 'Paris'
+    db.session.commit()
+
+    entries = _wait_for_entries(db, app, 2)
+    update = [entry for entry in entries if entry.operation == 'UPDATE'][0]
+    assert update.client_id == kyc_client.id
+    assert decompress_changes(update.modifications)['ville'] == ['Lyon', 'Paris']
+
+
+def test_transaction_mode_writes_with_the_business_commit(db, monkeypatch):
+    monkeypatch.setattr(audit, 'AUDIT_MODE', 'transaction')
+    client = Client(nom='Roux', prenom='Marc', email='marc@example.fr')
+    db.session.add(client)
+    db.session.commit()
+    assert [entry.operation for entry in _entries(db)] == ['INSERT']
+
+    client.ville = 'Nantes'
+    db.session.flush()
+    db.session.rollback()
+    assert len(_entries(db)) == 1
+
+
+def test_failed_batch_is_spilled_then_replayed(app, db, tmp_path, monkeypatch):
+    monkeypatch.setattr(audit, 'AUDIT_MAX_RETRIES', 0)
+    writer = AuditWriter(app, spill_dir=str(tmp_path))
+    record = {'mois': '2026-01', 'date_action': datetime(2026, 1, 5), 'client_id': 1, 'table_objet': 'clients',
+              'objet_id': 1, 'operation': 'UPDATE', 'conseiller': None, 'modifications': {'ville': ['A', 'B']}}
+
+    insert = writer._insert
+    monkeypatch.setattr(writer, '_insert', lambda batch: (_ for _ in ()).throw(RuntimeError('base indisponible')))
+    writer._write([record])
+    assert len(list(tmp_path.iterdir())) == 1
+
+    monkeypatch.setattr(writer, '_insert', insert)
+    assert writer.replay_spilled() == 1
+    assert list(tmp_path.iterdir()) == []
+    assert decompress_changes(_entries(db)[0].modifications) == {'ville': ['A', 'B']}
+
+
+def test_history_cursor_follows_date_order(client, db):
+    # Ids dans l'ordre inverse des dates (lots écrits dans le désordre), plusieurs entrées à la même date
+    start = datetime(2026, 3, 1)
+    dates = [start + timedelta(minutes=minute) for minute in (5, 5, 5, 4, 3, 3, 2, 1)]
+    db.session.add_all(JournalAudit(mois='2026-03', date_action=date_action, client_id=7, table_objet='clients',
+                                    objet_id=7, operation='UPDATE', modifications=compress_changes({}))
+                       for date_action in reversed(dates))
+    db.session.commit()
+
+    seen, before = [], None
+    while True:
+        url = '/api/v1/clients/7/audit?limit=3' + (f'&before={before}' if before else '')
+        page = client.get(url).get_json()
+        seen.extend((entry['date_action'], entry['id']) for entry in page['data'])
+        before = page['next_before']
+        if not before:
+            break
+    assert len(seen) == len(dates) == len(set(seen))
+    assert seen == sorted(seen, reverse=True)
@@ -0,0 +1,40 @@
+"""Table unifiée des documents (user-047) : les codes de type inconnus ne bloquent ni la migration ni la recopie"""
+from document_store import migrate_documents
+from models import Client, DocumentClient, DocumentType, PieceJustificative
+
+
+def _client(db):
+    client = Client(nom='Bernard', prenom='Luc', email='luc@example.fr')
+    db.session.add(client)
+    db.session.commit()
+    return client
+
+
+def test_migration_maps_unknown_legacy_code_to_autre(db):
+    client = _client(db)
+    # Ligne ancienne écrite hors ORM, avec un code absent de l'énumération
+    db.session.execute(PieceJustificative.__table__.insert().values(
+        client_id=client.id, type_piece='CARTE_VITALE', nom_fichier='vitale.pdf', fichier_path='/absent/vitale.pdf'))
+    db.session.execute(PieceJustificative.__table__.insert().values(
+        client_id=client.id, type_piece='RELEVE_COMPTE', nom_fichier='rib.pdf', fichier_path='/absent/rib.pdf'))
+    db.session.commit()
+
+    stats = migrate_documents()
+
+    assert stats['pieces_justificatives'] == (2, 0)
+    types = {row.nom_fichier: row.type_document for row in DocumentClient.query}
+    assert types == {'vitale.pdf': DocumentType.AUTRE, 'rib.pdf': DocumentType.RELEVE_BANCAIRE}
+
+
+def test_compatibility_listener_accepts_unknown_code(db):
+    client = _client(db)
+    piece = PieceJustificative(client_id=client.id, type_piece='CARTE_VITALE',
+                               nom_fichier='vitale.pdf', fichier_path='/absent/vitale.pdf')
+    db.session.add(piece)
+    db.session.flush()
+    # Identifiant lu avant le commit : l'ORM ne sait pas relire le code hors énumération de l'ancienne table
+    piece_id = piece.id
+    db.session.commit()
+
+    mirrored = DocumentClient.query.filter_by(source_table='pieces_justificatives', source_id=piece_id).one()
+    assert mirrored.type_document == DocumentType.AUTRE
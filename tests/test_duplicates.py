@@ -0,0 +1,49 @@
+"""Détection des doublons (user-046) : recherche classée par poids, rapport robuste aux clés orphelines"""
+import pytest
+
+import duplicates
+from duplicates import duplicate_pairs, find_duplicates
+from models import CleDoublon, Client
+
+
+@pytest.fixture(autouse=True)
+def empty_report_cache(monkeypatch):
+    monkeypatch.setattr(duplicates, '_report', (None, None))
+
+
+def test_shared_email_is_not_crowded_out(db):
+    db.session.add_all(Client(nom='Dupont', prenom='Jean', email=f'jean{i}@example.fr', ville='Paris')
+                       for i in range(60))
+    target = Client(nom='Martin', prenom='Paul', email='cible@example.fr', ville='Lyon')
+    db.session.add(target)
+    db.session.commit()
+
+    results = find_duplicates(nom='Dupont', prenom='Jean', email='cible@example.fr', ville='Paris')
+    assert results[0]['client'].id == target.id
+
+
+def test_orphan_keys_are_ignored(client, db):
+    first = Client(nom='Leroy', prenom='Anne', email='anne@example.fr')
+    second = Client(nom='Leroy', prenom='Anne', email='anne+pro@example.fr')
+    db.session.add_all([first, second])
+    db.session.commit()
+    assert len(duplicate_pairs()) == 1
+    second_id = second.id
+
+    # Suppression hors ORM : les clés du client restent dans cles_doublons
+    db.session.execute(Client.__table__.delete().where(Client.id == second_id))
+    db.session.commit()
+    assert db.session.query(CleDoublon).filter_by(client_id=second_id).count() > 0
+
+    assert duplicate_pairs() == []
+    assert client.get('/doublons?niveau=TOUS').status_code == 200
+
+
+def test_report_is_paginated(client, db, monkeypatch):
+    monkeypatch.setattr('routes.DUPLICATE_REPORT_PAGE_SIZE', 2)
+    db.session.add_all(Client(nom='Roche', prenom='Eva', email=f'eva+{i}@example.fr', ville='Nice') for i in range(3))
+    db.session.commit()
+
+    first = client.get('/doublons?niveau=TOUS').get_data(as_text=True)
+    assert 'Paires 1 à 2 sur 3' in first and 'page=2' in first
+    assert 'Paires 3 à 3 sur 3' in client.get('/doublons?niveau=TOUS&page=2').get_data(as_text=True)
@@ -0,0 +1,27 @@
+"""Budget du temps d'import d'un worker (user-028), mesuré comme benchmarks/import_time.py"""
+import os
+import statistics
+
+from benchmarks.import_time import LAZY_MODULES, run_importtime
+
+IMPORT_TIME_BUDGET_MS = float(os.environ.get('IMPORT_TIME_BUDGET_MS', 1000))
+RUNS = 3
+
+
+def _env():
+    env = dict(os.environ, SCHEMA_AUTO_CREATE='0')
+    env.setdefault('SIGNATURE_WEBHOOK_SECRET', 'test-secret')
+    return env
+
+
+def test_worker_import_within_budget():
+    env = _env()
+    run_importtime('main', env)  # compile les .pyc
+    timings = [run_importtime('main', env) for _ in range(RUNS)]
+    median_ms = statistics.median(timing['main'][1] / 1000 for timing in timings)
+    assert median_ms <= IMPORT_TIME_BUDGET_MS
+
+
+def test_python_docx_loaded_lazily():
+    timings = run_importtime('main', _env())
+    assert not [name for name in timings if name.split('.')[0] in LAZY_MODULES]
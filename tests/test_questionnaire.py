@@ -0,0 +1,36 @@
+"""Questionnaire (user-041) : formulaire, définition publiée et score issus de la même source"""
+import json
+import re
+
+from models import Client
+from questionnaire import DEFINITION_FINGERPRINT, QUESTIONS, score_answers
+
+
+def test_form_matches_published_definition(client, db):
+    customer = Client(nom='Blanc', prenom='Léa', email='lea@example.fr')
+    db.session.add(customer)
+    db.session.commit()
+
+    html = client.get(f'/questionnaire/{customer.id}').get_data(as_text=True)
+    definition = client.get(f'/questionnaire/definition.{DEFINITION_FINGERPRINT}.json').get_json()
+
+    rendered = {}
+    for name, value in re.findall(r'type="radio" name="(\w+)" id="[^"]+" value="([^"]+)"', html):
+        rendered.setdefault(name, []).append(value)
+    assert rendered == {question['id']: list(question['scores']) for question in definition['questions']}
+    for question in QUESTIONS:
+        assert question['text'].replace("'", '&#39;') in html
+
+
+def test_server_score_uses_option_scores():
+    form = {question['id']: question['options'][-1]['value'] for question in QUESTIONS}
+    answers, total = score_answers(form)
+    assert total == sum(question['options'][-1]['score'] for question in QUESTIONS)
+    assert len(answers) == len(QUESTIONS)
+
+
+def test_stale_fingerprint_redirects(client):
+    response = client.get('/questionnaire/definition.0000.json')
+    assert response.status_code == 302
+    assert DEFINITION_FINGERPRINT in response.headers['Location']
+    assert json.loads(client.get(response.headers['Location']).get_data())['version'] >= 1
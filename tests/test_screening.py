@@ -0,0 +1,39 @@
+"""Filtrage sanctions / PEP (user-042) : variantes orthographiques et échec fermé sans liste"""
+import pytest
+
+import screening
+from models import Client
+from screening import NameIndex, ScreeningLists, ScreeningUnavailable
+
+
+def test_spelling_variant_is_found():
+    index = NameIndex()
+    index.add(('UE', '1'), 'Muhammad Ali')
+    index.add(('UE', '2'), 'Marie Dubois')
+    assert [match.key for match in index.search('Mohamed Ali')] == [('UE', '1')]
+
+
+def test_phonetic_candidates_match_every_token(monkeypatch):
+    # Sans les candidats par trigrammes, seuls restent ceux de l'intersection phonétique
+    monkeypatch.setattr(screening, 'MAX_CANDIDATES', 0)
+    index = NameIndex()
+    index.add(('UE', 'cible'), 'Muhammad Ali Traore')
+    index.add(('UE', 'sans-ali'), 'Mohammed Traore')
+    for i in range(5):
+        index.add(('UE', f'ali-{i}'), f'Ali Karim{i}')
+    candidates = index._candidates(screening.normalize_name('Mohamed Ali Traoré'))
+    assert {index._names[position][0] for position in candidates} == {('UE', 'cible')}
+
+
+def test_screening_without_lists_fails_closed(tmp_path):
+    lists = ScreeningLists(str(tmp_path))
+    with pytest.raises(ScreeningUnavailable):
+        lists.screen('Marie Dubois')
+
+
+def test_onboarding_without_lists_leaves_client_pending(client, db, tmp_path, monkeypatch):
+    monkeypatch.setattr(screening, '_lists', ScreeningLists(str(tmp_path)))
+    client.post('/onboarding', data={'nom': 'Dubois', 'prenom': 'Marie', 'email': 'marie@example.fr',
+                                     'telephone': '0600000000', 'ville': 'Lille'})
+    customer = db.session.query(Client).filter_by(email='marie@example.fr').one()
+    assert customer.date_echec_filtrage is not None
@@ -0,0 +1,98 @@
+"""Webhooks de signature (user-035) : vérification HMAC, idempotence et application des événements"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import signature
+from models import Client, DER, SignatureEvent, WorkflowStatus
+from signature import get_signature_provider
+
+WEBHOOK = '/webhooks/signature'
+
+
+@pytest.fixture(autouse=True)
+def fresh_provider(monkeypatch):
+    """Fournisseur recréé à chaque test, avec le secret en vigueur"""
+    monkeypatch.setattr(signature, '_provider', None)
+
+
+@pytest.fixture
+def sent_client(db):
+    client = Client(nom='Martin', prenom='Claire', email='claire@example.fr', statut_workflow=WorkflowStatus.DER_SENT,
+                    enveloppe_der='env-1')
+    db.session.add(client)
+    db.session.commit()
+    return client
+
+
+def test_app_starts_without_secret():
+    env = {key: value for key, value in os.environ.items() if key not in ('SIGNATURE_WEBHOOK_SECRET', 'FLASK_DEBUG')}
+    result = subprocess.run([sys.executable, '-c', 'import main'], cwd=os.path.dirname(os.path.dirname(__file__)),
+                            env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr[-2000:]
+
+
+def test_webhook_disabled_without_secret(client, monkeypatch):
+    body, headers = get_signature_provider().build_webhook(1, 'DER')
+    monkeypatch.setattr(signature, 'SIGNATURE_WEBHOOK_SECRET', None)
+    response = client.post(WEBHOOK, data=body, headers=headers)
+    assert response.status_code == 503
+
+
+def test_webhook_rejects_bad_signature(client, db):
+    body, headers = get_signature_provider().build_webhook(1, 'DER')
+    response = client.post(WEBHOOK, data=body, headers={**headers, 'X-Signature': '0' * 64})
+    assert response.status_code == 400
+    assert db.session.query(SignatureEvent).count() == 0
+
+
+def test_webhook_rejects_unsigned_payload(client, db):
+    body, headers = get_signature_provider().build_webhook(1, 'DER')
+    response = client.post(WEBHOOK, data=body, headers={'Content-Type': 'application/json'})
+    assert response.status_code == 400
+
+
+def test_redelivered_event_is_queued_once(client, db, sent_client):
+    body, headers = get_signature_provider().build_webhook(sent_client.id, 'DER', envelope_id='env-1',
+                                                            event_id='evt-1')
+    assert client.post(WEBHOOK, data=body, headers=headers).get_json()['queued'] == 1
+    assert client.post(WEBHOOK, data=body, headers=headers).get_json()['queued'] == 0
+    assert db.session.query(SignatureEvent).count() == 1
+
+
+def test_unknown_client_is_recorded(client, db):
+    body, headers = get_signature_provider().build_webhook(999, 'DER')
+    assert client.post(WEBHOOK, data=body, headers=headers).status_code == 202
+    event = db.session.query(SignatureEvent).one()
+    assert event.client_id is None
+    assert event.resultat == 'unknown_client'
+    assert json.loads(event.payload)['metadata']['client_id'] == 999
+
+
+def test_batch_with_duplicates_is_inserted_once(db, sent_client):
+    provider = get_signature_provider()
+    events = []
+    for event_id in ('evt-a', 'evt-b', 'evt-a'):
+        body, headers = provider.build_webhook(sent_client.id, 'DER', envelope_id='env-1', event_id=event_id)
+        events.extend(provider.parse_webhook(body, headers))
+    assert signature.enqueue_events(provider, events) == 2
+    assert signature.enqueue_events(provider, events) == 0
+
+
+def test_signed_event_marks_der_signed(client, db, sent_client):
+    from datetime import date
+    der = DER(client_id=sent_client.id, date_entree_relation=date.today(), statut=WorkflowStatus.DER_SENT)
+    db.session.add(der)
+    db.session.commit()
+    body, headers = get_signature_provider().build_webhook(sent_client.id, 'DER', envelope_id='env-1')
+    client.post(WEBHOOK, data=body, headers=headers)
+
+    assert signature.process_signature_events() == 1
+    db.session.expire_all()
+    assert db.session.get(Client, sent_client.id).statut_workflow == WorkflowStatus.DER_SIGNED
+    der = db.session.get(DER, der.id)
+    assert der.statut == WorkflowStatus.DER_SIGNED
+    assert der.date_signature is not None
@@ -0,0 +1,166 @@
+import os
+import ipaddress
+from collections import namedtuple
+from datetime import datetime
+from flask import has_request_context, request
+from sqlalchemy import event, inspect
+from db_routing import RoutingSession
+from models import Client, TransitionStatut, WorkflowStatus
+
+# En-tête portant l'identifiant du conseiller, posé par le proxy d'authentification
+ADVISOR_HEADER = os.environ.get('ADVISOR_HEADER', 'X-Remote-User')
+# Adresses (ou réseaux CIDR) du proxy d'authentification, séparées par des virgules. L'en-tête n'est cru que
+# s'il vient directement de l'un d'eux ; sans proxy configuré, les actions ne sont pas attribuées
+TRUSTED_PROXIES = [ipaddress.ip_network(value.strip(), strict=False)
+                   for value in os.environ.get('TRUSTED_PROXY', '').split(',') if value.strip()]
+
+# Action suivante proposée pour un statut : endpoint Flask, libellés, icône Font Awesome et couleur Bootstrap
+NextAction = namedtuple('NextAction', ['endpoint', 'label', 'short_label', 'icon', 'button'])
+
+# Métadonnées précalculées d'un statut du workflow
+WorkflowStep = namedtuple('WorkflowStep', [
+    'status',
+    'ordinal',        # Position dans le workflow (0 = créé)
+    'progress',       # Pourcentage d'avancement estimé à partir du seul statut
+    'status_steps',   # Étapes de progression validées par le statut (création, DER généré, DER signé)
+    'badge',          # Classe Bootstrap du badge de statut
+    'next_action',    # NextAction ou None
+    'transitions',    # Statuts accessibles depuis ce statut
+])
+
+_ORDER = [
+    WorkflowStatus.CREATED,
+    WorkflowStatus.DER_GENERATED,
+    WorkflowStatus.DER_SENT,
+    WorkflowStatus.DER_SIGNED,
+    WorkflowStatus.DOCUMENTS_UPLOADED,
+    WorkflowStatus.QUESTIONNAIRE_COMPLETED,
+    WorkflowStatus.DOCUMENTS_GENERATED,
+    WorkflowStatus.DOCUMENTS_SENT,
+    WorkflowStatus.DOCUMENTS_SIGNED,
+    WorkflowStatus.SUBSCRIPTION_SENT,
+    WorkflowStatus.COMPLETED,
+]
+
+_BADGES = {
+    WorkflowStatus.CREATED: 'secondary',
+    WorkflowStatus.DER_GENERATED: 'info',
+    WorkflowStatus.DER_SENT: 'warning',
+    WorkflowStatus.DER_SIGNED: 'success',
+    WorkflowStatus.DOCUMENTS_UPLOADED: 'warning',
+    WorkflowStatus.QUESTIONNAIRE_COMPLETED: 'primary',
+    WorkflowStatus.DOCUMENTS_GENERATED: 'info',
+    WorkflowStatus.DOCUMENTS_SENT: 'warning',
+    WorkflowStatus.DOCUMENTS_SIGNED: 'success',
+    WorkflowStatus.SUBSCRIPTION_SENT: 'primary',
+    WorkflowStatus.COMPLETED: 'success',
+}
+
+_NEXT_ACTIONS = {
+    WorkflowStatus.DER_GENERATED: NextAction('send_der_signature', 'Envoyer DER en Signature', 'Envoyer DER', 'fa-paper-plane', 'primary'),
+    WorkflowStatus.DER_SENT: NextAction('confirm_der_signed', 'Confirmer Signature DER', 'Confirmer signature', 'fa-check', 'success'),
+    WorkflowStatus.DER_SIGNED: NextAction('upload_documents', 'Télécharger Documents KYC', 'Documents', 'fa-upload', 'warning'),
+    WorkflowStatus.DOCUMENTS_UPLOADED: NextAction('questionnaire', 'Compléter Questionnaire', 'Questionnaire', 'fa-clipboard-list', 'info'),
+    WorkflowStatus.QUESTIONNAIRE_COMPLETED: NextAction('generate_final_documents', 'Générer Documents Finaux', 'Générer Documents', 'fa-file-word', 'success'),
+    WorkflowStatus.DOCUMENTS_GENERATED: NextAction('send_documents_signature', 'Envoyer en Signature', 'Envoyer Signature', 'fa-paper-plane', 'primary'),
+    WorkflowStatus.DOCUMENTS_SENT: NextAction('confirm_documents_signed', 'Confirmer Signatures', 'Confirmer Signatures', 'fa-check', 'success'),
+    WorkflowStatus.DOCUMENTS_SIGNED: NextAction('send_subscription_forms', 'Envoyer Bulletins Souscription', 'Bulletins', 'fa-file-contract', 'info'),
+    WorkflowStatus.SUBSCRIPTION_SENT: NextAction('complete_workflow', 'Terminer Workflow', 'Terminer', 'fa-check', 'success'),
+}
+
+# Statuts qui valident chacune des trois premières étapes de progression (client créé, DER généré, DER signé)
+_STATUS_STEP_MEMBERS = [
+    {WorkflowStatus.CREATED, WorkflowStatus.DER_GENERATED, WorkflowStatus.DER_SENT, WorkflowStatus.DER_SIGNED,
+     WorkflowStatus.DOCUMENTS_UPLOADED, WorkflowStatus.QUESTIONNAIRE_COMPLETED, WorkflowStatus.COMPLETED},
+    {WorkflowStatus.DER_GENERATED, WorkflowStatus.DER_SENT, WorkflowStatus.DER_SIGNED,
+     WorkflowStatus.DOCUMENTS_UPLOADED, WorkflowStatus.QUESTIONNAIRE_COMPLETED, WorkflowStatus.COMPLETED},
+    {WorkflowStatus.DER_SIGNED, WorkflowStatus.DOCUMENTS_UPLOADED, WorkflowStatus.QUESTIONNAIRE_COMPLETED,
+     WorkflowStatus.COMPLETED},
+]
+
+
+def _build_steps():
+    steps = {}
+    last = len(_ORDER) - 1
+    for ordinal, status in enumerate(_ORDER):
+        steps[status] = WorkflowStep(
+            status=status,
+            ordinal=ordinal,
+            progress=round(ordinal / last * 100),
+            status_steps=sum(status in members for members in _STATUS_STEP_MEMBERS),
+            badge=_BADGES[status],
+            next_action=_NEXT_ACTIONS.get(status),
+            transitions=frozenset(_ORDER[ordinal + 1:ordinal + 2]),
+        )
+    return steps
+
+
+# Table de correspondance statut -> métadonnées, construite une seule fois au chargement
+WORKFLOW_STEPS = _build_steps()
+
+
+def workflow_step(status):
+    """Métadonnées d'un statut du workflow"""
+    return WORKFLOW_STEPS[status]
+
+
+def can_transition(client, target):
+    """Vérifie qu'un client peut passer de son statut actuel au statut cible"""
+    return target in WORKFLOW_STEPS[client.statut_workflow].transitions
+
+
+# Date de suivi renseignée sur le client lors du passage à un statut
+STATUS_DATE_FIELDS = {
+    WorkflowStatus.DER_SENT: 'date_envoi_der',
+    WorkflowStatus.DER_SIGNED: 'date_signature_der',
+    WorkflowStatus.DOCUMENTS_SENT: 'date_envoi_documents',
+    WorkflowStatus.DOCUMENTS_SIGNED: 'date_signature_documents',
+    WorkflowStatus.SUBSCRIPTION_SENT: 'date_envoi_souscription',
+}
+
+
+def apply_transition(client, target):
+    """Fait passer le client au statut cible s'il est autorisé ; retourne False sinon"""
+    if not can_transition(client, target):
+        return False
+    client.statut_workflow = target
+    date_field = STATUS_DATE_FIELDS.get(target)
+    if date_field:
+        setattr(client, date_field, datetime.utcnow())
+    return True
+
+
+def current_advisor():
+    """Conseiller à l'origine de la requête en cours (None hors requête, sans authentification
+    ou si la requête ne vient pas d'un proxy de confiance)"""
+    if not has_request_context() or not TRUSTED_PROXIES:
+        return None
+    # Pair direct : ProxyFix remplace remote_addr par X-Forwarded-For, que n'importe quel client peut envoyer
+    peer = request.environ.get('werkzeug.proxy_fix.orig', {}).get('REMOTE_ADDR', request.remote_addr)
+    try:
+        peer = ipaddress.ip_address(peer or '')
+    except ValueError:
+        return None
+    if not any(peer in network for network in TRUSTED_PROXIES):
+        return None
+    return request.headers.get(ADVISOR_HEADER)
+
+
+@event.listens_for(RoutingSession, 'before_flush')
+def _record_transitions(session, flush_context, instances):
+    """Journalise chaque changement de statut d'un client, quel que soit le code qui l'a fait"""
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Client):
+            continue
+        history = inspect(obj).attrs.statut_workflow.history
+        if history.added:
+            status, previous = history.added[0], (history.deleted[0] if history.deleted else None)
+        elif obj in session.new:
+            # Statut par défaut appliqué à l'insertion
+            status, previous = WorkflowStatus.CREATED, None
+        else:
+            continue
+        if status is None or status == previous:
+            continue
+        session.add(TransitionStatut(client=obj, statut_precedent=previous, statut=status,
+                                     date_transition=datetime.utcnow(), conseiller=current_advisor()))